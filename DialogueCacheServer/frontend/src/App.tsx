@@ -222,7 +222,7 @@ const App = observer(({ datastore }: { datastore: DataStore }) => {
 
   var gameImageHtml = null;
   if (datastore.currentBlock && datastore.currentBlock.imageUrl !== null) {
-    gameImageHtml = <img src={datastore.currentBlock.imageUrl} alt="Logo" style={logoStyle} />;
+    gameImageHtml = <img src={datastore.currentBlock.imageUrl} alt="Logo" style={logoStyle} loading="lazy" />;
   }
 
   var gameContent;
@@ -16,11 +16,39 @@ export interface GptifAlert {
   duration: number;
 }
 
+// Mirrors gptif/events.py
+export enum EventKind {
+  Narration = "n",
+  Dialogue = "d",
+  Warning = "w",
+  Image = "i",
+  PressKey = "k",
+  Goal = "g",
+}
+
+export interface OutputEvent {
+  k: EventKind;
+  t?: string;
+  s?: string;
+  p?: string;
+  i?: number;
+  j?: number;
+}
+
 export class ChatBlock {
   imageUrl: string | null = null;
+  pendingImageJobId: string | null = null;
   chatSections: string[] = [];
+
+  constructor() {
+    // Images can arrive after the block is rendered
+    makeAutoObservable(this);
+  }
 }
 
+const IMAGE_JOB_POLL_MS = 1000;
+const IMAGE_JOB_MAX_POLLS = 60;
+
 export default class DataStore {
   blocks: ChatBlock[] = [];
   maxBlockIndex: number = -1;
@@ -55,64 +83,91 @@ export default class DataStore {
     }
   }
 
-  createChatBlocksFromResponse(responseResults: any[]) {
+  renderEventText(event: OutputEvent): string {
+    var responseText = event.t === undefined ? "" : event.t;
+    if (event.s !== undefined) {
+      responseText = "[" + event.s + "]" + responseText + "[/]";
+    }
+
+    // Replace rich tags with spans
+    const acceptedTags = ["yellow", "blue", "bright_blue bold", "yellow bold", "purple", "green", "light_green", "red on black"]
+    responseText = responseText.replaceAll("[/]", "</span>")
+    acceptedTags.forEach(acceptedTag => {
+      responseText = responseText.replaceAll("[" + acceptedTag + "]", "<span class=\"game_markdown_" + acceptedTag.replaceAll(" ", "_") + "\">")
+    });
+    return Marked.parse(responseText);
+  }
+
+  createChatBlocksFromResponse(events: OutputEvent[]) {
     const chatBlocks = []
     var chatBlock = new ChatBlock();
     chatBlocks.push(chatBlock);
-    const chatSections = responseResults.map((responseResult: any[]) => {
-      var responseText = responseResult[0];
-      if (responseResult[1] !== null) {
-        //const colorHtmlMap = new Map<string, string[]>();
-        //colorHtmlMap.set("yellow", ["<span style=\"color:yellow\">", "</span>"]);
-        //const htmlResult: string[] | undefined = colorHtmlMap.get(responseResult[1]);
-        //if (htmlResult === undefined) {
-        //throw "Oops: " + responseResult[1];
-        //}
-        responseText = "[" + responseResult[1] + "]" + responseText + "[/]";
-      }
-  
-      // Replace rich tags with spans
-      const acceptedTags = ["yellow", "blue", "bright_blue bold", "yellow bold", "purple", "green", "light_green", "red on black"]
-      responseText = responseText.replaceAll("[/]", "</span>")
-      acceptedTags.forEach(acceptedTag => {
-        responseText = responseText.replaceAll("[" + acceptedTag + "]", "<span class=\"game_markdown_" + acceptedTag.replaceAll(" ", "_") + "\">")
-      });
-      if (responseText.includes("%%IMAGE%%")) {
-        return responseText;
-      }
-
-      return Marked.parse(responseText);
-    }).filter(response => response !== null) as string[];
 
-    chatSections.forEach(chatSection => {
-      if (chatSection.includes("Press enter to continue...")) {
-        chatBlock = new ChatBlock();
-        chatBlocks.push(chatBlock);
-        return;
+    events.forEach(event => {
+      switch (event.k) {
+        case EventKind.PressKey:
+          chatBlock = new ChatBlock();
+          chatBlocks.push(chatBlock);
+          break;
+        case EventKind.Image:
+          if (event.i !== undefined) {
+            const image_url = API_SERVER_BASE + "api/ai_image/" + event.i;
+            console.log("GOT IMAGE: " + image_url);
+            chatBlock.imageUrl = image_url;
+            chatBlock.pendingImageJobId = null;
+          } else if (event.j !== undefined) {
+            // The image is still being generated, show the text now and fill it in later
+            chatBlock.pendingImageJobId = String(event.j);
+          }
+          break;
+        default:
+          chatBlock.chatSections.push(this.renderEventText(event));
       }
-      if(chatSection.includes("%%IMAGE%%")) {
-        const image_id = chatSection.split(" ")[1];
-        const image_url = API_SERVER_BASE + "api/ai_image/" + image_id;
-        console.log("GOT IMAGE: " + image_url);
-        chatBlock.imageUrl = image_url;
-        return;
-      }
-      chatBlock.chatSections.push(chatSection);
     });
 
     if (chatBlocks[chatBlocks.length-1].chatSections.length === 0) {
       // Delete the last section if it is empty
       chatBlocks.pop();
     }
+    chatBlocks.forEach(block => {
+      if (block.pendingImageJobId !== null) {
+        this.pollImageJob(block, block.pendingImageJobId, IMAGE_JOB_MAX_POLLS);
+      }
+    });
     return chatBlocks;
   }
 
+  pollImageJob(chatBlock: ChatBlock, jobId: string, pollsLeft: number) {
+    if (pollsLeft <= 0) {
+      return;
+    }
+    setTimeout(() => {
+      fetchPlus(API_SERVER_BASE + "api/ai_image_job/" + jobId, {
+        credentials: 'include',
+      }, 3).then((job: any) => {
+        if (job.image_id !== null) {
+          this.setChatBlockImage(chatBlock, API_SERVER_BASE + "api/ai_image/" + job.image_id);
+        } else if (job.status === "pending" || job.status === "running") {
+          this.pollImageJob(chatBlock, jobId, pollsLeft - 1);
+        }
+      }).catch((reason: any) => {
+        console.log("IMAGE POLL FAILED");
+        console.log(reason);
+      });
+    }, IMAGE_JOB_POLL_MS);
+  }
+
+  setChatBlockImage(chatBlock: ChatBlock, imageUrl: string) {
+    chatBlock.imageUrl = imageUrl;
+    chatBlock.pendingImageJobId = null;
+  }
+
   submitNewGame() {
     console.log("STARTING NEW GAME");
     return fetchPlus(API_SERVER_BASE + "api/begin_game", {
       method: "POST",
       credentials: 'include',
-    }, 3).then((responseResults: any[]) => {
+    }, 3).then((responseResults: OutputEvent[]) => {
       const chatBlocks = this.createChatBlocksFromResponse(responseResults);
       this.newGame(chatBlocks);
       //setWaitingForAnswer(false);
@@ -128,7 +183,7 @@ export default class DataStore {
       },
       body: JSON.stringify({ "command": command }),
       credentials: 'include',
-    }, 3).then((responseResults: any[]) => {
+    }, 3).then((responseResults: OutputEvent[]) => {
       //const responseResults = await value.json();
       console.log(responseResults);
       const chatBlocks = this.createChatBlocksFromResponse(responseResults);
@@ -1,7 +1,9 @@
 # This Python file uses the following encoding: utf-8
+import os
 import sys
 
-from PySide6.QtWidgets import QApplication, QWidget
+from PySide6.QtCore import QFileSystemWatcher
+from PySide6.QtWidgets import QApplication, QPlainTextEdit, QWidget
 
 # Important:
 # You need to run the following command to generate the ui_form.py file
@@ -9,12 +11,57 @@ from PySide6.QtWidgets import QApplication, QWidget
 #     pyside2-uic form.ui -o ui_form.py
 from ui_form import Ui_Editor
 
+# GptIfEngine, which has gptif and data/
+ENGINE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ENGINE_ROOT)
+
+from gptif.lint import ERROR, ContentLinter
+
+
 class Editor(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.ui = Ui_Editor()
         self.ui.setupUi(self)
 
+        # Next to the tabs, which keep most of the width
+        self.lint_output = QPlainTextEdit(self)
+        self.lint_output.setReadOnly(True)
+        self.ui.gridLayout.addWidget(self.lint_output, 0, 1)
+        self.ui.gridLayout.setColumnStretch(0, 2)
+        self.ui.gridLayout.setColumnStretch(1, 1)
+
+        # Lint the content every time it's saved
+        self.watcher = QFileSystemWatcher(self)
+        self.watch_content()
+        self.watcher.fileChanged.connect(self.content_changed)
+        self.watcher.directoryChanged.connect(self.content_changed)
+        self.lint()
+
+    def watch_content(self):
+        data_dir = os.path.join(ENGINE_ROOT, "data")
+        paths = []
+        for directory, _, filenames in os.walk(data_dir):
+            paths.append(directory)
+            paths.extend(os.path.join(directory, filename) for filename in filenames)
+        watched = set(self.watcher.files() + self.watcher.directories())
+        new_paths = [path for path in paths if path not in watched]
+        if len(new_paths) > 0:
+            self.watcher.addPaths(new_paths)
+
+    def content_changed(self, path: str):
+        # Editors that save by replacing the file drop it from the watcher
+        self.watch_content()
+        self.lint()
+
+    def lint(self):
+        messages = ContentLinter(ENGINE_ROOT).run()
+        errors = sum(1 for message in messages if message.level == ERROR)
+        self.lint_output.setPlainText(
+            "\n".join(str(message) for message in messages)
+            + f"\n\n{errors} errors, {len(messages) - errors} warnings"
+        )
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -3,7 +3,7 @@
 ################################################################################
 ## Form generated from reading UI file 'form.ui'
 ##
-## Created by: Qt User Interface Compiler version 6.5.0
+## Created by: Qt User Interface Compiler version 6.12.0
 ##
 ## WARNING! All changes made in this file will be lost when recompiling UI file!
 ################################################################################
@@ -15,34 +15,77 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QAbstractScrollArea, QApplication, QPushButton, QScrollArea,
-    QSizePolicy, QWidget)
+from PySide6.QtWidgets import (QApplication, QFormLayout, QFrame, QGridLayout,
+    QHBoxLayout, QLabel, QLineEdit, QListView,
+    QSizePolicy, QTabWidget, QWidget)
 
 class Ui_Editor(object):
     def setupUi(self, Editor):
         if not Editor.objectName():
             Editor.setObjectName(u"Editor")
         Editor.resize(1280, 720)
-        self.scrollArea = QScrollArea(Editor)
-        self.scrollArea.setObjectName(u"scrollArea")
-        self.scrollArea.setGeometry(QRect(70, 70, 411, 371))
-        self.scrollArea.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.scrollArea.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.scrollArea.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-        self.scrollArea.setWidgetResizable(True)
-        self.scrollAreaWidgetContents = QWidget()
-        self.scrollAreaWidgetContents.setObjectName(u"scrollAreaWidgetContents")
-        self.scrollAreaWidgetContents.setGeometry(QRect(0, 0, 500, 500))
-        sizePolicy = QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        sizePolicy.setHorizontalStretch(0)
-        sizePolicy.setVerticalStretch(0)
-        sizePolicy.setHeightForWidth(self.scrollAreaWidgetContents.sizePolicy().hasHeightForWidth())
-        self.scrollAreaWidgetContents.setSizePolicy(sizePolicy)
-        self.scrollAreaWidgetContents.setMinimumSize(QSize(500, 500))
-        self.pushButton = QPushButton(self.scrollAreaWidgetContents)
-        self.pushButton.setObjectName(u"pushButton")
-        self.pushButton.setGeometry(QRect(350, 300, 89, 25))
-        self.scrollArea.setWidget(self.scrollAreaWidgetContents)
+        self.gridLayout = QGridLayout(Editor)
+        self.gridLayout.setObjectName(u"gridLayout")
+        self.tabWidget = QTabWidget(Editor)
+        self.tabWidget.setObjectName(u"tabWidget")
+        self.room_tab = QWidget()
+        self.room_tab.setObjectName(u"room_tab")
+        self.horizontalLayout_3 = QHBoxLayout(self.room_tab)
+        self.horizontalLayout_3.setObjectName(u"horizontalLayout_3")
+        self.room_id_list_view = QListView(self.room_tab)
+        self.room_id_list_view.setObjectName(u"room_id_list_view")
+
+        self.horizontalLayout_3.addWidget(self.room_id_list_view)
+
+        self.line = QFrame(self.room_tab)
+        self.line.setObjectName(u"line")
+        self.line.setFrameShape(QFrame.Shape.VLine)
+        self.line.setFrameShadow(QFrame.Shadow.Sunken)
+
+        self.horizontalLayout_3.addWidget(self.line)
+
+        self.room_details = QWidget(self.room_tab)
+        self.room_details.setObjectName(u"room_details")
+        self.formLayout = QFormLayout(self.room_details)
+        self.formLayout.setObjectName(u"formLayout")
+        self.id_label = QLabel(self.room_details)
+        self.id_label.setObjectName(u"id_label")
+
+        self.formLayout.setWidget(0, QFormLayout.ItemRole.LabelRole, self.id_label)
+
+        self.id_edit = QLineEdit(self.room_details)
+        self.id_edit.setObjectName(u"id_edit")
+
+        self.formLayout.setWidget(0, QFormLayout.ItemRole.FieldRole, self.id_edit)
+
+        self.label = QLabel(self.room_details)
+        self.label.setObjectName(u"label")
+
+        self.formLayout.setWidget(1, QFormLayout.ItemRole.LabelRole, self.label)
+
+        self.title_edit = QLineEdit(self.room_details)
+        self.title_edit.setObjectName(u"title_edit")
+
+        self.formLayout.setWidget(1, QFormLayout.ItemRole.FieldRole, self.title_edit)
+
+        self.label_2 = QLabel(self.room_details)
+        self.label_2.setObjectName(u"label_2")
+
+        self.formLayout.setWidget(2, QFormLayout.ItemRole.LabelRole, self.label_2)
+
+
+        self.horizontalLayout_3.addWidget(self.room_details)
+
+        self.tabWidget.addTab(self.room_tab, "")
+        self.line.raise_()
+        self.room_id_list_view.raise_()
+        self.room_details.raise_()
+        self.scenery_tab = QWidget()
+        self.scenery_tab.setObjectName(u"scenery_tab")
+        self.tabWidget.addTab(self.scenery_tab, "")
+
+        self.gridLayout.addWidget(self.tabWidget, 0, 0, 1, 1)
+
 
         self.retranslateUi(Editor)
 
@@ -51,6 +94,10 @@ class Ui_Editor(object):
 
     def retranslateUi(self, Editor):
         Editor.setWindowTitle(QCoreApplication.translate("Editor", u"Editor", None))
-        self.pushButton.setText(QCoreApplication.translate("Editor", u"PushButton", None))
+        self.id_label.setText(QCoreApplication.translate("Editor", u"ID", None))
+        self.label.setText(QCoreApplication.translate("Editor", u"Title", None))
+        self.label_2.setText(QCoreApplication.translate("Editor", u"North", None))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.room_tab), QCoreApplication.translate("Editor", u"Rooms", None))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.scenery_tab), QCoreApplication.translate("Editor", u"Scenery", None))
     # retranslateUi
 
@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import gptif.settings
+from gptif.console import console
+
+# climage and PIL are imported where they are used, they are slow to import
+
+# Rendered images kept in memory, a few rooms' and agents' worth
+MEMORY_CACHE_MAX_ENTRIES = 64
+
+# Images are shrunk to this many times the output width before climage resizes
+# them the rest of the way, so the final resample still has pixels to average
+PRESCALE_FACTOR = 2
+
+
+@functools.lru_cache(maxsize=None)
+def terminal_color_type() -> str:
+    """The richest color mode the terminal supports, detected once per process."""
+    colorterm = os.environ.get("COLORTERM", "").lower()
+    if colorterm in ("truecolor", "24bit"):
+        return "truecolor"
+    term = os.environ.get("TERM", "").lower()
+    if term in ("linux", "vt100") or term.startswith("xterm-color"):
+        return "color16"
+    return "color256"
+
+
+class AnsiRenderCache:
+    """Images rendered as ANSI text, in memory and on disk.
+
+    Keyed by the image bytes, output width, color mode and palette, so a room's
+    image is only decoded and converted the first time it is shown.
+    """
+
+    def __init__(self, cache_dir: Optional[str]):
+        self.cache_dir = (
+            None if cache_dir is None else os.path.expanduser(cache_dir)
+        )
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def key(self, image_data_bytes: bytes, width: int, color_type: str, palette: str) -> str:
+        image_hash = hashlib.sha256(image_data_bytes).hexdigest()
+        return f"{image_hash}-{width}-{color_type}-{palette}"
+
+    def _path(self, key: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, key + ".ansi")
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            output = self.entries.get(key)
+            if output is not None:
+                self.entries.move_to_end(key)
+                return output
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                output = f.read()
+        except OSError as ex:
+            console.debug("Could not read cached image", path, ex)
+            return None
+        self._remember(key, output)
+        return output
+
+    def put(self, key: str, output: str):
+        self._remember(key, output)
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so another process never reads half an image
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(output)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            console.debug("Could not cache image", path, ex)
+
+    def _remember(self, key: str, output: str):
+        with self.lock:
+            self.entries[key] = output
+            self.entries.move_to_end(key)
+            while len(self.entries) > MEMORY_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+
+def render_ansi(image_data_bytes: bytes, width: int, color_type: str, palette: str) -> str:
+    from climage.__main__ import _color_types, _toAnsi
+    from PIL import Image
+
+    im = Image.open(io.BytesIO(image_data_bytes))
+    target_size = (width * PRESCALE_FACTOR, im.height * width * PRESCALE_FACTOR // im.width)
+    # Lets JPEGs decode at a fraction of their size, a no-op for other formats
+    im.draft("RGB", target_size)
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    im.thumbnail(target_size)
+    return _toAnsi(
+        im,
+        oWidth=width,
+        is_unicode=True,
+        color_type=getattr(_color_types, color_type),
+        palette=palette,
+    )
+
+
+ansi_render_cache: Optional[AnsiRenderCache] = None
+
+
+def get_ansi_render_cache() -> AnsiRenderCache:
+    global ansi_render_cache
+    if ansi_render_cache is None:
+        ansi_render_cache = AnsiRenderCache(gptif.settings.ANSI_CACHE_DIR)
+    return ansi_render_cache
+
+
+def image_to_ansi(image_data_bytes: bytes, width: int = 80, palette: str = "default") -> str:
+    color_type = terminal_color_type()
+    cache = get_ansi_render_cache()
+    key = cache.key(image_data_bytes, width, color_type, palette)
+    output = cache.get(key)
+    if output is None:
+        output = render_ansi(image_data_bytes, width, color_type, palette)
+        cache.put(key, output)
+    return output
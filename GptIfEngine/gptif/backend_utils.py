@@ -1,6 +1,67 @@
 from aws_lambda_powertools import Logger, Metrics
-from aws_lambda_powertools.metrics import MetricUnit  # noqa: F401
+from aws_lambda_powertools.metrics import MetricUnit, single_metric  # noqa: F401
 
+from gptif.profiling import RequestProfile, aggregate_samples, samples_by_verb
 
 logger: Logger = Logger()
 metrics: Metrics = Metrics()
+
+
+def emit_speculation_metrics():
+    from gptif.speculation import speculation_engine
+
+    if speculation_engine is None:
+        return
+    # e.g. already_warm -> SpeculationAlreadyWarm
+    for name, count in speculation_engine.drain_stats().items():
+        metrics.add_metric(
+            name="Speculation" + name.title().replace("_", ""),
+            unit=MetricUnit.Count,
+            value=count,
+        )
+
+
+def emit_semantic_cache_metrics():
+    from gptif.semantic_cache import semantic_cache
+
+    if semantic_cache is None:
+        return
+    # hit -> SemanticCacheHit, miss -> SemanticCacheMiss
+    for name, count in semantic_cache.drain_stats().items():
+        metrics.add_metric(
+            name="SemanticCache" + name.title(), unit=MetricUnit.Count, value=count
+        )
+
+
+def emit_profile_metrics(verb: str, profile: RequestProfile):
+    # One metric per phase, dimensioned by verb so CloudWatch can aggregate them.
+    # Metrics without a namespace can't be serialized (e.g. when running locally).
+    for phase_name, seconds in list(profile.phase_seconds.items()) + [
+        ("total", profile.total_seconds)
+    ]:
+        if metrics.namespace is None:
+            break
+        with single_metric(
+            name=f"HandleInput_{phase_name}",
+            unit=MetricUnit.Milliseconds,
+            value=seconds * 1000.0,
+            namespace=metrics.namespace,
+            default_dimensions={"verb": verb},
+        ):
+            pass
+
+    if profile.sampler is not None:
+        aggregate_samples(verb, profile)
+        logger.info(
+            "Sampled profile",
+            extra={
+                "verb": verb,
+                "top_samples": profile.top_samples(),
+                "top_samples_for_verb": [
+                    (f"{filename}:{function}:{lineno}", count)
+                    for (filename, function, lineno), count in samples_by_verb[
+                        verb
+                    ].most_common(10)
+                ],
+            },
+        )
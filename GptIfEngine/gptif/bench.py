@@ -0,0 +1,308 @@
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import click
+
+import gptif.llm
+import gptif.settings
+from gptif.console import DEBUG_INPUT, console
+from gptif.profiling import LLM, SAVE, WORLD_LOAD, phase, profile_request, timed
+
+BENCH_MODEL_VERSION = "bench_stub"
+BENCH_SESSION_ID = "bench"
+
+# Differences smaller than this are noise, no matter the relative change
+MIN_REGRESSION_MS = 1.0
+
+
+class StubLanguageModel:
+    """Deterministic stand-in for the LLM: the answer only depends on the prompt."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def model_name(self):
+        return BENCH_MODEL_VERSION
+
+    @timed(LLM)
+    def llm(
+        self,
+        question: str,
+        stop: Optional[List[str]] = None,
+        echo: bool = False,
+        prefix: Optional[str] = None,
+    ) -> str:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if question.startswith("Answer questions about the following statement"):
+            # Friend checks always pass so scripted playthroughs advance the story
+            return "Yes"
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()[:8]
+        return f"I'd rather not say. ({digest})"
+
+
+def _generate_image_stub(prompt: str) -> Optional[bytes]:
+    return b"bench:" + hashlib.sha1(prompt.encode("utf-8")).digest()
+
+
+def load_script(script: Optional[str]) -> List[str]:
+    if script is None:
+        return list(DEBUG_INPUT)
+    commands = []
+    with open(script, "r") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            commands.append(line)
+    return commands
+
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = max(0, math.ceil(p / 100.0 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if len(values) > 0 else 0.0,
+        "total": sum(values),
+    }
+
+
+def _drain_image_jobs():
+    # Stands in for a warm image worker: images are ready by the next command
+    from gptif.db import claim_next_ai_image_job
+    from gptif.image_queue import process_job
+
+    while True:
+        job = claim_next_ai_image_job()
+        if job is None:
+            return
+        process_job(job)
+
+
+def replay(commands: List[str], allocations: bool) -> Dict[str, Any]:
+    from gptif.db import GameState, push_game_command
+    from gptif.handle_input import command_verb, handle_input
+    from gptif.world import World
+
+    random.seed(0)
+    game_state = GameState(session_id=BENCH_SESSION_ID)  # type: ignore
+    with console.capture(BENCH_SESSION_ID):
+        world = World()
+        world.start_chapter_one()
+        world.save(game_state)
+    _drain_image_jobs()
+
+    latencies_ms: List[float] = []
+    latencies_by_verb: Dict[str, List[float]] = defaultdict(list)
+    phases_ms: Dict[str, List[float]] = defaultdict(list)
+    allocated_kb: List[float] = []
+    slowest: List[Dict[str, Any]] = []
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for command in commands:
+        if allocations:
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        # Mirror the server: every command reloads and saves the world
+        with console.capture(BENCH_SESSION_ID), profile_request() as profile:
+            with phase(WORLD_LOAD):
+                world = World()
+                assert world.load(game_state)
+            handle_input(world, command)
+            with phase(SAVE):
+                push_game_command(BENCH_SESSION_ID, command)
+                world.save(game_state)
+        if allocations:
+            allocated_kb.append(
+                (tracemalloc.get_traced_memory()[1] - allocated_before) / 1024.0
+            )
+        latency_ms = profile.total_seconds * 1000.0
+        latencies_ms.append(latency_ms)
+        latencies_by_verb[command_verb(command)].append(latency_ms)
+        for phase_name, seconds in profile.phase_seconds.items():
+            phases_ms[phase_name].append(seconds * 1000.0)
+        slowest.append({"command": command, "ms": latency_ms})
+        _drain_image_jobs()
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    results: Dict[str, Any] = {
+        "commands": len(commands),
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "latency_ms": summarize(latencies_ms),
+        "verbs": {
+            verb: summarize(values) for verb, values in sorted(latencies_by_verb.items())
+        },
+        "phases_ms": {
+            phase_name: summarize(values)
+            for phase_name, values in sorted(phases_ms.items())
+        },
+        "slowest": sorted(slowest, key=lambda x: -x["ms"])[:5],
+    }
+    if allocations:
+        results["allocations_kb"] = summarize(allocated_kb)
+    return results
+
+
+def comparable_metrics(results: Dict[str, Any]) -> Dict[str, float]:
+    """Flattens the results into the metrics that are checked against a baseline."""
+    metrics = {
+        "latency_ms.p50": results["latency_ms"]["p50"],
+        "latency_ms.p95": results["latency_ms"]["p95"],
+        "cpu_ms": results["cpu_seconds"] * 1000.0,
+    }
+    for phase_name, summary in results["phases_ms"].items():
+        metrics[f"phases_ms.{phase_name}.p95"] = summary["p95"]
+    for verb, summary in results["verbs"].items():
+        metrics[f"verbs.{verb}.p50"] = summary["p50"]
+    if "allocations_kb" in results:
+        metrics["allocations_kb.p95"] = results["allocations_kb"]["p95"]
+    return metrics
+
+
+def find_regressions(
+    baseline: Dict[str, Any], results: Dict[str, Any], tolerance: float
+) -> List[str]:
+    regressions = []
+    old_metrics = comparable_metrics(baseline)
+    for name, new_value in comparable_metrics(results).items():
+        old_value = old_metrics.get(name)
+        if old_value is None:
+            continue
+        # Allocations aren't milliseconds, but the same noise floor works for KB
+        if new_value > old_value * (1.0 + tolerance) and (
+            new_value - old_value > MIN_REGRESSION_MS
+        ):
+            regressions.append(
+                f"{name}: {old_value:.2f} -> {new_value:.2f} (+{(new_value / max(old_value, 1e-9) - 1.0) * 100.0:.0f}%)"
+            )
+    return regressions
+
+
+def print_results(results: Dict[str, Any]):
+    latency = results["latency_ms"]
+    print(
+        f"{results['commands']} commands in {results['wall_seconds']:.2f}s wall, {results['cpu_seconds']:.2f}s cpu"
+    )
+    print(
+        f"latency ms: p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  max {latency['max']:.1f}"
+    )
+    print("phases (ms):")
+    for phase_name, summary in results["phases_ms"].items():
+        print(
+            f"  {phase_name:<12} p50 {summary['p50']:8.2f}  p95 {summary['p95']:8.2f}  total {summary['total']:9.1f}"
+        )
+    print("verbs (ms):")
+    for verb, summary in results["verbs"].items():
+        print(
+            f"  {verb:<12} n={summary['count']:<4} p50 {summary['p50']:8.2f}  p95 {summary['p95']:8.2f}"
+        )
+    if "allocations_kb" in results:
+        allocations = results["allocations_kb"]
+        print(
+            f"peak allocations per command (KB): p50 {allocations['p50']:.0f}  p95 {allocations['p95']:.0f}  max {allocations['max']:.0f}"
+        )
+    print("slowest commands:")
+    for entry in results["slowest"]:
+        print(f"  {entry['ms']:8.1f}ms  {entry['command']}")
+
+
+@click.command()
+@click.option("--script", default=None, help="File with one command per line")
+@click.option("--baseline", default=None, help="Baseline JSON to compare against")
+@click.option("--write-baseline", default=None, help="Write the results to this file")
+@click.option("--tolerance", default=0.2, help="Allowed relative slowdown")
+@click.option("--allocations", default=False, is_flag=True)
+@click.option("--warmup/--no-warmup", default=True)
+@click.option("--llm-latency", default=0.0, help="Seconds the stub LLM sleeps")
+@click.option(
+    "--cassette", default=None, help="Replay LLM and image responses from a fixture file"
+)
+@click.option("--fixture-latency", default="none", help="See gptif.fixtures.LatencyModel")
+def bench(
+    script: Optional[str],
+    baseline: Optional[str],
+    write_baseline: Optional[str],
+    tolerance: float,
+    allocations: bool,
+    warmup: bool,
+    llm_latency: float,
+    cassette: Optional[str],
+    fixture_latency: str,
+):
+    commands = load_script(script)
+
+    os.environ["SQL_URL"] = "sqlite:///" + tempfile.mkdtemp(prefix="gptif_bench")
+    gptif.settings.CLI_MODE = False
+    gptif.settings.RUN_LOCALLY = True
+    gptif.settings.CONVERSE_SERVER = None
+
+    from gptif.cl_image import register_image_generator
+    from gptif.db import create_db_and_tables
+
+    if cassette is not None:
+        from gptif.fixtures import REPLAY, configure_fixtures
+
+        configure_fixtures(cassette, REPLAY, fixture_latency, seed=0)
+    else:
+        gptif.settings.IMAGE_MODEL_VERSION = BENCH_MODEL_VERSION
+        gptif.llm.set_llm(StubLanguageModel(llm_latency))
+        register_image_generator(BENCH_MODEL_VERSION, _generate_image_stub)
+    create_db_and_tables()
+
+    # The image code prints every prompt, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if warmup:
+            # Fills the dialogue and image caches and warms up imports
+            replay(commands, False)
+
+        if allocations:
+            tracemalloc.start()
+        results = replay(commands, allocations)
+        if allocations:
+            tracemalloc.stop()
+
+    print_results(results)
+
+    if write_baseline is not None:
+        with open(write_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        with open(baseline, "r") as f:
+            baseline_results = json.load(f)
+        regressions = find_regressions(baseline_results, results, tolerance)
+        if len(regressions) > 0:
+            print("REGRESSIONS:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against", baseline)
+
+
+if __name__ == "__main__":
+    bench()
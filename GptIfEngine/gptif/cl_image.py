@@ -1,23 +1,24 @@
-from typing import Optional
+from typing import Callable, Deque, Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()  # take environment variables from .env.
 
 import base64
-import io
-
-import openai
-import requests
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import os
 
+# openai, requests, PIL and climage are imported where they are used, they are slow
+# to import and most processes (e.g. the lambda) only need a few of them
 stage = os.environ.get("STAGE", None)
-if stage is None:
-    from climage.__main__ import _get_color_type, _toAnsi
-    from PIL import Image
 
 import gptif.settings
 from gptif.console import console
+from gptif.profiling import IMAGE, timed
+from gptif.speculation import IMAGE_KIND, record_use
 from gptif.db import (
     AiImage,
     get_ai_image_from_id,
@@ -26,16 +27,15 @@ from gptif.db import (
 )
 
 
+def portrait_prompt(description: str) -> str:
+    return "Portrait of character with description: " + description
+
+
 def display_image(image_data_bytes: bytes):
     if stage is None:
-        im = Image.open(io.BytesIO(image_data_bytes))
-        ctype = _get_color_type(
-            is_truecolor=False, is_256color=True, is_16color=False, is_8color=False
-        )
-        output = _toAnsi(
-            im, oWidth=80, is_unicode=True, color_type=ctype, palette="default"
-        )
-        print(output)
+        from gptif.ansi_images import image_to_ansi
+
+        print(image_to_ansi(image_data_bytes, width=80, palette="default"))
 
 
 def _generate_image_openai(prompt: str) -> Optional[bytes]:
@@ -48,6 +48,7 @@ def _generate_image_openai(prompt: str) -> Optional[bytes]:
             n=1,
             size="512x512",
             response_format="b64_json",
+            request_timeout=gptif.settings.IMAGE_PROVIDER_TIMEOUT_SECONDS,
         )
 
         image_data_b64 = response["data"][0]["b64_json"]
@@ -122,7 +123,16 @@ def _generate_image_sd_hf(prompt: str) -> Optional[bytes]:
     headers = {"Authorization": f"Bearer {HF_KEY}"}
 
     def query(payload):
-        response = requests.post(API_URL, headers=headers, json=payload)
+        response = requests.post(
+            API_URL,
+            headers=headers,
+            json=payload,
+            timeout=gptif.settings.IMAGE_PROVIDER_TIMEOUT_SECONDS,
+        )
+        if response.status_code != 200:
+            # Errors come back as a json body, not an image
+            console.debug("HUGGING FACE ERROR", response.content)
+            return None
         return response.content
 
     image_bytes = query(
@@ -134,17 +144,131 @@ def _generate_image_sd_hf(prompt: str) -> Optional[bytes]:
     return image_bytes
 
 
+class ProviderStats:
+    # Too few samples to trust the percentiles, fall back to the configured budget
+    MIN_SAMPLES = 5
+
+    def __init__(self, window: int = 50):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, success: bool):
+        with self.lock:
+            self.outcomes.append(success)
+            if success:
+                self.latencies.append(latency)
+
+    def p95(self) -> Optional[float]:
+        with self.lock:
+            if len(self.latencies) < ProviderStats.MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if len(self.outcomes) < ProviderStats.MIN_SAMPLES:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+
+provider_stats: Dict[str, ProviderStats] = {}
+
+
+def _stats_for(generator: Callable[[str], Optional[bytes]]) -> ProviderStats:
+    return provider_stats.setdefault(generator.__name__, ProviderStats())
+
+
+def _hedge_delay(generator: Callable[[str], Optional[bytes]]) -> float:
+    stats = _stats_for(generator)
+    if stats.error_rate() > gptif.settings.IMAGE_HEDGE_MAX_ERROR_RATE:
+        # The provider is probably down, don't wait on it before trying the next one
+        return 0.0
+    p95 = stats.p95()
+    if p95 is None:
+        return gptif.settings.IMAGE_HEDGE_DELAY_SECONDS
+    return min(p95, gptif.settings.IMAGE_HEDGE_DELAY_SECONDS)
+
+
+def _timed_generate(
+    generator: Callable[[str], Optional[bytes]], prompt: str
+) -> Optional[bytes]:
+    start_time = time.monotonic()
+    try:
+        result = generator(prompt)
+    except Exception as ex:
+        console.debug(ex)
+        result = None
+    _stats_for(generator).record(time.monotonic() - start_time, result is not None)
+    return result
+
+
+def _generate_image_hedged(
+    prompt: str, generators: List[Callable[[str], Optional[bytes]]]
+) -> Optional[bytes]:
+    remaining = list(generators)
+    executor = ThreadPoolExecutor(max_workers=len(generators))
+    pending: Dict[Future, Callable[[str], Optional[bytes]]] = {}
+    deadline = time.monotonic() + gptif.settings.IMAGE_PROVIDER_TIMEOUT_SECONDS
+
+    def launch_next() -> float:
+        generator = remaining.pop(0)
+        pending[executor.submit(_timed_generate, generator, prompt)] = generator
+        return time.monotonic() + _hedge_delay(generator)
+
+    try:
+        hedge_at = launch_next()
+        while len(pending) > 0:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if len(remaining) > 0:
+                timeout = max(0.0, min(timeout, hedge_at - now))
+            done, _ = wait(list(pending.keys()), timeout, FIRST_COMPLETED)
+            for future in done:
+                generator = pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    console.debug("Image generated by", generator.__name__)
+                    return result
+            if len(remaining) > 0 and (
+                len(pending) == 0 or time.monotonic() >= hedge_at
+            ):
+                # The last provider failed or is slower than usual, hedge with the next one
+                hedge_at = launch_next()
+        return None
+    finally:
+        # Providers that already started can't be interrupted, their results are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Extra image backends keyed by model version (e.g. the benchmark's stub)
+image_generators: Dict[str, Callable[[str], Optional[bytes]]] = {}
+
+
+def register_image_generator(
+    model_version: str, generator: Callable[[str], Optional[bytes]]
+):
+    image_generators[model_version] = generator
+
+
 def generate_image(query: AiImage) -> Optional[bytes]:
     prompt = query.prompt
     print("GENERATE IMAGE WITH", query.model_version)
     print(prompt)
 
+    if query.model_version in image_generators:
+        return image_generators[query.model_version](prompt)
     if query.model_version == "dalle_with_waterfall":
         generators = [
             _generate_image_openai,
             _generate_image_stability,
             _generate_image_sd_hf,
         ]
+        if gptif.settings.IMAGE_HEDGING:
+            return _generate_image_hedged(prompt, generators)
         for g in generators:
             result = g(prompt)
             if result is not None:
@@ -160,12 +284,54 @@ def generate_image(query: AiImage) -> Optional[bytes]:
         raise NotImplementedError(f"Invalid model type: {query.model_version}")
 
 
+def warm_image(prompt: str) -> bool:
+    """Gets the image for the prompt generated without showing it, after the images
+    players are waiting for.  Returns whether it had to be generated (or requested)."""
+    from gptif.image_queue import SPECULATIVE_PRIORITY
+
+    query = AiImage(model_version=gptif.settings.IMAGE_MODEL_VERSION, prompt=prompt)
+    if gptif.settings.CONVERSE_SERVER is not None:
+        from gptif.image_cache import get_local_image_cache
+
+        image_cache = get_local_image_cache()
+        if image_cache.get_image_id(query) is not None:
+            return False
+        image_id = image_cache.fetch_image_id(query, SPECULATIVE_PRIORITY)
+        if image_id is not None and gptif.settings.CLI_MODE:
+            image_cache.fetch_image(image_id)
+        return True
+    if not gptif.settings.CLI_MODE:
+        from gptif.image_queue import request_image
+
+        ai_image_id, _ = request_image(prompt, query.model_version, SPECULATIVE_PRIORITY)
+        return ai_image_id is None
+    if get_ai_image_if_cached(query) is not None:
+        return False
+    query.result = generate_image(query)
+    put_ai_image_in_cache(query)
+    return True
+
+
+@timed(IMAGE)
 def display_image_for_prompt(prompt: str):
     print("DISPLAYING IMAGE FOR PROMPT", prompt)
+    record_use(IMAGE_KIND, prompt)
     # if gptif.settings.DEBUG_MODE == True:
     # return
-    query = AiImage(model_version="dalle_with_waterfall", prompt=prompt)
+    query = AiImage(model_version=gptif.settings.IMAGE_MODEL_VERSION, prompt=prompt)
     if gptif.settings.CONVERSE_SERVER is None:
+        if not gptif.settings.CLI_MODE:
+            # Don't make the turn wait on the image, the client polls for it
+            from gptif.image_queue import request_image
+
+            ai_image_id, job = request_image(prompt, query.model_version)
+            if ai_image_id is not None:
+                console.image(image_id=ai_image_id)
+            else:
+                assert job is not None
+                console.image(job_id=job.id)
+            return
+
         ai_image = get_ai_image_if_cached(query)
         if ai_image is None:
             image_data_bytes = generate_image(query)
@@ -181,9 +347,6 @@ def display_image_for_prompt(prompt: str):
 
         if ai_image_id is None:
             return
-        if not gptif.settings.CLI_MODE:
-            console.print(f"%%IMAGE%% {ai_image_id}")
-            return
 
         ai_image = get_ai_image_from_id(ai_image_id)
 
@@ -192,36 +355,22 @@ def display_image_for_prompt(prompt: str):
             display_image(ai_image.result)
 
     else:
-        response = requests.post(
-            f"{gptif.settings.CONVERSE_SERVER}/fetch_image_id_for_caption",
-            json=query.dict(),
-        )
-
-        console.debug("RESPONSE", response)
-        console.debug(response.content)
-
-        # TODO: More gracefully handle errors
-        assert response.status_code == 200
+        from gptif.image_cache import get_image_prefetcher, get_local_image_cache
 
-        if response.content is not None:
-            image_id = int(response.content.decode().strip('"'))
+        # The image may already be on its way
+        get_image_prefetcher().wait_for(query)
 
-            response = requests.get(
-                f"{gptif.settings.CONVERSE_SERVER}/ai_image/{image_id}"
-            )
-
-            # TODO: More gracefully handle errors
-            assert response.status_code == 200
-
-            # print(response.content)
-            if not gptif.settings.CLI_MODE:
-                console.print(f"%%IMAGE%% {image_id}")
-                return
+        image_cache = get_local_image_cache()
+        image_id = image_cache.fetch_image_id(query)
+        if image_id is None:
+            console.debug("Image generation failed for prompt", prompt)
+            return
 
-            # image_data_b64 = response["data"][0]["b64_json"]
-            # image_data_bytes = base64.b64decode(image_data_b64)
+        if not gptif.settings.CLI_MODE:
+            console.image(image_id=image_id)
+            return
 
-            display_image(response.content)
+        display_image(image_cache.fetch_image(image_id))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from gptif.state import World
+
+# Offered at the start of a command, whatever the room
+COMMAND_VERBS = (
+    "LOOK AT",
+    "LOOK",
+    "GO",
+    "TELL",
+    "ASK",
+    "PERSUADE",
+    "WAIT",
+    "INVENTORY",
+    "GOAL",
+    "HELP",
+)
+
+# Verbs whose object is a person
+AGENT_VERBS = ("TELL", "ASK", "PERSUADE")
+
+# Verbs whose object is a direction
+EXIT_VERBS = ("GO",)
+
+
+@dataclass
+class TrieNode:
+    children: Dict[str, TrieNode] = field(default_factory=dict)
+    # The term as it's displayed, if a term ends here
+    term: Optional[str] = None
+
+
+class PrefixTrie:
+    """Case insensitive prefix search over a set of terms."""
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.size = 0
+
+    def insert(self, term: str):
+        node = self.root
+        for c in term.casefold():
+            node = node.children.setdefault(c, TrieNode())
+        if node.term is None:
+            self.size += 1
+        node.term = term
+
+    def remove(self, term: str):
+        path: List[Tuple[TrieNode, str]] = []
+        node = self.root
+        for c in term.casefold():
+            child = node.children.get(c)
+            if child is None:
+                return
+            path.append((node, c))
+            node = child
+        if node.term is None:
+            return
+        node.term = None
+        self.size -= 1
+        # Prune the branch that only led to this term
+        for parent, c in reversed(path):
+            child = parent.children[c]
+            if child.term is not None or len(child.children) > 0:
+                break
+            del parent.children[c]
+
+    def _terms_under(self, node: TrieNode) -> Iterator[str]:
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.term is not None:
+                yield node.term
+            # Reversed so terms come out in alphabetical order
+            stack.extend(node.children[c] for c in sorted(node.children, reverse=True))
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        node = self.root
+        for c in prefix.casefold():
+            child = node.children.get(c)
+            if child is None:
+                return []
+            node = child
+        completions = []
+        for term in self._terms_under(node):
+            completions.append(term)
+            if len(completions) >= limit:
+                break
+        return completions
+
+
+def _build_verb_trie() -> PrefixTrie:
+    trie = PrefixTrie()
+    for verb in COMMAND_VERBS:
+        trie.insert(verb)
+    return trie
+
+
+class CompletionService:
+    """Completes commands from what's in the player's current room.
+
+    update() diffs the room's terms against the last update, so moving around
+    only touches the tries for what changed.
+    """
+
+    verb_trie = _build_verb_trie()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tries: Dict[str, PrefixTrie] = {
+            "verbs": PrefixTrie(),
+            "exits": PrefixTrie(),
+            "agents": PrefixTrie(),
+            "scenery": PrefixTrie(),
+        }
+        self.terms: Dict[str, Set[str]] = {kind: set() for kind in self.tries}
+
+    def room_terms(self, world: World) -> Dict[str, Set[str]]:
+        room = world.current_room
+        terms: Dict[str, Set[str]] = {
+            "verbs": set(),
+            "exits": set(
+                direction.upper()
+                for direction, exit in room.exits.items()
+                if world.exit_visible(exit)
+            ),
+            "agents": set(),
+            "scenery": set(),
+        }
+        for agent in world.agents_in_room:
+            terms["agents"].add(agent.name)
+            terms["agents"].add(agent.name.split(" ")[0])
+        for scenery in room.scenery:
+            terms["scenery"].update(scenery.hints)
+            terms["verbs"].update(action.upper() for action in scenery.actions.keys())
+        return terms
+
+    def update(self, world: World):
+        new_terms = self.room_terms(world)
+        with self.lock:
+            for kind, trie in self.tries.items():
+                for term in self.terms[kind] - new_terms[kind]:
+                    trie.remove(term)
+                for term in new_terms[kind] - self.terms[kind]:
+                    trie.insert(term)
+            self.terms = new_terms
+
+    def complete(self, line: str, limit: int = 10) -> List[str]:
+        """Whole command lines that start with line."""
+        line = line.lstrip()
+        with self.lock:
+            if " " not in line:
+                # Exits work as commands on their own
+                candidates = (
+                    self.verb_trie.complete(line, limit)
+                    + self.tries["verbs"].complete(line, limit)
+                    + self.tries["exits"].complete(line, limit)
+                )
+                return list(dict.fromkeys(candidates))[:limit]
+
+            if '"' in line:
+                # Free text
+                return []
+            verb, object_kinds = self._split_verb(line)
+            head, object_prefix = line[: len(verb)], line[len(verb) :].lstrip()
+            completions = []
+            for kind in object_kinds:
+                completions.extend(
+                    f"{head} {term}"
+                    for term in self.tries[kind].complete(object_prefix, limit)
+                )
+            return completions[:limit]
+
+    def _split_verb(self, line: str) -> Tuple[str, Tuple[str, ...]]:
+        folded = line.casefold()
+        if folded.startswith("look at "):
+            return line[: len("look at")], ("agents", "scenery")
+        verb = line.split(" ")[0]
+        if verb.upper() in AGENT_VERBS:
+            return verb, ("agents",)
+        if verb.upper() in EXIT_VERBS:
+            return verb, ("exits",)
+        return verb, ("agents", "scenery")
@@ -1,11 +1,14 @@
+import contextlib
 import contextvars
-from typing import Any, Dict, List, Optional, Tuple, cast
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
 from rich.markdown import Markdown
 
 
 from rich.console import Console
 
 import gptif.settings
+from gptif.events import EventKind, OutputEvent
 
 DEBUG_INPUT = [
     'ASK Juan "Where are you from?"',  #
@@ -120,13 +123,96 @@ DEBUG_INPUT = [
 
 session_id_contextvar = contextvars.ContextVar("session_id", default="")
 
+logger = logging.getLogger(__name__)
+
+
+class OutputSink:
+    """Collects the output of a single request instead of printing it."""
+
+    def __init__(self, max_bytes: int):
+        self.entries: List[OutputEvent] = []
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.truncated = False
+        self.step_mode = False
+        self.enqueue_press_key = False
+
+    def append(self, event: OutputEvent):
+        if self.truncated:
+            return
+        if (
+            event.kind == EventKind.NARRATION
+            and event.text is not None
+            and len(event.text.strip()) == 0
+        ):
+            # Blank lines only matter in a terminal
+            return
+        self.num_bytes += event.size
+        if self.num_bytes > self.max_bytes:
+            self.truncated = True
+            logger.warning("Output truncated at %d bytes", self.max_bytes)
+            self.entries.append(
+                OutputEvent(EventKind.WARNING, "(Output truncated)", "red on black")
+            )
+            return
+        self.entries.append(event)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [event.to_json() for event in self.entries]
+
+
+output_sink_contextvar: contextvars.ContextVar[
+    Optional[OutputSink]
+] = contextvars.ContextVar("output_sink", default=None)
+
 
 class ConsoleHandler:
     def __init__(self):
         self._console = Console()
-        self.buffers: Dict[str, List[Tuple[str, Optional[str]]]] = {}
-        self.step_mode = False
-        self.enqueue_press_key = False
+        self._step_mode = False
+        self._enqueue_press_key = False
+
+    @property
+    def sink(self) -> Optional[OutputSink]:
+        return output_sink_contextvar.get()
+
+    # Pause state belongs to the request when output is captured, so concurrent sessions don't share it
+    @property
+    def step_mode(self) -> bool:
+        sink = self.sink
+        return self._step_mode if sink is None else sink.step_mode
+
+    @step_mode.setter
+    def step_mode(self, value: bool):
+        sink = self.sink
+        if sink is None:
+            self._step_mode = value
+        else:
+            sink.step_mode = value
+
+    @property
+    def enqueue_press_key(self) -> bool:
+        sink = self.sink
+        return self._enqueue_press_key if sink is None else sink.enqueue_press_key
+
+    @enqueue_press_key.setter
+    def enqueue_press_key(self, value: bool):
+        sink = self.sink
+        if sink is None:
+            self._enqueue_press_key = value
+        else:
+            sink.enqueue_press_key = value
+
+    @contextlib.contextmanager
+    def capture(self, session_id: str) -> Iterator[OutputSink]:
+        sink = OutputSink(gptif.settings.MAX_OUTPUT_BYTES_PER_REQUEST)
+        session_token = session_id_contextvar.set(session_id)
+        sink_token = output_sink_contextvar.set(sink)
+        try:
+            yield sink
+        finally:
+            output_sink_contextvar.reset(sink_token)
+            session_id_contextvar.reset(session_token)
 
     def get_input(self, prompt: str) -> str:
         if len(DEBUG_INPUT) > 0:
@@ -148,18 +234,41 @@ class ConsoleHandler:
         self.enqueue_press_key = False
         self.ask_to_press_key()
 
-    def print(self, *objects: Any, style: Optional[str] = None):
+    def _output(
+        self,
+        kind: EventKind,
+        objects: Tuple[Any, ...],
+        style: Optional[str],
+        speaker: Optional[str] = None,
+    ):
         self._pop_ask_to_press_key()
-        session_id = session_id_contextvar.get()
-        if len(session_id) > 0:
-            if session_id not in self.buffers:
-                self.buffers[session_id] = []
-            self.buffers[session_id].append(
-                (ConsoleHandler.merge_parameters(objects), style)
+        sink = self.sink
+        if sink is not None:
+            sink.append(
+                OutputEvent(
+                    kind, ConsoleHandler.merge_parameters(objects), style, speaker
+                )
             )
         else:
             self._console.print(*objects, style=style)
 
+    def print(self, *objects: Any, style: Optional[str] = None):
+        self._output(EventKind.NARRATION, objects, style)
+
+    def dialogue(self, speaker: str, *objects: Any, style: Optional[str] = None):
+        self._output(EventKind.DIALOGUE, objects, style, speaker)
+
+    def goal(self, *objects: Any, style: Optional[str] = None):
+        self._output(EventKind.GOAL, objects, style)
+
+    def image(self, image_id: Optional[int] = None, job_id: Optional[int] = None):
+        self._pop_ask_to_press_key()
+        sink = self.sink
+        if sink is not None:
+            sink.append(OutputEvent(EventKind.IMAGE, image_id=image_id, job_id=job_id))
+        else:
+            self.debug("IMAGE", image_id, "JOB", job_id)
+
     @staticmethod
     def merge_parameters(*objects: Any) -> str:
         def replace_markdown(o: Any):
@@ -173,12 +282,19 @@ class ConsoleHandler:
         return self._console.input(prompt)
 
     def debug(self, *objects: Any):
-        if gptif.settings.DEBUG_MODE is True or gptif.settings.CLI_MODE is False:
+        if self.sink is not None:
+            # Keep server debug output in the logs, tagged with the session
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "[%s] %s",
+                    session_id_contextvar.get(),
+                    " ".join(str(o) for o in objects),
+                )
+        elif gptif.settings.DEBUG_MODE is True or gptif.settings.CLI_MODE is False:
             self._console.print(*objects, style="bright_black on black")
 
     def warning(self, *objects: Any):
-        self._pop_ask_to_press_key()
-        self.print(*objects, style="red on black")
+        self._output(EventKind.WARNING, objects, "red on black")
         if gptif.settings.DEBUG_MODE:
             # Shouldn't get warnings in debug mode...
             self.print("Got a warning in debug mode")
@@ -187,6 +303,10 @@ class ConsoleHandler:
         self.enqueue_press_key = True
 
     def ask_to_press_key(self):
+        sink = self.sink
+        if sink is not None:
+            sink.append(OutputEvent(EventKind.PRESS_KEY))
+            return
         if gptif.settings.DEBUG_MODE or not gptif.settings.CLI_MODE:
             self.print("[blue]Press enter to continue...[/]")
         else:
@@ -0,0 +1,55 @@
+from typing import Dict, List
+
+# The game content.  Only yaml and the standard library are imported here, so the
+# linter can read the content without loading the engine.
+
+ROOM_DESCRIPTIONS_PATH = "data/rooms/room_descriptions.md"
+ROOMS_PATH = "data/rooms/rooms.yaml"
+SCENERY_PATH = "data/rooms/scenery.yaml"
+SCENERY_ACTIONS_PATH = "data/rooms/scenery_actions.md"
+AGENTS_PATH = "data/agents/agents.yaml"
+
+# The chapter intros, played by World.start_chapter_one etc.
+CHAPTER_PATHS = {
+    1: "data/start_ch1.md",
+    2: "data/start_ch2.md",
+    3: "data/start_ch3.md",
+    5: "data/start_ch5.md",
+    6: "data/start_ch6.md",
+    7: "data/start_ch7.md",
+}
+
+# Where the game starts
+START_ROOM_ID = "driving_to_terminal"
+
+PAGEBREAK = "{{< pagebreak >}}"
+
+
+def load_sections(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """Parses markdown where "# " starts an object and "## " one of its sections."""
+    sections_by_uid: Dict[str, Dict[str, List[str]]] = {}
+
+    current_uid = ""
+    current_section = ""
+    with open(path, "r") as fp:
+        sections = fp.read().split("\n\n")
+        for section in sections:
+            if section[:2] == "##":
+                current_section = section[2:].strip()
+                if current_uid == "":
+                    raise ValueError(f"{path}: section {current_section} outside of an object")
+                sections_by_uid[current_uid][current_section] = []
+            elif section[:1] == "#":
+                current_uid = section[1:].strip()
+                current_section = ""
+                sections_by_uid[current_uid] = {}
+            else:
+                if current_uid == "" or current_section == "":
+                    raise ValueError(f"{path}: text outside of a section: {section[:40]!r}")
+                sections_by_uid[current_uid][current_section].append(section)
+
+        # Re-split descriptions
+        for sd in sections_by_uid.values():
+            for section_name in sd.keys():
+                sd[section_name] = "\n\n".join(sd[section_name]).split(PAGEBREAK)
+    return sections_by_uid
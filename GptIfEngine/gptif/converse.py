@@ -1,21 +1,37 @@
 import multiprocessing
 import os
-from typing import List, Optional
-
-import requests
-from rich.progress import Progress
+from typing import List, Optional, Tuple
 
 import gptif.settings
 from gptif import db
 from gptif.console import console
-from gptif.llm import llm
-from gptif.state import Agent
-
-
-def get_answer_from_cache(dialogue: db.GptDialogue) -> Optional[str]:
+import gptif.llm
+from gptif.prompt_templates import (
+    CONVERSE_PREFIX,
+    CONVERSE_TURN,
+    DESCRIBE_CHARACTER,
+    FAKE_SCENERY,
+    FRIEND_QUESTION,
+    SUMMARIZE_CONVERSATION,
+    converse_prefix,
+    count_tokens,
+    profile_for_agent,
+    render_exchange,
+)
+from gptif.state import Agent, ConversationMemory
+
+
+def get_answer_from_cache(
+    dialogue: db.GptDialogue, semantic: bool = False
+) -> Optional[str]:
+    """Set semantic to also reuse answers to similar questions (see semantic_cache)."""
     if gptif.settings.CONVERSE_SERVER is not None:
-        response = requests.post(
-            gptif.settings.CONVERSE_SERVER + "/fetch_dialogue", json=dialogue.dict()
+        from gptif.http_session import get_http_session
+
+        response = get_http_session().post(
+            gptif.settings.CONVERSE_SERVER + "/fetch_dialogue",
+            json=dialogue.dict(),
+            params={"semantic": "true"} if semantic else None,
         )
 
         console.debug("RESPONSE", response)
@@ -24,18 +40,73 @@ def get_answer_from_cache(dialogue: db.GptDialogue) -> Optional[str]:
         # TODO: More gracefully handle errors
         assert response.status_code == 200
 
-        x = response.content.decode()
-        if x == "None" or x == '"None"':
+        # The endpoint returns a JSON encoded string
+        x = response.json()
+        if x == "None":
             return None
         return x
     else:
-        return db.get_answer_if_cached(dialogue)
+        answer = db.get_answer_if_cached(dialogue)
+        if answer is None and semantic:
+            answer = get_semantic_answer(dialogue)
+        return answer
+
+
+def get_semantic_answer(dialogue: db.GptDialogue) -> Optional[str]:
+    if gptif.settings.SEMANTIC_CACHE_THRESHOLD is None:
+        return None
+    from gptif.semantic_cache import get_semantic_cache
+
+    semantic_cache = get_semantic_cache()
+    assert semantic_cache is not None
+    return semantic_cache.lookup(dialogue)
+
+
+def remember_semantic_answer(dialogue: db.GptDialogue):
+    if gptif.settings.SEMANTIC_CACHE_THRESHOLD is None:
+        return
+    from gptif.semantic_cache import get_semantic_cache
+
+    semantic_cache = get_semantic_cache()
+    assert semantic_cache is not None
+    semantic_cache.remember(dialogue)
+
+
+def get_answers_from_cache(
+    dialogues: List[db.GptDialogue],
+) -> List[Optional[str]]:
+    """Like get_answer_from_cache, with one round-trip for all the dialogues.
+
+    The converse server generates the missing answers, like it does for
+    get_answer_from_cache, since the client may have no key for the llm.
+    """
+    if len(dialogues) == 0:
+        return []
+    if gptif.settings.CONVERSE_SERVER is not None:
+        from gptif.http_session import get_http_session
+
+        response = get_http_session().post(
+            gptif.settings.CONVERSE_SERVER + "/fetch_dialogue_batch",
+            json={
+                "dialogues": [dialogue.dict() for dialogue in dialogues],
+                "generate": True,
+            },
+        )
+
+        # TODO: More gracefully handle errors
+        assert response.status_code == 200
+
+        return response.json()
+    else:
+        return db.get_answers_if_cached(dialogues)
 
 
 def put_answer_in_cache(dialogue: db.GptDialogue):
     console.debug("PUTTING ANSWER IN CACHE")
     if gptif.settings.CONVERSE_SERVER is not None:
-        response = requests.post(
+        from gptif.http_session import get_http_session
+
+        response = get_http_session().post(
             gptif.settings.CONVERSE_SERVER + "/put_dialogue", json=dialogue.dict()
         )
 
@@ -43,46 +114,32 @@ def put_answer_in_cache(dialogue: db.GptDialogue):
         assert response.status_code == 200
     else:
         db.put_answer_in_cache(dialogue)
-
-
-def profile_for_agent(agent: Agent) -> str:
-    return f"""
-**Name:** {agent.profile.name}
-**Age:** {agent.profile.age}
-**Race:** {agent.profile.race}
-**Gender:** {agent.profile.gender}
-**Occupation:** {agent.profile.occupation}
-**Personality:** {". ".join(agent.profile.personality)}
-**Backstory:** {". ".join(agent.profile.backstory)}
-**Goals:**   {". ".join(agent.profile.goals)}
-**Notes:**   {". ".join(agent.notes)}
-"""
+        remember_semantic_answer(dialogue)
 
 
 def converse(target_agent: Agent, statement: str) -> Optional[str]:
-    assert llm is not None
+    assert gptif.llm.llm is not None
 
     assert target_agent.profile.personality is not None
     assert target_agent.profile.backstory is not None
     assert target_agent.profile.goals is not None
 
-    context = f"""Given a character and question, answer the question in a paragraph.
-
-Character:
-
-{profile_for_agent(target_agent)}
-
-Alfred: What is your name?
-{target_agent.profile.name}: \"My name is {target_agent.profile.name}.\"
-
-Alfred: {statement}
-{target_agent.profile.name}: \""""
+    prefix = converse_prefix(target_agent)
+    # Identical histories render identical prompts, so they share cache entries
+    context = (
+        prefix.text
+        + "".join(
+            render_exchange(target_agent, past_statement, past_answer)
+            for past_statement, past_answer in target_agent.memory.turns
+        )
+        + CONVERSE_TURN.render(statement=statement, name=target_agent.profile.name)
+    )
 
     assert target_agent.profile.name is not None
 
     dialogue = db.GptDialogue(
         character_name=target_agent.profile.name,
-        model_version=llm.model_name(),
+        model_version=gptif.llm.llm.model_name(),
         question=statement,
         context=context,
         stop_words=",".join(["Alfred:", "\n"]),
@@ -90,15 +147,23 @@ Alfred: {statement}
 
     assert dialogue.stop_words is not None
 
-    cached_answer = get_answer_from_cache(dialogue)
+    # Players ask the same thing many ways, so similar questions can share answers
+    cached_answer = get_answer_from_cache(dialogue, semantic=True)
     console.debug("Cached answer:", cached_answer)
     if cached_answer is not None:
+        remember_turn(target_agent, statement, cached_answer)
         return cached_answer
     if gptif.settings.CLI_MODE:
         console.print(f"[purple]{target_agent.profile.name} thinks for a moment...[/]")
+    console.debug(
+        f"{CONVERSE_PREFIX.id()} prompt tokens: {prefix.token_count(gptif.llm.llm)} prefix + {count_tokens(gptif.llm.llm, context[len(prefix.text):])} conversation (memory {target_agent.memory.digest()})"
+    )
     while True:
-        answer = llm.llm(
-            dialogue.context, stop=dialogue.stop_words.split(","), echo=False
+        answer = gptif.llm.llm.llm(
+            dialogue.context,
+            stop=dialogue.stop_words.split(","),
+            echo=False,
+            prefix=prefix.text,
         )
         answer_text = answer
         if len(answer_text) > 0:
@@ -112,35 +177,96 @@ Alfred: {statement}
                     stop_words=dialogue.stop_words,
                 )
             )
+            remember_turn(target_agent, statement, answer_text)
             return answer_text
 
 
-def check_if_more_friendly(target_agent: Agent, statement: str) -> bool:
-    assert llm is not None
-
-    for friendly_question in target_agent.friend_questions:
-        context = f"""Answer questions about the following statement:
+def remember_turn(agent: Agent, statement: str, answer: str):
+    """Adds a turn to the agent's memory, summarizing the oldest turns when the
+    remembered turns go over the token budget."""
+    budget = gptif.settings.CONVERSATION_MEMORY_TOKEN_BUDGET
+    if budget is None:
+        return
+    assert gptif.llm.llm is not None
+    memory = agent.memory
+    memory.add_turn(statement, answer.strip().strip('"'))
+
+    turn_tokens = [
+        count_tokens(gptif.llm.llm, render_exchange(agent, *turn))
+        for turn in memory.turns
+    ]
+    folded_turns = []
+    # Always keep the latest turn word for word
+    while len(memory.turns) > 1 and sum(turn_tokens) > budget:
+        folded_turns.append(memory.turns.pop(0))
+        turn_tokens.pop(0)
+    if len(folded_turns) > 0:
+        memory.summary = summarize_turns(agent, memory.summary, folded_turns)
+
+
+def summarize_turns(
+    agent: Agent, previous_summary: str, turns: List[Tuple[str, str]]
+) -> str:
+    """Folds turns into the summary (the summary grows by one llm call per fold)."""
+    assert gptif.llm.llm is not None
+
+    context = SUMMARIZE_CONVERSATION.render(
+        name=agent.name,
+        previous_summary=f"{previous_summary}\n\n" if len(previous_summary) > 0 else "",
+        exchanges="".join(render_exchange(agent, *turn) for turn in turns),
+    )
+    dialogue = db.GptDialogue(
+        character_name=agent.name,
+        model_version=gptif.llm.llm.model_name(),
+        # The question column is indexed, a digest keeps it short
+        question=ConversationMemory(turns, previous_summary).digest(),
+        context=context,
+        stop_words="\n\n",
+    )
+    summary = get_answer_from_cache(dialogue)
+    if summary is None:
+        summary = gptif.llm.llm.llm(context, stop=["\n\n"], echo=False).strip()
+        put_answer_in_cache(
+            db.GptDialogue(
+                character_name=dialogue.character_name,
+                model_version=dialogue.model_version,
+                question=dialogue.question,
+                context=dialogue.context,
+                answer=summary,
+                stop_words=dialogue.stop_words,
+            )
+        )
+    # Bounded no matter what the model does
+    return " ".join(summary.split()[: gptif.settings.CONVERSATION_SUMMARY_MAX_WORDS])
 
-\"{statement}\"
 
-Is the statement above about chocolate?
-No
+def check_if_more_friendly(target_agent: Agent, statement: str) -> bool:
+    assert gptif.llm.llm is not None
 
-{friendly_question}
-"""
+    dialogues = []
+    for friendly_question in target_agent.friend_questions:
+        context = FRIEND_QUESTION.render(
+            statement=statement, friendly_question=friendly_question
+        )
 
         assert target_agent.profile.name is not None
 
-        dialogue = db.GptDialogue(
-            character_name=target_agent.profile.name,
-            model_version=llm.model_name(),
-            question=statement,
-            context=context,
-            stop_words=",".join(["?", "\n\n"]),
+        dialogues.append(
+            db.GptDialogue(
+                character_name=target_agent.profile.name,
+                model_version=gptif.llm.llm.model_name(),
+                question=statement,
+                context=context,
+                stop_words=",".join(["?", "\n\n"]),
+            )
         )
+
+    # Look up every friend question in one round-trip
+    cached_answers = get_answers_from_cache(dialogues)
+    for dialogue, cached_answer in zip(dialogues, cached_answers):
+        context = dialogue.context
         assert dialogue.stop_words is not None
 
-        cached_answer = get_answer_from_cache(dialogue)
         if cached_answer is not None:
             if "yes" in cached_answer.lower():
                 return True
@@ -148,7 +274,7 @@ No
                 assert "no" in cached_answer.lower(), cached_answer
                 return False
         while True:
-            answer = llm.llm(context, stop=dialogue.stop_words.split(","), echo=False)
+            answer = gptif.llm.llm.llm(context, stop=dialogue.stop_words.split(","), echo=False)
             answer_text = answer
             console.debug("RAW ANSWER", answer_text)
             if "yes" in answer_text.lower():
@@ -160,7 +286,7 @@ No
             put_answer_in_cache(
                 db.GptDialogue(
                     character_name=target_agent.profile.name,
-                    model_version=llm.model_name(),
+                    model_version=gptif.llm.llm.model_name(),
                     question=statement,
                     context=context,
                     answer=answer_text,
@@ -176,21 +302,15 @@ No
 def generate_fake_scenery(
     scenery_text: str, room_name: str, room_text: str
 ) -> Optional[str]:
-    assert llm is not None
+    assert gptif.llm.llm is not None
 
-    context = f"""Given a room description and an object in the room, describe the object.
-    
-Room Name: {room_name}
-
-Room Description: {room_text}
-    
-Object Name: {scenery_text}
-
-Object Description: """
+    context = FAKE_SCENERY.render(
+        room_name=room_name, room_text=room_text, scenery_text=scenery_text
+    )
 
     dialogue = db.GptDialogue(
         character_name=None,
-        model_version=llm.model_name(),
+        model_version=gptif.llm.llm.model_name(),
         question=scenery_text,
         context=context,
         stop_words=",".join(["?", "\n\n"]),
@@ -200,13 +320,13 @@ Object Description: """
     cached_answer = get_answer_from_cache(dialogue)
     if cached_answer is not None:
         return cached_answer
-    answer = llm.llm(context, stop=dialogue.stop_words.split(","), echo=False)
+    answer = gptif.llm.llm.llm(context, stop=dialogue.stop_words.split(","), echo=False)
     answer_text = answer
     console.debug("RAW ANSWER", answer_text)
     put_answer_in_cache(
         db.GptDialogue(
             character_name=None,
-            model_version=llm.model_name(),
+            model_version=gptif.llm.llm.model_name(),
             question=scenery_text,
             context=context,
             answer=answer_text,
@@ -216,36 +336,42 @@ Object Description: """
     return answer_text
 
 
-def describe_character(agent: Agent) -> str:
-    assert llm is not None
+def _describe_character_dialogue(agent: Agent) -> db.GptDialogue:
+    assert gptif.llm.llm is not None
 
-    question = f"""Given a character profile, write a description of the character in a single paragraph. The description should include the age and race.
-    
-Character:
+    return db.GptDialogue(
+        character_name=agent.name,
+        model_version=gptif.llm.llm.model_name(),
+        question=DESCRIBE_CHARACTER.render(profile=profile_for_agent(agent)),
+        context="",
+    )
 
-{profile_for_agent(agent)}
 
-Description:
+def cached_description(agent: Agent) -> Optional[str]:
+    """The agent's description if it's been generated, never calls the llm."""
+    return get_answer_from_cache(_describe_character_dialogue(agent))
 
-"""
 
-    dialogue = db.GptDialogue(
-        character_name=agent.name,
-        model_version=llm.model_name(),
-        question=question,
-        context="",
-    )
+def description_is_cached(agent: Agent) -> bool:
+    return cached_description(agent) is not None
+
+
+def describe_character(agent: Agent) -> str:
+    assert gptif.llm.llm is not None
+
+    dialogue = _describe_character_dialogue(agent)
+    question = dialogue.question
 
     cached_answer = get_answer_from_cache(dialogue)
     if cached_answer is not None:
         return cached_answer
-    answer = llm.llm(question, echo=False)
+    answer = gptif.llm.llm.llm(question, echo=False)
     answer_text = answer
     console.debug("RAW ANSWER", answer_text)
     put_answer_in_cache(
         db.GptDialogue(
             character_name=dialogue.character_name,
-            model_version=llm.model_name(),
+            model_version=gptif.llm.llm.model_name(),
             question=question,
             context="",
             answer=answer_text,
@@ -1,7 +1,8 @@
 import os
-from typing import List, Optional
+import time
+from typing import Dict, List, Optional
 
-from sqlmodel import Field, Session, SQLModel, create_engine, select, func
+from sqlmodel import Field, Session, SQLModel, create_engine, select, func, update
 
 from gptif.console import console
 
@@ -25,6 +26,22 @@ class AiImage(SQLModel, table=True):
     result: Optional[bytes] = Field(nullable=False)
 
 
+IMAGE_JOB_PENDING = "pending"
+IMAGE_JOB_RUNNING = "running"
+IMAGE_JOB_DONE = "done"
+IMAGE_JOB_FAILED = "failed"
+
+
+class AiImageJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    model_version: str = Field(index=True, nullable=False)
+    prompt: str = Field(nullable=False)
+    status: str = Field(index=True, nullable=False, default=IMAGE_JOB_PENDING)
+    priority: int = Field(default=0, nullable=False)
+    claimed_at: Optional[float] = Field(default=None)
+    ai_image_id: Optional[int] = Field(default=None)
+
+
 class GameState(SQLModel, table=True):
     session_id: Optional[str] = Field(primary_key=True, nullable=False)
     version: str = Field(nullable=False)
@@ -67,29 +84,49 @@ def create_db_and_tables():
         SQLModel.metadata.create_all(engine)
 
 
+def _cached_answer_statement(dialogue: GptDialogue):
+    statement = (
+        select(GptDialogue)
+        .where(GptDialogue.character_name == dialogue.character_name)
+        .where(GptDialogue.model_version == dialogue.model_version)
+        .where(GptDialogue.question == dialogue.question)
+        .where(GptDialogue.context == dialogue.context)
+    )
+    if dialogue.stop_words is not None:
+        statement = statement.where(GptDialogue.stop_words == dialogue.stop_words)
+    return statement
+
+
 def get_answer_if_cached(dialogue: GptDialogue) -> Optional[str]:
+    return get_answers_if_cached([dialogue])[0]
+
+
+def get_answers_if_cached(dialogues: List[GptDialogue]) -> List[Optional[str]]:
+    """Looks up many dialogues with one connection, answers are in the same order."""
+    answers: List[Optional[str]] = []
     with Session(engine) as session:
-        if dialogue.stop_words is None:
-            statement = (
-                select(GptDialogue)
-                .where(GptDialogue.character_name == dialogue.character_name)
-                .where(GptDialogue.model_version == dialogue.model_version)
-                .where(GptDialogue.question == dialogue.question)
-                .where(GptDialogue.context == dialogue.context)
-            )
+        for dialogue in dialogues:
+            result = session.exec(_cached_answer_statement(dialogue)).first()
+            answers.append(None if result is None else result.answer)
+    return answers
+
+
+def get_dialogues_for_character(
+    character_name: str, model_version: str, stop_words: str
+) -> List[GptDialogue]:
+    """The answered dialogues with the stop words ("" for none)."""
+    with Session(engine) as session:
+        statement = (
+            select(GptDialogue)
+            .where(GptDialogue.character_name == character_name)
+            .where(GptDialogue.model_version == model_version)
+            .where(GptDialogue.answer != None)  # noqa: E711
+        )
+        if stop_words == "":
+            statement = statement.where(GptDialogue.stop_words == None)  # noqa: E711
         else:
-            statement = (
-                select(GptDialogue)
-                .where(GptDialogue.character_name == dialogue.character_name)
-                .where(GptDialogue.model_version == dialogue.model_version)
-                .where(GptDialogue.question == dialogue.question)
-                .where(GptDialogue.context == dialogue.context)
-                .where(GptDialogue.stop_words == dialogue.stop_words)
-            )
-        results = list(session.exec(statement))
-        if len(results) == 0:
-            return None
-        return results[0].answer
+            statement = statement.where(GptDialogue.stop_words == stop_words)
+        return list(session.exec(statement))
 
 
 def put_answer_in_cache(dialogue: GptDialogue):
@@ -132,6 +169,98 @@ def put_ai_image_in_cache(ai_image: AiImage):
         session.refresh(ai_image)
 
 
+def enqueue_ai_image_job(query: AiImage, priority: int = 0) -> AiImageJob:
+    with Session(engine) as session:
+        # Reuse any job for the same prompt that hasn't failed
+        statement = (
+            select(AiImageJob)
+            .where(AiImageJob.model_version == query.model_version)
+            .where(AiImageJob.prompt == query.prompt)
+            .where(AiImageJob.status != IMAGE_JOB_FAILED)
+        )
+        results = list(session.exec(statement))
+        if len(results) > 0:
+            job = results[0]
+            if job.status == IMAGE_JOB_PENDING and priority < job.priority:
+                # e.g. a player is now waiting on an image that was speculated
+                job.priority = priority
+                session.add(job)
+                session.commit()
+                session.refresh(job)
+            return job
+
+        assert query.model_version is not None
+        job = AiImageJob(
+            model_version=query.model_version, prompt=query.prompt, priority=priority
+        )
+        session.add(job)
+
+        session.commit()
+
+        session.refresh(job)
+        return job
+
+
+def claim_next_ai_image_job() -> Optional[AiImageJob]:
+    with Session(engine) as session:
+        while True:
+            statement = (
+                select(AiImageJob)
+                .where(AiImageJob.status == IMAGE_JOB_PENDING)
+                .order_by(AiImageJob.priority, AiImageJob.id)
+                .limit(1)
+            )
+            results = list(session.exec(statement))
+            if len(results) == 0:
+                return None
+            job = results[0]
+
+            # Only take the job if no other worker got to it first
+            claimed = session.execute(
+                update(AiImageJob)
+                .where(AiImageJob.id == job.id)
+                .where(AiImageJob.status == IMAGE_JOB_PENDING)
+                .values(status=IMAGE_JOB_RUNNING, claimed_at=time.time())
+            )
+            session.commit()
+            if claimed.rowcount == 1:
+                session.refresh(job)
+                return job
+
+
+def requeue_stale_ai_image_jobs(max_age_seconds: float):
+    with Session(engine) as session:
+        session.execute(
+            update(AiImageJob)
+            .where(AiImageJob.status == IMAGE_JOB_RUNNING)
+            .where(AiImageJob.claimed_at < time.time() - max_age_seconds)
+            .values(status=IMAGE_JOB_PENDING, claimed_at=None)
+        )
+        session.commit()
+
+
+def finish_ai_image_job(job_id: int, ai_image_id: Optional[int]):
+    with Session(engine) as session:
+        session.execute(
+            update(AiImageJob)
+            .where(AiImageJob.id == job_id)
+            .values(
+                status=IMAGE_JOB_FAILED if ai_image_id is None else IMAGE_JOB_DONE,
+                ai_image_id=ai_image_id,
+            )
+        )
+        session.commit()
+
+
+def get_ai_image_job(job_id: int) -> Optional[AiImageJob]:
+    with Session(engine) as session:
+        statement = select(AiImageJob).where(AiImageJob.id == job_id)
+        results = list(session.exec(statement))
+        if len(results) == 0:
+            return None
+        return results[0]
+
+
 def get_game_state_from_id(session_id: str) -> Optional[GameState]:
     with Session(engine) as session:
         statement = select(GameState).where(GameState.session_id == session_id)
@@ -163,6 +292,30 @@ def push_game_command(session_id: str, command: str):
         session.commit()
 
 
+def get_game_command_histories(
+    max_sessions: int = 1000, min_commands: int = 1
+) -> List[List[str]]:
+    """Returns the commands of recent sessions, each in the order they were played."""
+    with Session(engine) as session:
+        session_ids = session.exec(
+            select(GameCommand.session_id)
+            .group_by(GameCommand.session_id)
+            .having(func.count(GameCommand.id) >= min_commands)
+            .order_by(func.max(GameCommand.id).desc())
+            .limit(max_sessions)
+        ).all()
+        if len(session_ids) == 0:
+            return []
+        histories: Dict[str, List[str]] = {session_id: [] for session_id in session_ids}
+        for game_command in session.exec(
+            select(GameCommand)
+            .where(GameCommand.session_id.in_(session_ids))  # type: ignore
+            .order_by(GameCommand.session_id, GameCommand.command_id)
+        ):
+            histories[game_command.session_id].append(game_command.command)
+        return list(histories.values())
+
+
 def add_feedback(feedback: str, session_id: Optional[str]):
     with Session(engine) as session:
         session.add(GameFeedback(session_id=session_id, feedback=feedback))
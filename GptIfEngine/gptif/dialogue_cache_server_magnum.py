@@ -3,10 +3,12 @@ try:
 except ImportError:
     pass
 
-from gptif.dialogue_cache_server import app
+from gptif.dialogue_cache_server import app, warm_up
 from mangum import Mangum
 from gptif.backend_utils import logger, metrics
 
+warm_up()
+
 handler = Mangum(app)
 
 # Add logging
@@ -0,0 +1,108 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+import gptif.llm
+import gptif.settings
+from gptif.backend_utils import emit_semantic_cache_metrics
+from gptif.converse import get_semantic_answer, remember_semantic_answer
+from gptif.db import (
+    GptDialogue,
+    get_answer_if_cached,
+    get_answers_if_cached,
+    put_answer_in_cache,
+)
+from gptif.service_common import (
+    ConcurrencyLimiter,
+    LoggerRouteHandler,
+    create_app,
+    start_services,
+)
+
+dialogue_limiter = ConcurrencyLimiter(
+    "DialogueService",
+    gptif.settings.DIALOGUE_SERVICE_MAX_CONCURRENT,
+    gptif.settings.DIALOGUE_SERVICE_MAX_QUEUE,
+)
+
+router = APIRouter(
+    route_class=LoggerRouteHandler, dependencies=[Depends(dialogue_limiter)]
+)
+
+
+class DialogueBatch(BaseModel):
+    dialogues: List[GptDialogue]
+    # Ask the llm for answers that aren't cached (only for the server's own model)
+    generate: bool = False
+
+
+def _generate_answer(query: GptDialogue) -> Optional[str]:
+    if query.model_version != gptif.llm.llm.model_name():
+        return None
+    # Grab the answer from openai
+    assert query.stop_words is not None
+    answer = gptif.llm.llm.llm(query.context, stop=query.stop_words.split(","), echo=False)
+    query.answer = answer
+    put_answer_in_cache(query)
+    remember_semantic_answer(query)
+    return answer
+
+
+def _fetch_semantic_answer(query: GptDialogue) -> Optional[str]:
+    if gptif.settings.SEMANTIC_CACHE_THRESHOLD is None:
+        return None
+    answer = get_semantic_answer(query)
+    emit_semantic_cache_metrics()
+    return answer
+
+
+def _fetch_dialogue(query: GptDialogue, semantic: bool) -> str:
+    answer = get_answer_if_cached(query)
+    if answer is None and semantic:
+        answer = _fetch_semantic_answer(query)
+    if answer is None:
+        answer = _generate_answer(query)
+
+    return "None" if answer is None else answer
+
+
+def _fetch_dialogue_batch(batch: DialogueBatch) -> List[Optional[str]]:
+    answers = get_answers_if_cached(batch.dialogues)
+    if batch.generate:
+        for i, query in enumerate(batch.dialogues):
+            if answers[i] is None:
+                answers[i] = _generate_answer(query)
+    return answers
+
+
+@router.post("/api/fetch_dialogue")
+async def fetch_dialogue(query: GptDialogue, semantic: bool = False) -> str:
+    return await dialogue_limiter.run(_fetch_dialogue, query, semantic)
+
+
+@router.post("/api/fetch_dialogue_batch")
+async def fetch_dialogue_batch(batch: DialogueBatch) -> List[Optional[str]]:
+    """Answers (or null when missing) in the same order as the dialogues."""
+    return await dialogue_limiter.run(_fetch_dialogue_batch, batch)
+
+
+def _put_dialogue(query: GptDialogue):
+    put_answer_in_cache(query)
+    # Embedding the question can be a network call, so it's done off the event loop too
+    remember_semantic_answer(query)
+
+
+@router.post("/api/put_dialogue")
+async def put_dialogue(query: GptDialogue):
+    await dialogue_limiter.run(_put_dialogue, query)
+
+
+# Standalone dialogue cache tier: uvicorn gptif.dialogue_service:app --port 8002
+app = create_app("GptIfDialogue")
+app.include_router(router)
+
+
+@app.on_event("startup")
+def on_startup():
+    start_services(image_worker=False)
@@ -0,0 +1,54 @@
+import functools
+import random
+import re
+import threading
+from typing import List, Optional, Sequence
+
+import dice
+from dice.utilities import single
+
+# "10d5t": the total of 10 five sided dice, which is what agent tics use
+SIMPLE_TOTAL_RE = re.compile(r"^(\d+)d(\d+)t$")
+
+
+class DiceSampler:
+    """A dice expression parsed once.
+
+    Rolls draw from the rng exactly like dice.roll(expression, random=rng), so
+    game states (which save the rng) don't depend on which one rolled.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.amount: Optional[int] = None
+        self.sides: Optional[int] = None
+        self.elements: List = []
+        # The dice elements keep state while evaluating
+        self.lock = threading.Lock()
+
+        match = SIMPLE_TOTAL_RE.match(expression)
+        if match is not None:
+            # dice rolls each die with rng.randint(1, sides)
+            self.amount = int(match.group(1))
+            self.sides = int(match.group(2))
+        else:
+            self.elements = list(dice.parse_expression(expression))
+
+    def roll(self, rng: random.Random) -> int:
+        if self.amount is not None:
+            randint = rng.randint
+            sides = self.sides
+            return sum(randint(1, sides) for _ in range(self.amount))  # type: ignore
+        with self.lock:
+            return int(single([element.evaluate(random=rng) for element in self.elements]))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_dice(expression: str) -> DiceSampler:
+    return DiceSampler(expression)
+
+
+def roll_all(samplers: Sequence[DiceSampler], rng: random.Random, times: int) -> List[List[int]]:
+    """Rolls every sampler times times, in the order rolling them one by one each
+    time would.  Returns the rolls by time, then by sampler."""
+    return [[sampler.roll(rng) for sampler in samplers] for _ in range(times)]
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, Optional
+
+
+class EventKind(str, Enum):
+    # Values are the wire format, keep them short
+    NARRATION = "n"
+    DIALOGUE = "d"
+    WARNING = "w"
+    IMAGE = "i"
+    PRESS_KEY = "k"
+    GOAL = "g"
+
+
+@dataclass
+class OutputEvent:
+    kind: EventKind
+    text: Optional[str] = None
+    style: Optional[str] = None
+    speaker: Optional[str] = None
+    image_id: Optional[int] = None
+    job_id: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        return 0 if self.text is None else len(self.text)
+
+    def to_json(self) -> Dict[str, Any]:
+        retval: Dict[str, Any] = {"k": self.kind.value}
+        if self.text is not None:
+            retval["t"] = self.text
+        if self.style is not None:
+            retval["s"] = self.style
+        if self.speaker is not None:
+            retval["p"] = self.speaker
+        if self.image_id is not None:
+            retval["i"] = self.image_id
+        if self.job_id is not None:
+            retval["j"] = self.job_id
+        return retval
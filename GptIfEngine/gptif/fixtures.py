@@ -0,0 +1,312 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import gptif.llm
+import gptif.settings
+from gptif.console import console
+from gptif.llm import LargeLanguageModel
+from gptif.profiling import LLM, timed
+
+FIXTURE_MODEL_VERSION = "fixture"
+
+REPLAY = "replay"
+RECORD = "record"
+
+CASSETTE_VERSION = 1
+
+# The real image model, remembered in case the fixtures are configured twice
+_upstream_image_model_version: Optional[str] = None
+
+
+class FixtureUpstreamError(Exception):
+    """Simulated upstream failure, raised according to the configured error rate."""
+
+
+def _llm_key(prompt: str, stop: Optional[List[str]]) -> str:
+    return hashlib.sha256(json.dumps([prompt, stop or []]).encode("utf-8")).hexdigest()
+
+
+def _image_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Recorded upstream responses, stored as a JSON file.
+
+    {"version": 1,
+     "llm": {key: {"prompt", "stop", "answer", "latency"}},
+     "images": {key: {"prompt", "image" (base64), "latency"}}}
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lock = threading.Lock()
+        self.llm: Dict[str, Dict[str, Any]] = {}
+        self.images: Dict[str, Dict[str, Any]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            assert data.get("version") == CASSETTE_VERSION, f"Unknown cassette: {path}"
+            self.llm = data["llm"]
+            self.images = data["images"]
+
+    def get_answer(self, prompt: str, stop: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        return self.llm.get(_llm_key(prompt, stop))
+
+    def put_answer(
+        self, prompt: str, stop: Optional[List[str]], answer: str, latency: float
+    ):
+        with self.lock:
+            self.llm[_llm_key(prompt, stop)] = {
+                "prompt": prompt,
+                "stop": stop or [],
+                "answer": answer,
+                "latency": latency,
+            }
+            self._save()
+
+    def get_image(self, prompt: str) -> Optional[Dict[str, Any]]:
+        return self.images.get(_image_key(prompt))
+
+    def put_image(self, prompt: str, image: bytes, latency: float):
+        with self.lock:
+            self.images[_image_key(prompt)] = {
+                "prompt": prompt,
+                "image": base64.b64encode(image).decode("ascii"),
+                "latency": latency,
+            }
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        # Write to a temp file so an interrupted recording doesn't corrupt the cassette
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {"version": CASSETTE_VERSION, "llm": self.llm, "images": self.images},
+                f,
+                indent=1,
+            )
+        os.replace(temp_path, self.path)
+
+
+class LatencyModel:
+    """Synthetic upstream latency.
+
+    Specs: "none", "recorded", "fixed:SECONDS" or "lognormal:MEDIAN_SECONDS:SIGMA".
+    """
+
+    def __init__(self, spec: str, rng: random.Random):
+        self.spec = spec
+        self.rng = rng
+        parts = spec.split(":")
+        self.kind = parts[0]
+        self.args = [float(x) for x in parts[1:]]
+        if self.kind not in ("none", "recorded", "fixed", "lognormal"):
+            raise ValueError(f"Invalid latency spec: {spec}")
+        if self.kind == "fixed" and len(self.args) != 1:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        if self.kind == "lognormal" and len(self.args) != 2:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample(self, recorded: Optional[float]) -> float:
+        if self.kind == "recorded":
+            return 0.0 if recorded is None else recorded
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "lognormal":
+            median, sigma = self.args
+            return self.rng.lognormvariate(math.log(median), sigma)
+        return 0.0
+
+
+class FixtureBackend:
+    """Shared state for the fixture LLM and image generator."""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        mode: str = REPLAY,
+        latency: str = "recorded",
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        assert mode in (REPLAY, RECORD), f"Invalid fixture mode: {mode}"
+        self.cassette = cassette
+        self.mode = mode
+        # Keep our own rng so fixtures never perturb the game's random state
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.hits = 0
+        self.misses = 0
+
+    def simulate_upstream(self, recorded_latency: Optional[float]) -> bool:
+        """Sleeps like the upstream would.  Returns False if the call should fail."""
+        with self.rng_lock:
+            delay = self.latency.sample(recorded_latency)
+            failed = self.error_rate > 0 and self.rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return not failed
+
+
+class FixtureLanguageModel(LargeLanguageModel):
+    def __init__(
+        self,
+        backend: FixtureBackend,
+        upstream: Optional[LargeLanguageModel] = None,
+    ):
+        self.backend = backend
+        self.upstream = upstream
+        if backend.mode == RECORD:
+            assert upstream is not None, "Record mode needs a real model"
+
+    def model_name(self):
+        if self.backend.mode == RECORD:
+            assert self.upstream is not None
+            return self.upstream.model_name()
+        # Keep synthetic answers out of the real model's dialogue cache
+        return FIXTURE_MODEL_VERSION
+
+    @timed(LLM)
+    def llm(
+        self,
+        question: str,
+        stop: List[str] = [],
+        echo: bool = False,
+        prefix: Optional[str] = None,
+    ) -> str:
+        if self.backend.mode == RECORD:
+            assert self.upstream is not None
+            start_time = time.perf_counter()
+            answer = self.upstream.llm(question, stop=stop, echo=echo, prefix=prefix)
+            self.backend.cassette.put_answer(
+                question, stop, answer, time.perf_counter() - start_time
+            )
+            return answer
+
+        entry = self.backend.cassette.get_answer(question, stop)
+        if not self.backend.simulate_upstream(
+            None if entry is None else entry["latency"]
+        ):
+            raise FixtureUpstreamError("Simulated LLM failure")
+        if entry is None:
+            self.backend.misses += 1
+            return synthetic_answer(question)
+        self.backend.hits += 1
+        return entry["answer"]
+
+
+def synthetic_answer(question: str) -> str:
+    # Starts with "No" so friend checks parse, and is unique so caches behave realistically
+    return f"No. (synthetic {hashlib.sha256(question.encode('utf-8')).hexdigest()[:8]})"
+
+
+def synthetic_image(prompt: str, size: int = 64) -> bytes:
+    """A solid color PNG derived from the prompt."""
+    r, g, b = hashlib.sha256(prompt.encode("utf-8")).digest()[:3]
+    row = b"\x00" + bytes([r, g, b]) * size
+    raw = row * size
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_fixture_image_generator(
+    backend: FixtureBackend, upstream_model_version: str
+) -> Callable[[str], Optional[bytes]]:
+    def generate(prompt: str) -> Optional[bytes]:
+        if backend.mode == RECORD:
+            from gptif.cl_image import generate_image
+            from gptif.db import AiImage
+
+            start_time = time.perf_counter()
+            image = generate_image(
+                AiImage(model_version=upstream_model_version, prompt=prompt)
+            )
+            if image is not None:
+                backend.cassette.put_image(
+                    prompt, image, time.perf_counter() - start_time
+                )
+            return image
+
+        entry = backend.cassette.get_image(prompt)
+        if not backend.simulate_upstream(None if entry is None else entry["latency"]):
+            # Image providers report failure by returning None
+            return None
+        if entry is None:
+            backend.misses += 1
+            return synthetic_image(prompt)
+        backend.hits += 1
+        return base64.b64decode(entry["image"])
+
+    return generate
+
+
+def configure_fixtures(
+    cassette_path: Optional[str],
+    mode: str = REPLAY,
+    latency: str = "recorded",
+    error_rate: float = 0.0,
+    seed: Optional[int] = None,
+) -> FixtureBackend:
+    """Routes all LLM and image generation through the fixture backend."""
+    from gptif.cl_image import register_image_generator
+
+    global _upstream_image_model_version
+    backend = FixtureBackend(Cassette(cassette_path), mode, latency, error_rate, seed)
+    if _upstream_image_model_version is None:
+        _upstream_image_model_version = gptif.settings.IMAGE_MODEL_VERSION
+    upstream_model_version = _upstream_image_model_version
+    register_image_generator(
+        FIXTURE_MODEL_VERSION,
+        make_fixture_image_generator(backend, upstream_model_version),
+    )
+    gptif.settings.IMAGE_MODEL_VERSION = FIXTURE_MODEL_VERSION
+    gptif.llm.set_llm(
+        FixtureLanguageModel(backend, gptif.llm.llm if mode == RECORD else None)
+    )
+    console.debug(
+        "Using fixtures from", cassette_path, "mode", mode, "latency", latency
+    )
+    return backend
+
+
+def configure_fixtures_from_env() -> Optional[FixtureBackend]:
+    """Enables fixtures if GPTIF_FIXTURE_MODE is set (used by the server)."""
+    mode = os.environ.get("GPTIF_FIXTURE_MODE", None)
+    if mode is None:
+        return None
+    return configure_fixtures(
+        os.environ.get("GPTIF_FIXTURE_CASSETTE", None),
+        mode,
+        os.environ.get("GPTIF_FIXTURE_LATENCY", "recorded"),
+        float(os.environ.get("GPTIF_FIXTURE_ERROR_RATE", "0")),
+        int(os.environ["GPTIF_FIXTURE_SEED"])
+        if "GPTIF_FIXTURE_SEED" in os.environ
+        else None,
+    )
@@ -4,7 +4,7 @@ from typing import Optional
 
 from dotenv import load_dotenv
 
-from gptif.cl_image import display_image_for_prompt
+from gptif.cl_image import display_image_for_prompt, portrait_prompt
 
 load_dotenv()  # take environment variables from .env.
 
@@ -21,6 +21,8 @@ from gptif.parser import (
     get_verb_classes,
     handle_user_input,
 )
+from gptif.speculation import DESCRIPTION_KIND, record_use
+from gptif.state import AmbiguousNameException
 from gptif.world import World
 
 DIRECTION_VERBS = (
@@ -48,6 +50,47 @@ DIRECTION_SHORT_LONG_MAP = {
 }
 
 
+# Verbs reported as-is in metrics, everything else is bucketed as OTHER
+METRIC_VERBS = (
+    "GO",
+    "LOOK",
+    "WAIT",
+    "TELL",
+    "ASK",
+    "SAY",
+    "PERSUADE",
+    "CONVINCE",
+    "INVENTORY",
+    "GOAL",
+    "HELP",
+    "TAKE",
+    "GET",
+    "OPEN",
+    "USE",
+    "PUSH",
+    "PRESS",
+)
+
+
+def command_verb(command: str) -> str:
+    """Returns a low-cardinality label for the command, for use as a metric dimension."""
+    command = command.strip()
+    if len(command) == 0:
+        return "NONE"
+    if command[0] in ('"', "\u201c"):
+        return "TELL"
+    verb = command.split()[0].upper()
+    if verb in DIRECTION_VERBS:
+        return "GO"
+    if verb in ("L", "X", "EXAMINE"):
+        return "LOOK"
+    if verb == "I":
+        return "INVENTORY"
+    if verb in METRIC_VERBS:
+        return verb
+    return "OTHER"
+
+
 def handle_input(world: World, command: str) -> bool:
     try:
         # Convert unicode quotes
@@ -141,8 +184,7 @@ def handle_input(world: World, command: str) -> bool:
             min_wait_duration = world.min_wait_duration()
             if min_wait_duration > 0:
                 console.print("Time passes...\n", style="yellow")
-                for x in range(0, min_wait_duration):
-                    world.step()
+                world.wait(min_wait_duration)
             else:
                 console.warning("There's no reason to wait")
         elif "37" in verb_classes:  # Tell/Ask
@@ -169,16 +211,11 @@ def handle_input(world: World, command: str) -> bool:
             )
             statement = command_minus_verb[command_minus_verb.find('"') - 1 :].strip()
 
-            target_agent = None
-            missing_target_agent = None
-            for agent_id, agent in world.agents.items():
-                if agent.answers_to_name(target_name):
-                    if (
-                        agent_id in world.active_agents
-                        and agent.room_id == world.current_room_id
-                    ):
-                        target_agent = agent
-                    missing_target_agent = agent
+            try:
+                target_agent, missing_target_agent = world.find_agent(target_name)
+            except AmbiguousNameException as ane:
+                console.warning(str(ane))
+                return True
 
             if target_agent is None:
                 if missing_target_agent is not None:
@@ -220,13 +257,16 @@ def handle_input(world: World, command: str) -> bool:
                     answer = converse(target_agent, statement)
                     if answer is not None:
                         console.debug("(RAW ANSWER)", answer)
-                        console.print(Markdown("> " + answer.strip('"')))
+                        console.dialogue(
+                            target_agent.profile.name,
+                            Markdown("> " + answer.strip('"')),
+                        )
                         console.print("\n")
 
+                        record_use(DESCRIPTION_KIND, target_agent.uid)
                         target_agent_description = describe_character(target_agent)
                         display_image_for_prompt(
-                            "Portrait of character with description: "
-                            + target_agent_description
+                            portrait_prompt(target_agent_description)
                         )
 
                         if (
@@ -270,16 +310,11 @@ def handle_input(world: World, command: str) -> bool:
         elif "58" in verb_classes:  # PERSUADE
             target_name = command_minus_verb
 
-            target_agent = None
-            missing_target_agent = None
-            for agent_id, agent in world.agents.items():
-                if target_name.lower() in [x.lower() for x in agent.names]:
-                    if (
-                        agent_id in world.active_agents
-                        and agent.room_id == world.current_room_id
-                    ):
-                        target_agent = agent
-                    missing_target_agent = agent
+            try:
+                target_agent, missing_target_agent = world.find_agent(target_name)
+            except AmbiguousNameException as ane:
+                console.warning(str(ane))
+                return True
 
             if target_agent is None:
                 if missing_target_agent is not None:
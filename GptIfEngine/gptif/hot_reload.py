@@ -0,0 +1,189 @@
+import dataclasses
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+import yaml
+
+from gptif.console import console
+from gptif.content import (
+    AGENTS_PATH,
+    ROOM_DESCRIPTIONS_PATH,
+    ROOMS_PATH,
+    SCENERY_ACTIONS_PATH,
+    SCENERY_PATH,
+)
+from gptif.state import (
+    Agent,
+    ConversationMemory,
+    World,
+    load_rooms,
+    load_world_content,
+    replace_world_content,
+)
+
+CONTENT_DIR = "data"
+
+# load_rooms reads all of these, scenery changes the room descriptions
+ROOM_PATHS = {
+    ROOM_DESCRIPTIONS_PATH,
+    ROOMS_PATH,
+    SCENERY_PATH,
+    SCENERY_ACTIONS_PATH,
+}
+
+
+@dataclass
+class ContentChanges:
+    changed: List[str] = field(default_factory=list)
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return len(self.changed) + len(self.added) + len(self.removed) == 0
+
+    def describe(self, kind: str) -> str:
+        parts = []
+        for verb, uids in (
+            ("changed", self.changed),
+            ("added", self.added),
+            ("removed", self.removed),
+        ):
+            if len(uids) > 0:
+                parts.append(f"{verb} {', '.join(sorted(uids))}")
+        return f"{kind}: {'; '.join(parts)}"
+
+
+class ContentReloader:
+    """Watches data/ and swaps edited rooms and agents into a running World.
+
+    Only the files that changed are parsed again, and only the rooms and agents that
+    differ are replaced.  Agents keep their position, friendship and memory.
+    """
+
+    def __init__(self):
+        self.mtimes = self._scan()
+        with open(AGENTS_PATH, "r") as agent_file:
+            self.agents_yaml: Dict = yaml.safe_load(agent_file)
+
+    def _scan(self) -> Dict[str, float]:
+        mtimes = {}
+        for directory, _, filenames in os.walk(CONTENT_DIR):
+            for filename in filenames:
+                path = os.path.join(directory, filename).replace(os.sep, "/")
+                mtimes[path] = os.stat(path).st_mtime
+        return mtimes
+
+    def changed_paths(self) -> Set[str]:
+        mtimes = self._scan()
+        changed = set(
+            path
+            for path in set(mtimes.keys()) | set(self.mtimes.keys())
+            if mtimes.get(path) != self.mtimes.get(path)
+        )
+        self.mtimes = mtimes
+        return changed
+
+    def reload_if_changed(self, world: World) -> bool:
+        changed_paths = self.changed_paths()
+        if len(changed_paths) == 0:
+            return False
+        start_time = time.perf_counter()
+        rooms, agents = load_world_content()
+        reports = []
+        failed = False
+        if len(changed_paths & ROOM_PATHS) > 0:
+            try:
+                rooms, room_changes = self._reload_rooms(world, rooms)
+                if not room_changes.is_empty():
+                    reports.append(room_changes.describe("Rooms"))
+            except Exception as ex:
+                # Probably saved halfway through an edit, keep playing with the old rooms
+                console.warning(f"Could not reload the rooms: {ex}")
+                failed = True
+        if AGENTS_PATH in changed_paths:
+            try:
+                agents, agent_changes = self._reload_agents(world, agents)
+                if not agent_changes.is_empty():
+                    reports.append(agent_changes.describe("Agents"))
+            except Exception as ex:
+                console.warning(f"Could not reload the agents: {ex}")
+                failed = True
+        replace_world_content(rooms, agents)
+
+        for path in sorted(changed_paths - ROOM_PATHS - {AGENTS_PATH}):
+            # e.g. the chapter intros, which are read when they're played
+            reports.append(f"{path} is read when it's used")
+        if len(reports) == 0:
+            if failed:
+                return False
+            reports.append("Nothing changed")
+        elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+        console.print(f"[green]Reloaded content in {elapsed_ms:.1f} ms[/]")
+        for report in reports:
+            console.print(f"[green] • {report}[/]")
+        return True
+
+    def _reload_rooms(self, world: World, old_rooms):
+        new_rooms = load_rooms()
+        changes = ContentChanges()
+        for room_uid, room in new_rooms.items():
+            if room_uid not in old_rooms:
+                changes.added.append(room_uid)
+            elif room != old_rooms[room_uid]:
+                changes.changed.append(room_uid)
+            else:
+                # Unchanged rooms stay the same objects
+                new_rooms[room_uid] = old_rooms[room_uid]
+        for room_uid in old_rooms.keys():
+            if room_uid in new_rooms:
+                continue
+            if room_uid == world.current_room_id:
+                console.warning(f"Keeping {room_uid}, the player is in it")
+                new_rooms[room_uid] = old_rooms[room_uid]
+                continue
+            changes.removed.append(room_uid)
+
+        for room_uid in changes.removed:
+            world.rooms.pop(room_uid, None)
+        for room_uid in changes.changed + changes.added:
+            world.rooms[room_uid] = new_rooms[room_uid]
+        return new_rooms, changes
+
+    def _reload_agents(self, world: World, old_agents):
+        with open(AGENTS_PATH, "r") as agent_file:
+            agents_yaml = yaml.safe_load(agent_file)
+        new_agents: Dict[str, Agent] = {}
+        changes = ContentChanges()
+        for agent_uid, agent_yaml in agents_yaml.items():
+            if agent_uid in old_agents and self.agents_yaml.get(agent_uid) == agent_yaml:
+                new_agents[agent_uid] = old_agents[agent_uid]
+                continue
+            new_agents[agent_uid] = Agent.load_yaml(agent_uid, agent_yaml)
+            if agent_uid in old_agents:
+                changes.changed.append(agent_uid)
+            else:
+                changes.added.append(agent_uid)
+        changes.removed = [uid for uid in old_agents.keys() if uid not in new_agents]
+        self.agents_yaml = agents_yaml
+
+        for agent_uid in changes.removed:
+            world.agents.pop(agent_uid, None)
+            world.active_agents.discard(agent_uid)
+        for agent_uid in changes.changed:
+            # Content from the file, state from the game
+            old_agent = world.agents[agent_uid]
+            world.agents[agent_uid] = dataclasses.replace(
+                new_agents[agent_uid],
+                room_id=old_agent.room_id,
+                tic_percentage=old_agent.tic_percentage,
+                friend_points=old_agent.friend_points,
+                memory=old_agent.memory,
+            )
+        for agent_uid in changes.added:
+            world.agents[agent_uid] = dataclasses.replace(
+                new_agents[agent_uid], memory=ConversationMemory()
+            )
+        world.index_agents()
+        return new_agents, changes
@@ -0,0 +1,305 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import gptif.settings
+from gptif.console import console
+from gptif.db import IMAGE_JOB_PENDING, IMAGE_JOB_RUNNING, AiImage
+from gptif.http_session import get_http_session
+
+IMAGE_JOB_POLL_SECONDS = 1.0
+
+# Images fetched ahead of the player at once, the rest wait their turn
+PREFETCH_WORKERS = 2
+
+
+def image_server() -> str:
+    server = gptif.settings.IMAGE_SERVER or gptif.settings.CONVERSE_SERVER
+    assert server is not None
+    return server
+
+
+class LocalImageCache:
+    """Images from the image server, kept on disk between games.
+
+    Prompts map to image ids and image ids to the image and its ETag.  Each image is
+    revalidated with a conditional GET the first time a process shows it, after that
+    showing it again doesn't touch the network.
+    """
+
+    def __init__(self, cache_dir: Optional[str], server: str):
+        self.server = server
+        self.cache_dir = (
+            None
+            if cache_dir is None
+            # Image ids are only unique per server
+            else os.path.join(
+                os.path.expanduser(cache_dir),
+                hashlib.sha256(server.encode("utf-8")).hexdigest()[:12],
+            )
+        )
+        self.lock = threading.Lock()
+        self.image_ids: Dict[str, str] = {}
+        self.images: Dict[str, Tuple[bytes, Optional[str]]] = {}
+        self.validated: Set[str] = set()
+
+    @staticmethod
+    def prompt_key(query: AiImage) -> str:
+        return hashlib.sha256(
+            f"{query.model_version}\x00{query.prompt}".encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, *parts: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, *parts)
+
+    def _read(self, path: Optional[str]) -> Optional[bytes]:
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as ex:
+            console.debug("Could not read cached image", path, ex)
+            return None
+
+    def _write(self, path: Optional[str], data: bytes):
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so another process never reads half a file
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            console.debug("Could not cache image", path, ex)
+
+    def get_image_id(self, query: AiImage) -> Optional[str]:
+        key = LocalImageCache.prompt_key(query)
+        with self.lock:
+            image_id = self.image_ids.get(key)
+        if image_id is not None:
+            return image_id
+        data = self._read(self._path("prompts", key))
+        if data is None:
+            return None
+        image_id = data.decode("utf-8")
+        with self.lock:
+            self.image_ids[key] = image_id
+        return image_id
+
+    def put_image_id(self, query: AiImage, image_id: str):
+        key = LocalImageCache.prompt_key(query)
+        with self.lock:
+            self.image_ids[key] = image_id
+        self._write(self._path("prompts", key), image_id.encode("utf-8"))
+
+    def get_image(self, image_id: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        with self.lock:
+            image = self.images.get(image_id)
+        if image is not None:
+            return image
+        image_data_bytes = self._read(self._path("images", image_id + ".png"))
+        if image_data_bytes is None:
+            return None
+        etag = self._read(self._path("images", image_id + ".etag"))
+        image = (image_data_bytes, None if etag is None else etag.decode("utf-8"))
+        with self.lock:
+            self.images[image_id] = image
+        return image
+
+    def put_image(self, image_id: str, image_data_bytes: bytes, etag: Optional[str]):
+        with self.lock:
+            self.images[image_id] = (image_data_bytes, etag)
+            self.validated.add(image_id)
+        self._write(self._path("images", image_id + ".png"), image_data_bytes)
+        if etag is not None:
+            self._write(self._path("images", image_id + ".etag"), etag.encode("utf-8"))
+
+    def fetch_image_id(self, query: AiImage, priority: int = 0) -> Optional[str]:
+        """The image id for the prompt, asking the server (and waiting for the image to
+        be generated) only for prompts this client hasn't seen before.  Images with
+        a larger priority are generated later."""
+        image_id = self.get_image_id(query)
+        if image_id is not None:
+            return image_id
+
+        response = get_http_session().post(
+            f"{image_server()}/request_image_for_caption",
+            json=query.dict(),
+            params={"priority": priority},
+        )
+
+        console.debug("RESPONSE", response)
+        console.debug(response.content)
+
+        # TODO: More gracefully handle errors
+        assert response.status_code == 200
+
+        image_request = response.json()
+        image_id = image_request["image_id"]
+        job_id = image_request["job_id"]
+        while image_id is None and image_request["status"] in (
+            IMAGE_JOB_PENDING,
+            IMAGE_JOB_RUNNING,
+        ):
+            time.sleep(IMAGE_JOB_POLL_SECONDS)
+            response = get_http_session().get(f"{image_server()}/ai_image_job/{job_id}")
+            assert response.status_code == 200
+            image_request = response.json()
+            image_id = image_request["image_id"]
+
+        if image_id is None:
+            return None
+        image_id = str(image_id)
+        self.put_image_id(query, image_id)
+        return image_id
+
+    def fetch_image(self, image_id: str) -> bytes:
+        cached = self.get_image(image_id)
+        with self.lock:
+            validated = image_id in self.validated
+        if cached is not None and validated:
+            return cached[0]
+
+        headers = {}
+        if cached is not None and cached[1] is not None:
+            headers["If-None-Match"] = cached[1]
+        response = get_http_session().get(
+            f"{image_server()}/ai_image/{image_id}", headers=headers
+        )
+        if response.status_code == 304 and cached is not None:
+            with self.lock:
+                self.validated.add(image_id)
+            return cached[0]
+
+        # TODO: More gracefully handle errors
+        assert response.status_code == 200
+
+        self.put_image(image_id, response.content, response.headers.get("ETag"))
+        return response.content
+
+
+local_image_cache: Optional[LocalImageCache] = None
+local_image_cache_lock = threading.Lock()
+
+
+def get_local_image_cache() -> LocalImageCache:
+    global local_image_cache
+    server = image_server()
+    with local_image_cache_lock:
+        if local_image_cache is None or local_image_cache.server != server:
+            local_image_cache = LocalImageCache(gptif.settings.IMAGE_CACHE_DIR, server)
+        return local_image_cache
+
+
+class ImagePrefetcher:
+    """Fetches (and renders) images the player is likely to see next, in the background."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=PREFETCH_WORKERS, thread_name_prefix="image_prefetch"
+        )
+        self.lock = threading.Lock()
+        self.futures: Dict[str, Future] = {}
+
+    def _prefetch(self, query: AiImage):
+        from gptif.cl_image import stage
+
+        cache = get_local_image_cache()
+        image_id = cache.fetch_image_id(query)
+        if image_id is None:
+            return
+        image_data_bytes = cache.fetch_image(image_id)
+        if stage is None:
+            from gptif.ansi_images import image_to_ansi
+
+            image_to_ansi(image_data_bytes)
+
+    def _prefetch_portrait(self, agent):
+        from gptif.cl_image import portrait_prompt
+        from gptif.converse import cached_description
+
+        # Describing the agent costs an llm call that the player may never need,
+        # that's left to speculation (see gptif.speculation)
+        description = cached_description(agent)
+        if description is None:
+            return
+        # Keyed by the prompt from here on, so wait_for() finds it
+        self.prefetch_prompts([portrait_prompt(description)])
+
+    def _submit(self, key: str, fn, *args):
+        with self.lock:
+            if key in self.futures:
+                return
+            future = self.executor.submit(self._run, fn, *args)
+            self.futures[key] = future
+        # Outside the lock, the callback runs right away if the future is done already
+        future.add_done_callback(lambda future: self._forget(key, future))
+
+    def _forget(self, key: str, future: Future):
+        # Finished prefetches are cached on disk, failed ones are tried again
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as ex:
+            # The image is fetched again when it's shown
+            console.debug("Prefetch failed", ex)
+
+    def prefetch_prompts(self, prompts: List[str]):
+        for prompt in prompts:
+            query = AiImage(model_version=gptif.settings.IMAGE_MODEL_VERSION, prompt=prompt)
+            self._submit(LocalImageCache.prompt_key(query), self._prefetch, query)
+
+    def prefetch_portrait(self, agent):
+        self._submit("agent:" + agent.uid, self._prefetch_portrait, agent)
+
+    def wait_for(self, query: AiImage):
+        """Waits for a prefetch of the image that's already under way, rather than
+        fetching it a second time."""
+        with self.lock:
+            future = self.futures.get(LocalImageCache.prompt_key(query))
+        if future is not None:
+            future.result()
+
+
+image_prefetcher: Optional[ImagePrefetcher] = None
+
+
+def get_image_prefetcher() -> ImagePrefetcher:
+    global image_prefetcher
+    if image_prefetcher is None:
+        image_prefetcher = ImagePrefetcher()
+    return image_prefetcher
+
+
+def prefetch_images_near(world):
+    """Starts fetching the images for the rooms next to the player and the people here."""
+    if (
+        gptif.settings.CONVERSE_SERVER is None
+        or not gptif.settings.CLI_MODE
+        or not gptif.settings.IMAGE_PREFETCH
+    ):
+        return
+    room = world.current_room
+    # Exit visibility runs the room's scripts, so it's worked out here and not in
+    # the prefetch threads
+    prompts = [
+        world.rooms[exit.room_uid].image_prompt
+        for exit in room.exits.values()
+        if world.exit_visible(exit)
+    ]
+    prefetcher = get_image_prefetcher()
+    prefetcher.prefetch_prompts(prompts)
+    for agent in world.agents_in_room:
+        prefetcher.prefetch_portrait(agent)
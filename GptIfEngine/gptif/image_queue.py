@@ -0,0 +1,135 @@
+import threading
+from typing import Callable, Optional, Tuple
+
+import click
+
+import gptif.settings
+from gptif.console import console
+from gptif.db import (
+    AiImage,
+    AiImageJob,
+    claim_next_ai_image_job,
+    create_db_and_tables,
+    enqueue_ai_image_job,
+    finish_ai_image_job,
+    get_ai_image_if_cached,
+    put_ai_image_in_cache,
+    requeue_stale_ai_image_jobs,
+)
+
+# Jobs claimed longer ago than this are assumed to belong to a dead worker
+STALE_JOB_SECONDS = 120.0
+
+# Jobs with lower priorities are generated first.  Images nobody is waiting for yet
+# go after the ones players are waiting for.
+SPECULATIVE_PRIORITY = 10
+
+_wake_event = threading.Event()
+_worker: Optional["ImageWorker"] = None
+
+
+def request_image(
+    prompt: str, model_version: Optional[str] = None, priority: int = 0
+) -> Tuple[Optional[int], Optional[AiImageJob]]:
+    """Returns (image_id, None) if the image is cached, otherwise (None, job).
+
+    Never generates an image on the calling thread.
+    """
+    if model_version is None:
+        model_version = gptif.settings.IMAGE_MODEL_VERSION
+    query = AiImage(model_version=model_version, prompt=prompt)
+    ai_image = get_ai_image_if_cached(query)
+    if ai_image is not None:
+        assert ai_image.id is not None
+        return ai_image.id, None
+
+    job = enqueue_ai_image_job(query, priority)
+    if job.ai_image_id is not None:
+        return job.ai_image_id, None
+    _wake_event.set()
+    return None, job
+
+
+def process_job(job: AiImageJob) -> Optional[int]:
+    from gptif.cl_image import generate_image
+
+    assert job.id is not None
+    query = AiImage(model_version=job.model_version, prompt=job.prompt)
+    ai_image = get_ai_image_if_cached(query)
+    if ai_image is not None:
+        finish_ai_image_job(job.id, ai_image.id)
+        return ai_image.id
+
+    try:
+        image_data_bytes = generate_image(query)
+    except Exception as ex:
+        console.debug("Image job failed:", ex)
+        image_data_bytes = None
+
+    if image_data_bytes is None:
+        finish_ai_image_job(job.id, None)
+        return None
+
+    query.result = image_data_bytes
+    put_ai_image_in_cache(query)
+    finish_ai_image_job(job.id, query.id)
+    return query.id
+
+
+def process_jobs(keep_going: Callable[[], bool], poll_interval: float = 1.0) -> int:
+    """Claims and generates queued images while keep_going() is true.
+
+    Returns how many jobs were processed.
+    """
+    requeue_stale_ai_image_jobs(STALE_JOB_SECONDS)
+    processed = 0
+    while keep_going():
+        # Cleared before looking for jobs, so a job queued after the look still wakes
+        # the wait below
+        _wake_event.clear()
+        job = claim_next_ai_image_job()
+        if job is None:
+            _wake_event.wait(poll_interval)
+            continue
+        process_job(job)
+        processed += 1
+    return processed
+
+
+class ImageWorker(threading.Thread):
+    def __init__(self, poll_interval: float = 1.0):
+        super().__init__(name="ImageWorker", daemon=True)
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        process_jobs(lambda: not self.stopped.is_set(), self.poll_interval)
+
+    def stop(self):
+        self.stopped.set()
+        _wake_event.set()
+
+
+def start_image_worker() -> "ImageWorker":
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = ImageWorker()
+        _worker.start()
+    return _worker
+
+
+@click.command()
+@click.option("--poll-interval", default=1.0)
+def work(poll_interval: float):
+    create_db_and_tables()
+    worker = ImageWorker(poll_interval)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1.0)
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    work()
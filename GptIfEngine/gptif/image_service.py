@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+from typing import Any, Dict, Optional
+
+import bugsnag
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
+
+import gptif.settings
+from gptif.db import (
+    IMAGE_JOB_DONE,
+    AiImage,
+    get_ai_image_from_id,
+    get_ai_image_if_cached,
+    get_ai_image_job,
+    put_ai_image_in_cache,
+)
+from gptif.image_queue import request_image
+from gptif.service_common import (
+    ConcurrencyLimiter,
+    LoggerRouteHandler,
+    create_app,
+    start_services,
+)
+
+image_limiter = ConcurrencyLimiter(
+    "ImageService",
+    gptif.settings.IMAGE_SERVICE_MAX_CONCURRENT,
+    gptif.settings.IMAGE_SERVICE_MAX_QUEUE,
+)
+
+router = APIRouter(
+    route_class=LoggerRouteHandler, dependencies=[Depends(image_limiter)]
+)
+
+
+def _fetch_image_id_for_caption(query: AiImage) -> Optional[str]:
+    from gptif.cl_image import generate_image
+
+    ai_image = get_ai_image_if_cached(query)
+    if ai_image is None:
+        image_data_bytes = generate_image(query)
+
+        if image_data_bytes is None:
+            bugsnag.notify(Exception(f"Invalid image fetch query: {query.prompt}"))
+            return None
+        else:
+            query.result = image_data_bytes
+
+            put_ai_image_in_cache(query)
+
+            assert query.id is not None
+
+            return str(query.id)
+    return str(ai_image.id)
+
+
+@router.post("/api/fetch_image_id_for_caption")
+async def fetch_image_id_for_caption(query: AiImage) -> Optional[str]:
+    return await image_limiter.run(_fetch_image_id_for_caption, query)
+
+
+def _request_image_for_caption(query: AiImage, priority: int) -> Dict[str, Any]:
+    ai_image_id, job = request_image(query.prompt, query.model_version, priority)
+    if ai_image_id is not None:
+        return {"status": IMAGE_JOB_DONE, "image_id": ai_image_id, "job_id": None}
+    assert job is not None
+    return {"status": job.status, "image_id": None, "job_id": job.id}
+
+
+@router.post("/api/request_image_for_caption")
+async def request_image_for_caption(query: AiImage, priority: int = 0) -> Dict[str, Any]:
+    return await image_limiter.run(_request_image_for_caption, query, priority)
+
+
+@router.get("/api/ai_image_job/{job_id}")
+async def ai_image_job(job_id: int) -> Dict[str, Any]:
+    job = await image_limiter.run(get_ai_image_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such image job")
+    return {"status": job.status, "image_id": job.ai_image_id, "job_id": job.id}
+
+
+def image_etag(image_data_bytes: bytes) -> str:
+    return '"' + hashlib.sha256(image_data_bytes).hexdigest()[:32] + '"'
+
+
+def _image_response(image_id: int, if_none_match: Optional[str]) -> Optional[Response]:
+    ai_image = get_ai_image_from_id(image_id)
+    if ai_image is None:
+        return None
+    assert ai_image.result is not None
+    etag = image_etag(ai_image.result)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if if_none_match is not None and etag in (
+        tag.strip() for tag in if_none_match.split(",")
+    ):
+        # The client has this image already, skip the download
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=gzip.compress(ai_image.result),
+        media_type="image/png",
+        headers={"Content-Encoding": "gzip", **headers},
+    )
+
+
+@router.get(
+    "/api/ai_image/{image_id}",
+    responses={200: {"content": {"image/png": {}}}},
+    # Prevent FastAPI from adding "application/json" as an additional
+    # response media type in the autogenerated OpenAPI specification.
+    # https://github.com/tiangolo/fastapi/issues/3258
+    response_class=Response,
+)
+async def ai_image(
+    image_id: str, if_none_match: Optional[str] = Header(None)
+) -> Response:
+    response = await image_limiter.run(_image_response, int(image_id), if_none_match)
+    if response is None:
+        raise Exception("Oops")
+    return response
+
+
+# Standalone image tier: uvicorn gptif.image_service:app --port 8001
+app = create_app("GptIfImages")
+app.include_router(router)
+
+
+@app.on_event("startup")
+def on_startup():
+    start_services(image_worker=True)
@@ -0,0 +1,29 @@
+try:
+    import unzip_requirements
+except ImportError:
+    pass
+
+from gptif.backend_utils import logger, metrics
+from gptif.db import create_db_and_tables
+from gptif.image_queue import process_jobs
+
+create_db_and_tables()
+
+# Stop claiming jobs when less time than this is left, so the last image can finish
+# before the function times out
+JOB_TIME_MARGIN_MS = 60 * 1000
+
+
+def image_worker_handler(event, context):
+    # Run on a schedule, so the queue is drained even while no request is running
+    processed = process_jobs(
+        lambda: context.get_remaining_time_in_millis() > JOB_TIME_MARGIN_MS
+    )
+    logger.info(f"Processed {processed} image jobs")
+    return {"processed": processed}
+
+
+# Add logging
+handler = logger.inject_lambda_context(image_worker_handler, clear_state=True)
+# Add metrics last to properly flush metrics.
+handler = metrics.log_metrics(handler)
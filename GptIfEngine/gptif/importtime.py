@@ -0,0 +1,95 @@
+import json
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import click
+
+
+@dataclass
+class ImportRecord:
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(output: str) -> List[ImportRecord]:
+    """Parses the stderr of python -X importtime."""
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line
+            continue
+        records.append(ImportRecord(fields[2].strip(), int(fields[0]), int(fields[1])))
+    return records
+
+
+def measure(module: str) -> List[ImportRecord]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        errors = "\n".join(
+            line
+            for line in result.stderr.splitlines()
+            if not line.startswith("import time:")
+        )
+        raise click.ClickException(f"import {module} failed:\n{errors[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def summarize_imports(records: List[ImportRecord], top: int) -> Dict:
+    by_package: Dict[str, int] = defaultdict(int)
+    for record in records:
+        by_package[record.module.split(".")[0]] += record.self_us
+    total_us = sum(record.self_us for record in records)
+    return {
+        "total_ms": total_us / 1000.0,
+        "modules": len(records),
+        "packages_ms": {
+            package: us / 1000.0
+            for package, us in sorted(by_package.items(), key=lambda x: -x[1])[:top]
+        },
+        # Our own modules, which is where lazy imports can be added
+        "gptif_ms": {
+            record.module: record.cumulative_us / 1000.0
+            for record in sorted(records, key=lambda x: -x.cumulative_us)
+            if record.module.startswith("gptif")
+        },
+    }
+
+
+@click.command()
+@click.option("--module", default="gptif.dialogue_cache_server")
+@click.option("--top", default=20)
+@click.option("--budget-ms", default=None, type=float, help="Fail if imports take longer")
+@click.option("--output", default=None, help="Write the summary as JSON")
+def importtime(module: str, top: int, budget_ms: Optional[float], output: Optional[str]):
+    summary = summarize_imports(measure(module), top)
+
+    print(f"import {module}: {summary['total_ms']:.0f}ms over {summary['modules']} modules")
+    print("by top-level package (self time):")
+    for package, ms in summary["packages_ms"].items():
+        print(f"  {ms:8.1f}ms  {package}")
+    print("gptif modules (cumulative):")
+    for gptif_module, ms in summary["gptif_ms"].items():
+        print(f"  {ms:8.1f}ms  {gptif_module}")
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if budget_ms is not None and summary["total_ms"] > budget_ms:
+        print(f"Import time {summary['total_ms']:.0f}ms is over the {budget_ms:.0f}ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    importtime()
@@ -0,0 +1,449 @@
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import click
+import jinja2
+import yaml
+from jinja2 import nodes
+
+from gptif.content import (
+    AGENTS_PATH,
+    CHAPTER_PATHS,
+    PAGEBREAK,
+    ROOM_DESCRIPTIONS_PATH,
+    ROOMS_PATH,
+    SCENERY_ACTIONS_PATH,
+    SCENERY_PATH,
+    START_ROOM_ID,
+    load_sections,
+)
+
+ERROR = "error"
+WARNING = "warning"
+
+# The C loader when pyyaml was built with it, it's ten times faster
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+REQUIRED_AGENT_KEYS = ("Profile", "movement")
+REQUIRED_PROFILE_KEYS = (
+    "name",
+    "age",
+    "gender",
+    "occupation",
+    "personality",
+    "backstory",
+    "physical appearance",
+    "hobbies",
+    "goals",
+)
+REQUIRED_SCENERY_KEYS = ("hints", "names", "rooms")
+
+# World methods whose first argument is an agent uid
+AGENT_UID_METHODS = {"friends_with"}
+
+SYNSET_NAME_RE = re.compile(r"^[\w\-'.]+\.[nvasr]\.\d{2}$")
+
+# Synset names checked against wordnet before, so linting doesn't load wordnet
+# (which takes seconds) unless a name is new
+SYNSET_CACHE_PATH = "~/.gptif/synsets.json"
+
+
+@dataclass
+class LintMessage:
+    level: str
+    path: str
+    uid: Optional[str]
+    message: str
+
+    def __str__(self) -> str:
+        location = self.path if self.uid is None else f"{self.path} [{self.uid}]"
+        return f"{location}: {self.level}: {self.message}"
+
+
+@dataclass
+class Template:
+    path: str
+    uid: str
+    text: str
+    # The rooms the template is played in, None for the chapter intros
+    rooms: Optional[Tuple[str, ...]]
+
+
+class ContentLinter:
+    """Checks data/ for the mistakes that otherwise only show up while playing.
+
+    The room graph is checked without evaluating exit visibility, so a room counts
+    as reachable if any exit or move_to() leads to it.
+    """
+
+    def __init__(self, root: str = "."):
+        self.root = root
+        self.messages: List[LintMessage] = []
+        self.environment = jinja2.Environment()
+        self.templates: List[Template] = []
+        self.broken_templates = 0
+
+    def error(self, path: str, uid: Optional[str], message: str):
+        self.messages.append(LintMessage(ERROR, path, uid, message))
+
+    def warning(self, path: str, uid: Optional[str], message: str):
+        self.messages.append(LintMessage(WARNING, path, uid, message))
+
+    def _load_yaml(self, path: str) -> Dict:
+        try:
+            with open(os.path.join(self.root, path), "r") as fp:
+                loaded = yaml.load(fp, Loader=YAML_LOADER)
+        except (OSError, yaml.YAMLError) as ex:
+            self.error(path, None, str(ex))
+            return {}
+        if not isinstance(loaded, dict):
+            self.error(path, None, "expected a mapping of uids")
+            return {}
+        return loaded
+
+    def _load_sections(self, path: str) -> Dict[str, Dict[str, List[str]]]:
+        try:
+            return load_sections(os.path.join(self.root, path))
+        except (OSError, ValueError) as ex:
+            self.error(path, None, str(ex))
+            return {}
+
+    def run(self) -> List[LintMessage]:
+        rooms_yaml = self._load_yaml(ROOMS_PATH)
+        descriptions = self._load_sections(ROOM_DESCRIPTIONS_PATH)
+        scenery_yaml = self._load_yaml(SCENERY_PATH)
+        scenery_actions = self._load_sections(SCENERY_ACTIONS_PATH)
+        agents_yaml = self._load_yaml(AGENTS_PATH)
+
+        self.check_rooms(rooms_yaml, descriptions)
+        synset_names = self.check_scenery(scenery_yaml, scenery_actions, rooms_yaml)
+        self.check_agents(agents_yaml, rooms_yaml)
+        self.collect_chapter_templates()
+        scripted_moves = self.check_templates(rooms_yaml, agents_yaml)
+        self.check_room_graph(rooms_yaml, scripted_moves)
+        self.check_synsets(synset_names)
+        return self.messages
+
+    def check_rooms(self, rooms_yaml: Dict, descriptions: Dict[str, Dict[str, List[str]]]):
+        entered_by_exit = set(
+            exit.get("room")
+            for room_yaml in rooms_yaml.values()
+            for exit in (room_yaml.get("exits") or {}).values()
+        )
+        for room_uid, room_yaml in rooms_yaml.items():
+            if "title" not in room_yaml:
+                self.error(ROOMS_PATH, room_uid, "no title")
+            for direction, exit in (room_yaml.get("exits") or {}).items():
+                if exit.get("room") not in rooms_yaml:
+                    self.error(
+                        ROOMS_PATH,
+                        room_uid,
+                        f"exit {direction} leads to unknown room {exit.get('room')!r}",
+                    )
+                for script in ("visible", "prescript", "postscript"):
+                    if exit.get(script) is not None:
+                        self.templates.append(
+                            Template(
+                                ROOMS_PATH,
+                                f"{room_uid} {direction} {script}",
+                                str(exit[script]),
+                                (room_uid,),
+                            )
+                        )
+            if room_uid not in descriptions:
+                self.error(ROOM_DESCRIPTIONS_PATH, room_uid, "room has no descriptions")
+                continue
+            if "Long" not in descriptions[room_uid]:
+                self.error(ROOM_DESCRIPTIONS_PATH, room_uid, "no Long description")
+            if "Short" not in descriptions[room_uid] and room_uid in entered_by_exit:
+                # Shown when the player comes back
+                self.error(ROOM_DESCRIPTIONS_PATH, room_uid, "no Short description")
+            for description_name, sections in descriptions[room_uid].items():
+                if description_name.startswith("Tic"):
+                    tic = description_name.split(" ")
+                    if len(tic) != 2 or not tic[1].isdigit():
+                        self.error(
+                            ROOM_DESCRIPTIONS_PATH,
+                            room_uid,
+                            f"{description_name!r} should be \"Tic <time in room>\"",
+                        )
+                for section in sections:
+                    self.templates.append(
+                        Template(
+                            ROOM_DESCRIPTIONS_PATH,
+                            f"{room_uid} {description_name}",
+                            section,
+                            (room_uid,),
+                        )
+                    )
+        for room_uid in descriptions.keys():
+            if room_uid not in rooms_yaml:
+                self.warning(ROOM_DESCRIPTIONS_PATH, room_uid, "descriptions for an unknown room")
+
+    def check_scenery(
+        self,
+        scenery_yaml: Dict,
+        scenery_actions: Dict[str, Dict[str, List[str]]],
+        rooms_yaml: Dict,
+    ) -> Dict[str, List[str]]:
+        """Returns the scenery uids using each synset name."""
+        synset_names: Dict[str, List[str]] = {}
+        for scenery_uid, scenery in scenery_yaml.items():
+            missing = [key for key in REQUIRED_SCENERY_KEYS if key not in scenery]
+            if len(missing) > 0:
+                self.error(SCENERY_PATH, scenery_uid, f"missing {', '.join(missing)}")
+                continue
+            for room_uid in scenery["rooms"]:
+                if room_uid not in rooms_yaml:
+                    self.error(SCENERY_PATH, scenery_uid, f"in unknown room {room_uid!r}")
+            for name in scenery["names"]:
+                synset_names.setdefault(str(name), []).append(scenery_uid)
+            if scenery_uid not in scenery_actions:
+                self.error(SCENERY_ACTIONS_PATH, scenery_uid, "scenery has no actions")
+                continue
+            rooms = tuple(room for room in scenery["rooms"] if room in rooms_yaml)
+            for action, sections in scenery_actions[scenery_uid].items():
+                for section in sections:
+                    self.templates.append(
+                        Template(
+                            SCENERY_ACTIONS_PATH, f"{scenery_uid} {action}", section, rooms
+                        )
+                    )
+        for scenery_uid in scenery_actions.keys():
+            if scenery_uid not in scenery_yaml:
+                self.warning(SCENERY_ACTIONS_PATH, scenery_uid, "actions for unknown scenery")
+        return synset_names
+
+    def check_agents(self, agents_yaml: Dict, rooms_yaml: Dict):
+        for agent_uid, agent in agents_yaml.items():
+            missing = [key for key in REQUIRED_AGENT_KEYS if key not in agent]
+            missing += [
+                "Profile." + key
+                for key in REQUIRED_PROFILE_KEYS
+                if key not in (agent.get("Profile") or {})
+            ]
+            if len(missing) > 0:
+                self.error(AGENTS_PATH, agent_uid, f"missing {', '.join(missing)}")
+            starting_room = (agent.get("movement") or {}).get("starting_room")
+            if starting_room is not None and starting_room not in rooms_yaml:
+                self.error(AGENTS_PATH, agent_uid, f"starts in unknown room {starting_room!r}")
+            tics = agent.get("Tics")
+            if tics is not None:
+                dice = str(tics.get("percent_increase_per_tick", ""))
+                if not dice.endswith("t"):
+                    self.error(
+                        AGENTS_PATH,
+                        agent_uid,
+                        f"percent_increase_per_tick {dice!r} should be a total, e.g. 2d6t",
+                    )
+                for creative in tics.get("creative") or []:
+                    self.templates.append(
+                        Template(AGENTS_PATH, f"{agent_uid} tic", str(creative), None)
+                    )
+
+    def collect_chapter_templates(self):
+        for chapter, path in CHAPTER_PATHS.items():
+            try:
+                with open(os.path.join(self.root, path), "r") as fp:
+                    sections = fp.read().split(PAGEBREAK)
+            except OSError as ex:
+                self.error(path, None, str(ex))
+                continue
+            for section in sections:
+                self.templates.append(Template(path, f"chapter {chapter}", section, None))
+
+    def check_templates(
+        self, rooms_yaml: Dict, agents_yaml: Dict
+    ) -> List[Tuple[Optional[Tuple[str, ...]], str]]:
+        """Compiles every template.  Returns the (rooms, target room) of each
+        world.move_to() in them."""
+        scripted_moves = []
+        self.broken_templates = 0
+        for template in self.templates:
+            try:
+                tree = self.environment.parse(template.text)
+            except jinja2.TemplateSyntaxError as ex:
+                self.error(template.path, template.uid, f"line {ex.lineno}: {ex.message}")
+                self.broken_templates += 1
+                continue
+            for call in tree.find_all(nodes.Call):
+                method = _world_attribute(call.node)
+                if method is None or len(call.args) == 0:
+                    continue
+                argument = call.args[0]
+                if not isinstance(argument, nodes.Const):
+                    continue
+                if method == "move_to":
+                    if argument.value not in rooms_yaml:
+                        self.error(
+                            template.path,
+                            template.uid,
+                            f"move_to unknown room {argument.value!r}",
+                        )
+                    else:
+                        scripted_moves.append((template.rooms, argument.value))
+                elif method in AGENT_UID_METHODS and argument.value not in agents_yaml:
+                    self.error(
+                        template.path,
+                        template.uid,
+                        f"{method} unknown agent {argument.value!r}",
+                    )
+            for getitem in tree.find_all(nodes.Getitem):
+                if (
+                    _world_attribute(getitem.node) == "agents"
+                    and isinstance(getitem.arg, nodes.Const)
+                    and getitem.arg.value not in agents_yaml
+                ):
+                    self.error(
+                        template.path,
+                        template.uid,
+                        f"unknown agent {getitem.arg.value!r}",
+                    )
+        return scripted_moves
+
+    def check_room_graph(
+        self,
+        rooms_yaml: Dict,
+        scripted_moves: List[Tuple[Optional[Tuple[str, ...]], str]],
+    ):
+        if START_ROOM_ID not in rooms_yaml:
+            self.error(ROOMS_PATH, START_ROOM_ID, "the starting room is missing")
+            return
+        if self.broken_templates > 0:
+            # Their move_to()s are missing from the graph, every room after them
+            # would look unreachable
+            self.warning(ROOMS_PATH, None, "room graph not checked until the templates compile")
+            return
+        edges: Dict[str, Set[str]] = {room_uid: set() for room_uid in rooms_yaml}
+        for room_uid, room_yaml in rooms_yaml.items():
+            for exit in (room_yaml.get("exits") or {}).values():
+                if exit.get("room") in rooms_yaml:
+                    edges[room_uid].add(exit["room"])
+        roots = {START_ROOM_ID}
+        for rooms, target in scripted_moves:
+            if rooms is None:
+                # Chapter intros can move the player anywhere
+                roots.add(target)
+            else:
+                for room_uid in rooms:
+                    edges[room_uid].add(target)
+
+        reachable = set(roots)
+        frontier = deque(roots)
+        while len(frontier) > 0:
+            for next_room in edges[frontier.popleft()]:
+                if next_room not in reachable:
+                    reachable.add(next_room)
+                    frontier.append(next_room)
+
+        for room_uid in rooms_yaml.keys():
+            if room_uid not in reachable:
+                self.warning(ROOMS_PATH, room_uid, "no way to reach this room")
+            elif len(edges[room_uid] - {room_uid}) == 0:
+                self.warning(ROOMS_PATH, room_uid, "dead end, no exits or scripted moves out")
+
+    def check_synsets(self, synset_names: Dict[str, List[str]]):
+        for name, scenery_uids in synset_names.items():
+            if not SYNSET_NAME_RE.match(name):
+                self.error(
+                    SCENERY_PATH,
+                    ", ".join(scenery_uids),
+                    f"{name!r} isn't a synset name like car.n.01",
+                )
+        names = [name for name in synset_names if SYNSET_NAME_RE.match(name)]
+        known = check_synset_names(names)
+        if known is None:
+            self.warning(
+                SCENERY_PATH,
+                None,
+                "wordnet isn't installed, synset names weren't checked (nltk.download('wordnet'))",
+            )
+            return
+        for name in names:
+            if not known[name]:
+                self.error(
+                    SCENERY_PATH,
+                    ", ".join(synset_names[name]),
+                    f"no such synset {name!r}",
+                )
+
+
+def _world_attribute(node: nodes.Node) -> Optional[str]:
+    """"x" for world.x"""
+    if (
+        isinstance(node, nodes.Getattr)
+        and isinstance(node.node, nodes.Name)
+        and node.node.name == "world"
+    ):
+        return node.attr
+    return None
+
+
+def _read_synset_cache() -> Dict[str, bool]:
+    try:
+        with open(os.path.expanduser(SYNSET_CACHE_PATH), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_synset_cache(known: Dict[str, bool]):
+    path = os.path.expanduser(SYNSET_CACHE_PATH)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            json.dump(known, fp, indent=1, sort_keys=True)
+    except OSError:
+        pass
+
+
+def check_synset_names(names: Iterable[str]) -> Optional[Dict[str, bool]]:
+    """Whether each name is a wordnet synset, None if wordnet isn't installed and
+    some names weren't checked before."""
+    known = _read_synset_cache()
+    unchecked = [name for name in names if name not in known]
+    if len(unchecked) == 0:
+        return known
+
+    from nltk.corpus import wordnet
+    from nltk.corpus.reader.wordnet import WordNetError
+
+    try:
+        wordnet.ensure_loaded()
+    except LookupError:
+        return None
+    for name in unchecked:
+        try:
+            wordnet.synset(name)
+            known[name] = True
+        except (WordNetError, ValueError):
+            known[name] = False
+    _write_synset_cache(known)
+    return known
+
+
+@click.command()
+@click.option("--root", default=".", help="The directory containing data/")
+@click.option("--quiet", default=False, is_flag=True, help="Only print errors")
+def lint(root: str, quiet: bool):
+    start_time = time.perf_counter()
+    messages = ContentLinter(root).run()
+    errors = [message for message in messages if message.level == ERROR]
+    for message in messages:
+        if message.level == ERROR or not quiet:
+            click.echo(str(message))
+    elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+    click.echo(
+        f"{len(errors)} errors, {len(messages) - len(errors)} warnings in {elapsed_ms:.0f} ms"
+    )
+    sys.exit(1 if len(errors) > 0 else 0)
+
+
+if __name__ == "__main__":
+    lint()
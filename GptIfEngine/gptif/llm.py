@@ -1,16 +1,23 @@
 import multiprocessing
 import os
+import threading
 import time
-from typing import List, Optional
-
-import requests
-from rich.progress import Progress
+from typing import List, Optional, Set
 
 from gptif.console import console
+from gptif.profiling import LLM, timed
 
 
 class LargeLanguageModel:
-    def llm(self, question: str, stop: List[str] = [], echo: bool = False) -> str:
+    def llm(
+        self,
+        question: str,
+        stop: List[str] = [],
+        echo: bool = False,
+        prefix: Optional[str] = None,
+    ) -> str:
+        """prefix is the start of question that is shared with other calls
+        (e.g. a character's profile), for backends that can reuse its evaluation."""
         raise NotImplementedError()
 
     def model_name(self):
@@ -22,11 +29,20 @@ class LlamaCppLanguageModel:
 
     def __init__(self):
         self.llm_model = None
+        self.warm_prefixes: Set[str] = set()
+        # The model isn't thread safe, and speculation calls it in the background
+        self.lock = threading.Lock()
 
     def model_name(self):
         return LlamaCppLanguageModel.MODEL_NAME
 
-    def llm(self, question: str, stop: List[str] = [], echo: bool = False) -> str:
+    def count_tokens(self, text: str) -> int:
+        if self.llm_model is None:
+            with self.lock:
+                self.load_model()
+        return len(self.llm_model.tokenize(text.encode("utf-8")))  # type: ignore
+
+    def load_model(self):
         if self.llm_model == None:
             model_path = f"gpt_models/{self.model_name()}"
             if not os.path.exists(model_path):
@@ -39,17 +55,43 @@ class LlamaCppLanguageModel:
                 download_file(
                     f"https://huggingface.co/TheBloke/koala-13B-GPTQ-4bit-128g-GGML/resolve/main/{self.model_name()}"
                 )
-            from llama_cpp import Llama
+            import llama_cpp
 
-            self.llm_model = Llama(
+            self.llm_model = llama_cpp.Llama(
                 model_path=model_path,
                 n_ctx=2048,
                 n_threads=multiprocessing.cpu_count(),
                 embedding=True,
                 verbose=False,
             )
-
-        return self.llm_model(question, stop=stop, echo=echo)["choices"][0]["text"]  # type: ignore
+            if hasattr(llama_cpp, "LlamaCache"):
+                # Keeps the model state after each prompt, so a prompt that starts
+                # with an evaluated prefix only evaluates the rest
+                self.llm_model.set_cache(llama_cpp.LlamaCache())
+
+    @timed(LLM)
+    def llm(
+        self,
+        question: str,
+        stop: List[str] = [],
+        echo: bool = False,
+        prefix: Optional[str] = None,
+    ) -> str:
+        with self.lock:
+            self.load_model()
+            assert self.llm_model is not None
+
+            if (
+                prefix is not None
+                and question.startswith(prefix)
+                and prefix not in self.warm_prefixes
+                and hasattr(self.llm_model, "cache")
+            ):
+                # Evaluate the prefix alone once so it's cached for every turn after this one
+                self.llm_model(prefix, max_tokens=1)
+                self.warm_prefixes.add(prefix)
+
+            return self.llm_model(question, stop=stop, echo=echo)["choices"][0]["text"]  # type: ignore
 
 
 class OpenAiLanguageModel:
@@ -59,7 +101,14 @@ class OpenAiLanguageModel:
     def model_name(self):
         return "gpt-3.5-turbo"
 
-    def llm(self, question: str, stop: Optional[List[str]] = None, echo: bool = False) -> str:
+    @timed(LLM)
+    def llm(
+        self,
+        question: str,
+        stop: Optional[List[str]] = None,
+        echo: bool = False,
+        prefix: Optional[str] = None,
+    ) -> str:
         import openai
 
         openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -85,6 +134,9 @@ class OpenAiLanguageModel:
 
 
 def download_file(url):
+    import requests
+    from rich.progress import Progress
+
     local_filename = url.split("/")[-1]
     # NOTE the stream=True parameter below
     try:
@@ -117,3 +169,9 @@ def download_file(url):
 
 # llm = LlamaCppLanguageModel()
 llm = OpenAiLanguageModel()
+
+
+def set_llm(model) -> None:
+    """Swaps the model used by the engine (e.g. for benchmarks and fixtures)."""
+    global llm
+    llm = model
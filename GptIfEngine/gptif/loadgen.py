@@ -0,0 +1,358 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import click
+import httpx
+
+from gptif.bench import summarize
+from gptif.console import DEBUG_INPUT
+
+# How often the db connection pool is inspected
+POOL_SAMPLE_INTERVAL_SECONDS = 0.05
+# Production's Postgres engine gets SQLAlchemy's default QueuePool, this size
+PRODUCTION_POOL_SIZE = 5
+PRODUCTION_MAX_OVERFLOW = 10
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.players_finished = 0
+        self.pool_checked_out: List[int] = []
+        self.pool_size: Optional[int] = None
+
+    def record(self, endpoint: str, seconds: float, error: Optional[str]):
+        self.latencies[endpoint].append(seconds * 1000.0)
+        if error is not None:
+            self.errors[f"{endpoint}: {error}"] += 1
+
+
+def use_production_pool():
+    """Reopens an in-process sqlite db with a pool sized like production's.
+
+    sqlite engines get a NullPool, which has nothing to sample, so the report
+    couldn't say whether the pool saturates.
+    """
+    import gptif.db
+    from sqlalchemy.pool import QueuePool
+    from sqlmodel import create_engine
+
+    engine = gptif.db.engine
+    if engine is None or engine.url.get_backend_name() != "sqlite":
+        return
+    gptif.db.engine = create_engine(
+        engine.url,
+        echo=False,
+        pool_pre_ping=True,
+        poolclass=QueuePool,
+        pool_size=PRODUCTION_POOL_SIZE,
+        max_overflow=PRODUCTION_MAX_OVERFLOW,
+        connect_args={"check_same_thread": False},
+    )
+    engine.dispose()
+
+
+class PoolSampler(threading.Thread):
+    """Samples the in-process engine's connection pool.
+
+    Runs on its own thread because the request handlers block the event loop.
+    """
+
+    def __init__(self, stats: LoadStats):
+        super().__init__(name="PoolSampler", daemon=True)
+        self.stats = stats
+        self.stopped = threading.Event()
+
+    def run(self):
+        import gptif.db
+
+        while not self.stopped.wait(POOL_SAMPLE_INTERVAL_SECONDS):
+            if gptif.db.engine is None:
+                continue
+            pool = gptif.db.engine.pool
+            if not hasattr(pool, "checkedout"):
+                # e.g. NullPool/SingletonThreadPool for sqlite
+                continue
+            self.stats.pool_checked_out.append(pool.checkedout())
+            self.stats.pool_size = pool.size()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+async def timed_request(
+    client: httpx.AsyncClient,
+    stats: LoadStats,
+    endpoint: str,
+    **kwargs,
+) -> Optional[httpx.Response]:
+    start_time = time.perf_counter()
+    try:
+        response = await client.post(f"/api/{endpoint}", **kwargs)
+    except httpx.HTTPError as ex:
+        stats.record(endpoint, time.perf_counter() - start_time, type(ex).__name__)
+        return None
+    stats.record(
+        endpoint,
+        time.perf_counter() - start_time,
+        None if response.status_code == 200 else f"HTTP {response.status_code}",
+    )
+    return response if response.status_code == 200 else None
+
+
+async def run_player(
+    client: httpx.AsyncClient,
+    stats: LoadStats,
+    commands: List[str],
+    think_time: float,
+    start_delay: float,
+    rng: random.Random,
+    semaphore: asyncio.Semaphore,
+):
+    await asyncio.sleep(start_delay)
+    async with semaphore:
+        response = await timed_request(client, stats, "begin_game")
+        if response is None:
+            return
+        session_cookie = response.cookies.get("session_cookie")
+        if session_cookie is None:
+            stats.errors["begin_game: missing session cookie"] += 1
+            return
+        # Send the cookie explicitly, the client's cookie jar is shared by all players
+        headers = {"Cookie": f"session_cookie={session_cookie}"}
+        for command in commands:
+            if think_time > 0:
+                await asyncio.sleep(rng.expovariate(1.0 / think_time))
+            await timed_request(
+                client,
+                stats,
+                "handle_input",
+                json={"command": command},
+                headers=headers,
+            )
+        stats.players_finished += 1
+
+
+def load_command_histories(history_sql_url: Optional[str]) -> List[List[str]]:
+    if history_sql_url is None:
+        return [list(DEBUG_INPUT)]
+    from gptif.db import create_db_and_tables, get_game_command_histories
+
+    os.environ["SQL_URL"] = history_sql_url
+    create_db_and_tables()
+    histories = get_game_command_histories(min_commands=2)
+    if len(histories) == 0:
+        click.echo(f"No game commands in {history_sql_url}, using DEBUG_INPUT")
+        return [list(DEBUG_INPUT)]
+    return histories
+
+
+def build_report(
+    stats: LoadStats, players: int, wall_seconds: float
+) -> Dict[str, Any]:
+    commands_sent = len(stats.latencies["handle_input"])
+    report: Dict[str, Any] = {
+        "players": players,
+        "players_finished": stats.players_finished,
+        "wall_seconds": wall_seconds,
+        "commands_per_second": commands_sent / wall_seconds if wall_seconds > 0 else 0.0,
+        "requests_per_second": sum(len(x) for x in stats.latencies.values())
+        / wall_seconds
+        if wall_seconds > 0
+        else 0.0,
+        "latency_ms": {
+            endpoint: summarize(values) for endpoint, values in stats.latencies.items()
+        },
+        "error_rate": {
+            endpoint: sum(
+                count
+                for error, count in stats.errors.items()
+                if error.startswith(endpoint + ":")
+            )
+            / max(1, len(values))
+            for endpoint, values in stats.latencies.items()
+        },
+        "errors": dict(stats.errors.most_common()),
+    }
+    if len(stats.pool_checked_out) > 0:
+        report["db_pool"] = {
+            "size": stats.pool_size,
+            "max_checked_out": max(stats.pool_checked_out),
+            "mean_checked_out": sum(stats.pool_checked_out)
+            / len(stats.pool_checked_out),
+            # Fraction of samples where every pooled connection was in use
+            "saturated": sum(
+                1 for x in stats.pool_checked_out if x >= (stats.pool_size or 0)
+            )
+            / len(stats.pool_checked_out),
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"{report['players_finished']}/{report['players']} players finished in {report['wall_seconds']:.1f}s"
+    )
+    print(
+        f"throughput: {report['commands_per_second']:.1f} commands/s, {report['requests_per_second']:.1f} requests/s"
+    )
+    for endpoint, summary in report["latency_ms"].items():
+        print(
+            f"  {endpoint:<14} n={summary['count']:<6} p50 {summary['p50']:8.1f}  p95 {summary['p95']:8.1f}  p99 {summary['p99']:8.1f}  max {summary['max']:8.1f}  errors {report['error_rate'][endpoint] * 100.0:.1f}%"
+        )
+    for error, count in report["errors"].items():
+        print(f"  {count:6}  {error}")
+    if "db_pool" in report:
+        pool = report["db_pool"]
+        print(
+            f"db pool: size {pool['size']}, max checked out {pool['max_checked_out']}, mean {pool['mean_checked_out']:.2f}, saturated {pool['saturated'] * 100.0:.1f}% of the time"
+        )
+    else:
+        print("db pool: not sampled (only the in-process app's pool can be sampled)")
+
+
+async def run_load(
+    url: Optional[str],
+    histories: List[List[str]],
+    players: int,
+    commands_per_player: int,
+    concurrency: int,
+    think_time: float,
+    ramp_up: float,
+    timeout: float,
+    seed: int,
+) -> Dict[str, Any]:
+    stats = LoadStats()
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    app = None
+    pool_sampler = None
+    if url is None:
+        from gptif.dialogue_cache_server import app
+
+        # ASGITransport doesn't send lifespan events
+        await app.router.startup()
+        use_production_pool()
+        transport: httpx.AsyncBaseTransport = httpx.ASGITransport(app=app)  # type: ignore
+        base_url = "http://loadgen"
+        pool_sampler = PoolSampler(stats)
+        pool_sampler.start()
+    else:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=concurrency)
+        )
+        base_url = url
+
+    start_time = time.perf_counter()
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=timeout
+    ) as client:
+        tasks = []
+        for player_index in range(players):
+            history = rng.choice(histories)
+            tasks.append(
+                run_player(
+                    client,
+                    stats,
+                    history[:commands_per_player],
+                    think_time,
+                    ramp_up * player_index / max(1, players),
+                    random.Random(rng.random()),
+                    semaphore,
+                )
+            )
+        await asyncio.gather(*tasks)
+    wall_seconds = time.perf_counter() - start_time
+
+    if pool_sampler is not None:
+        pool_sampler.stop()
+    if app is not None:
+        await app.router.shutdown()
+
+    return build_report(stats, players, wall_seconds)
+
+
+@click.command()
+@click.option(
+    "--url",
+    default=None,
+    help="Server to load (default: in-process app).  DB pool saturation is only reported in-process.",
+)
+@click.option("--players", default=100)
+@click.option("--commands-per-player", default=20)
+@click.option("--concurrency", default=100, help="Players active at the same time")
+@click.option("--think-time", default=0.0, help="Mean seconds between commands")
+@click.option("--ramp-up", default=0.0, help="Seconds over which players join")
+@click.option("--timeout", default=60.0)
+@click.option("--seed", default=0)
+@click.option(
+    "--history-sql-url", default=None, help="Sample commands from this GameCommand table"
+)
+@click.option("--sql-url", default=None, help="Database for the in-process app")
+@click.option("--fixture-latency", default="none", help="Upstream latency in-process")
+@click.option("--fixture-cassette", default=None)
+@click.option("--report", default=None, help="Write the report as JSON")
+def loadgen(
+    url: Optional[str],
+    players: int,
+    commands_per_player: int,
+    concurrency: int,
+    think_time: float,
+    ramp_up: float,
+    timeout: float,
+    seed: int,
+    history_sql_url: Optional[str],
+    sql_url: Optional[str],
+    fixture_latency: str,
+    fixture_cassette: Optional[str],
+    report: Optional[str],
+):
+    histories = load_command_histories(history_sql_url)
+
+    if url is None:
+        os.environ["SQL_URL"] = (
+            sql_url
+            if sql_url is not None
+            else "sqlite:///" + tempfile.mkdtemp(prefix="gptif_loadgen")
+        )
+        if "GPTIF_SECRET_KEY" not in os.environ:
+            os.environ["GPTIF_SECRET_KEY"] = base64.b64encode(os.urandom(32)).decode()
+        # Never send load test traffic to the real upstreams
+        os.environ["GPTIF_FIXTURE_MODE"] = "replay"
+        os.environ["GPTIF_FIXTURE_LATENCY"] = fixture_latency
+        os.environ["GPTIF_FIXTURE_SEED"] = str(seed)
+        if fixture_cassette is not None:
+            os.environ["GPTIF_FIXTURE_CASSETTE"] = fixture_cassette
+
+    results = asyncio.run(
+        run_load(
+            url,
+            histories,
+            players,
+            commands_per_player,
+            concurrency,
+            think_time,
+            ramp_up,
+            timeout,
+            seed,
+        )
+    )
+    print_report(results)
+    if report is not None:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    loadgen()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (ca != cb),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def max_typos(name: str) -> int:
+    """How many edits a typed name can be from a real one, short names must be exact."""
+    if len(name) <= 3:
+        return 0
+    if len(name) == 4:
+        return 1
+    return 2
+
+
+@dataclass
+class BkTreeNode:
+    word: str
+    children: Dict[int, BkTreeNode] = field(default_factory=dict)
+
+
+class BkTree:
+    """Finds the words within an edit distance without comparing against all of them."""
+
+    def __init__(self, words: Iterable[str]):
+        self.root: Optional[BkTreeNode] = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = BkTreeNode(word)
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(word, node.word)
+            if distance == 0:
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = BkTreeNode(word)
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """(distance, word) for every word within max_distance, closest first."""
+        if self.root is None:
+            return []
+        results = []
+        nodes = [self.root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            distance = edit_distance(word, node.word)
+            if distance <= max_distance:
+                results.append((distance, node.word))
+            # The triangle inequality rules out every other subtree
+            for child_distance, child in node.children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(results)
+
+
+@dataclass
+class NameMatch:
+    uids: List[str]
+    # The name the match was made on, which differs from the typed one for typos
+    name: str
+    fuzzy: bool
+
+    @property
+    def ambiguous(self) -> bool:
+        return len(self.uids) > 1
+
+
+class NameIndex:
+    """Names, aliases and first names of agents, case folded, to agent uids."""
+
+    def __init__(self, names_by_uid: Iterable[Tuple[str, Iterable[str]]]):
+        self.uids_by_name: Dict[str, List[str]] = {}
+        self.order: Dict[str, int] = {}
+        for uid, names in names_by_uid:
+            self.order[uid] = len(self.order)
+            for name in sorted(set(normalize_name(name) for name in names)):
+                self.uids_by_name.setdefault(name, []).append(uid)
+        self.tree = BkTree(self.uids_by_name.keys())
+
+    def lookup(self, name: str) -> List[str]:
+        """Exact (case insensitive) matches, in agent order."""
+        return self.uids_by_name.get(normalize_name(name), [])
+
+    def resolve(self, name: str, fuzzy: bool = True) -> Optional[NameMatch]:
+        """The agents called name, or else the closest names within a few typos."""
+        normalized = normalize_name(name)
+        uids = self.uids_by_name.get(normalized)
+        if uids is not None:
+            return NameMatch(uids, normalized, False)
+        if not fuzzy:
+            return None
+        candidates = self.tree.search(normalized, max_typos(normalized))
+        if len(candidates) == 0:
+            return None
+        best_distance = candidates[0][0]
+        uids = []
+        matched_names = []
+        for distance, candidate in candidates:
+            if distance != best_distance:
+                break
+            matched_names.append(candidate)
+            for uid in self.uids_by_name[candidate]:
+                if uid not in uids:
+                    uids.append(uid)
+        return NameMatch(sorted(uids, key=self.order.__getitem__), matched_names[0], True)
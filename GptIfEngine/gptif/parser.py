@@ -2,17 +2,17 @@ import os
 
 os.environ["NLTK_DATA"] = "nltk_data"
 
-from typing import Dict, List, Optional, Set, cast
+from typing import Dict, FrozenSet, List, Optional, Set, cast
 import nltk
 from nltk.corpus import wordnet
 from nltk.tokenize import word_tokenize
 from nltk import Nonterminal, nonterminals, Production, CFG
 from nltk.corpus import verbnet
+import functools
 import yaml
-import spacy
 from collections.abc import Iterable
 from gptif.console import console
-from spacy.symbols import nsubj
+from gptif.profiling import PARSE, timed
 
 
 def flatten(xs):
@@ -33,6 +33,9 @@ nlp = None
 def init_nlp():
     global nlp
     if nlp is None:
+        # spacy takes most of a second to import, only pay for it when parsing
+        import spacy
+
         if "STAGE" in os.environ:
             nlp = spacy.load(f"/var/task/en_core_web_sm/en_core_web_sm-3.5.0")
         else:
@@ -43,23 +46,32 @@ class ParseException(Exception):
     pass
 
 
-def get_verb_classes(verb: str) -> Set[str]:
-    return set(
+def warm_up_parser(load_spacy: bool = True):
+    """Loads the lexical corpora (and the spacy model) so the first command is fast."""
+    verbnet.ensure_loaded()
+    try:
+        wordnet.ensure_loaded()
+    except LookupError as le:
+        # Only LOOK AT needs wordnet, don't fail startup without it
+        console.debug("Could not load wordnet:", le)
+    get_verb_classes("go")
+    if load_spacy:
+        init_nlp()
+
+
+@timed(PARSE)
+@functools.lru_cache(maxsize=4096)
+def get_verb_classes(verb: str) -> FrozenSet[str]:
+    return frozenset(
         [verbnet.shortid(x).split(".")[0] for x in verbnet.classids(lemma=verb.lower())]
     )
 
 
+@timed(PARSE)
 def get_verb_classes_for_list(verbs: Iterable[str]) -> Set[str]:
-    retval = set()
+    retval: Set[str] = set()
     for verb in verbs:
-        retval.update(
-            set(
-                [
-                    verbnet.shortid(x).split(".")[0]
-                    for x in verbnet.classids(lemma=verb.lower())
-                ]
-            )
-        )
+        retval.update(get_verb_classes(verb))
     return retval
 
 
@@ -228,7 +240,10 @@ def handle_user_input(user_input: str):
             console.debug(action["action"])
 
 
+@timed(PARSE)
 def get_direct_object(command: str) -> str:
+    from spacy.symbols import nsubj
+
     global nlp
     init_nlp()
     # user_input_tokens = word_tokenize(user_input)
@@ -284,7 +299,9 @@ def get_hypernyms(s: str):
     return object_hypernyms
 
 
-def get_hypernyms_set(s: str):
+@timed(PARSE)
+@functools.lru_cache(maxsize=4096)
+def get_hypernyms_set(s: str) -> FrozenSet[str]:
     object_hypernyms = [
         x.name()  # type: ignore
         for x in flatten(
@@ -294,7 +311,7 @@ def get_hypernyms_set(s: str):
             ]
         )
     ]
-    return set(object_hypernyms)
+    return frozenset(object_hypernyms)
 
 
 if __name__ == "__main__":
@@ -10,10 +10,13 @@ import click
 from rich.markdown import Markdown
 
 import gptif.settings
+from gptif.completion import CompletionService
 from gptif.console import console
 from gptif.converse import check_if_more_friendly, converse
 from gptif.db import GameState, create_db_and_tables
+from gptif.fixtures import RECORD, REPLAY, configure_fixtures
 from gptif.handle_input import handle_input
+from gptif.image_cache import prefetch_images_near
 from gptif.parser import (
     ParseException,
     get_direct_object,
@@ -31,23 +34,81 @@ class DummyContext(object):
         pass
 
 
+def enable_tab_completion(completion_service: CompletionService):
+    try:
+        import readline
+    except ImportError:
+        # Windows
+        return
+
+    matches = []
+
+    def completer(text: str, state: int) -> Optional[str]:
+        nonlocal matches
+        if state == 0:
+            matches = completion_service.complete(text)
+        return matches[state] if state < len(matches) else None
+
+    # Complete the whole line, commands have spaces in them
+    readline.set_completer_delims("")
+    readline.set_completer(completer)
+    if "libedit" in (readline.__doc__ or ""):
+        # macOS
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+
+
 @click.command()
 @click.option("--debug", default=False, is_flag=True)
+@click.option(
+    "--dev",
+    default=False,
+    is_flag=True,
+    help="Reload rooms and agents from data/ when they're edited",
+)
 @click.option("--no-converse-server", default=False, is_flag=True)
 @click.option(
     "--converse-server-url",
     default="https://i00ny5xb4e.execute-api.us-east-1.amazonaws.com",
 )
+@click.option(
+    "--image-server-url",
+    default=None,
+    help="Image tier, if it is not served by the converse server",
+)
 @click.option("--sql-url", default=None)
+@click.option(
+    "--fixture-mode",
+    type=click.Choice([REPLAY, RECORD]),
+    default=None,
+    help="Serve (or record) LLM and image responses from a cassette file",
+)
+@click.option("--fixture-cassette", default=None)
+@click.option("--fixture-latency", default="recorded")
+@click.option("--fixture-error-rate", default=0.0)
 def play(
     debug: bool,
+    dev: bool,
     no_converse_server: bool,
     converse_server_url: str,
+    image_server_url: Optional[str],
     sql_url: Optional[str],
+    fixture_mode: Optional[str],
+    fixture_cassette: Optional[str],
+    fixture_latency: str,
+    fixture_error_rate: float,
 ):
     if sql_url is not None:
         os.environ["SQL_URL"] = sql_url
 
+    if fixture_mode is not None:
+        # The converse server would answer with its own models
+        no_converse_server = True
+        configure_fixtures(
+            fixture_cassette, fixture_mode, fixture_latency, fixture_error_rate
+        )
+
     gptif.settings.CLI_MODE = True
 
     if debug:
@@ -56,10 +117,18 @@ def play(
     if no_converse_server == False:
         gptif.settings.RUN_LOCALLY = False
         gptif.settings.CONVERSE_SERVER = converse_server_url
+        gptif.settings.IMAGE_SERVER = image_server_url
 
     create_db_and_tables()
 
     world = World()
+    completion_service = CompletionService()
+    content_reloader = None
+    if dev:
+        from gptif.hot_reload import ContentReloader
+
+        content_reloader = ContentReloader()
+    enable_tab_completion(completion_service)
 
     with DummyContext():
         world.start_chapter_one()
@@ -81,6 +150,8 @@ def play(
                         print(game_state)
                         print(new_game_state)
                         assert False
+                completion_service.update(world)
+                prefetch_images_near(world)
                 try:
                     command = console.get_input(">").strip()
                 except KeyboardInterrupt as ki:
@@ -88,6 +159,9 @@ def play(
                     console.print("[blue]Thanks for playing![/]")
                     return
 
+                if content_reloader is not None:
+                    content_reloader.reload_if_changed(world)
+
                 if handle_input(world, command) == False:
                     return
             while world.waiting_for_player is False:
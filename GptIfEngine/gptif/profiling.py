@@ -0,0 +1,165 @@
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+PARSE = "parse"
+WORLD_LOAD = "world_load"
+LLM = "llm"
+IMAGE = "image"
+SAVE = "save"
+
+PROFILE_HEADER = "X-Gptif-Profile"
+
+# How often the sampling profiler looks at the request's stack
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_sample_random = random.Random()
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class StackSampler(threading.Thread):
+    """Periodically records which function a thread is running.
+
+    Unlike cProfile this costs nothing per function call, so it is safe to
+    leave on for a fraction of production traffic.
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name="StackSampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[Tuple[str, str, int]] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            # Attribute the sample to the innermost frame in our own code if there is one
+            leaf = frame
+            while frame is not None:
+                if "gptif" in frame.f_code.co_filename:
+                    leaf = frame
+                    break
+                frame = frame.f_back
+            self.samples[
+                (
+                    os.path.basename(leaf.f_code.co_filename),
+                    leaf.f_code.co_name,
+                    leaf.f_lineno,
+                )
+            ] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, sample: bool):
+        self.phase_seconds: Dict[str, float] = defaultdict(float)
+        self.total_seconds = 0.0
+        # Phases currently being timed, so nested calls aren't counted twice
+        self.active_phases: Set[str] = set()
+        self.sampler: Optional[StackSampler] = None
+        if sample:
+            self.sampler = StackSampler(threading.get_ident())
+
+    def top_samples(self, n: int = 10) -> List[Tuple[str, int]]:
+        if self.sampler is None:
+            return []
+        return [
+            (f"{filename}:{function}:{lineno}", count)
+            for (filename, function, lineno), count in self.sampler.samples.most_common(
+                n
+            )
+        ]
+
+
+_profile_contextvar: contextvars.ContextVar[
+    Optional[RequestProfile]
+] = contextvars.ContextVar("request_profile", default=None)
+
+# Sampled stacks aggregated by command verb for the lifetime of the process
+samples_by_verb: Dict[str, Counter[Tuple[str, str, int]]] = defaultdict(Counter)
+
+
+def should_sample(profile_header: Optional[str] = None) -> bool:
+    if profile_header is not None and profile_header not in ("", "0"):
+        return True
+    if os.environ.get("GPTIF_PROFILE", "0") == "1":
+        return True
+    sample_rate = float(os.environ.get("GPTIF_PROFILE_SAMPLE_RATE", "0"))
+    return sample_rate > 0 and _sample_random.random() < sample_rate
+
+
+@contextlib.contextmanager
+def profile_request(sample: bool = False) -> Iterator[RequestProfile]:
+    profile = RequestProfile(sample)
+    token = _profile_contextvar.set(profile)
+    if profile.sampler is not None:
+        profile.sampler.start()
+    start_time = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.total_seconds = time.perf_counter() - start_time
+        if profile.sampler is not None:
+            profile.sampler.stop()
+        _profile_contextvar.reset(token)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _profile_contextvar.get()
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    profile = _profile_contextvar.get()
+    if profile is None or name in profile.active_phases:
+        yield
+        return
+    profile.active_phases.add(name)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phase_seconds[name] += time.perf_counter() - start_time
+        profile.active_phases.discard(name)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    def decorator(f: F) -> F:
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def aggregate_samples(verb: str, profile: RequestProfile):
+    if profile.sampler is not None:
+        samples_by_verb[verb].update(profile.sampler.samples)
@@ -0,0 +1,240 @@
+import functools
+import re
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+from gptif.state import Agent
+
+
+class PromptTemplate:
+    """A prompt split once into literal text and fields.
+
+    The rendered prompt is the dialogue cache key, so any change to what it renders
+    must bump the version (which is logged with every llm call).
+    """
+
+    def __init__(self, name: str, version: int, text: str):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(text):
+            assert not format_spec and conversion is None, f"{name}: {field_name}"
+            self.parts.append((literal, field_name))
+        self.fields = set(field for _, field in self.parts if field is not None)
+
+    def render(self, **values: Any) -> str:
+        assert set(values.keys()) == self.fields, (self.name, values.keys())
+        # format() like an f-string would, so rendering matches the old prompts
+        return "".join(
+            literal if field is None else literal + format(values[field])
+            for literal, field in self.parts
+        )
+
+    def id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+
+PROFILE = PromptTemplate(
+    "profile",
+    1,
+    """
+**Name:** {name}
+**Age:** {age}
+**Race:** {race}
+**Gender:** {gender}
+**Occupation:** {occupation}
+**Personality:** {personality}
+**Backstory:** {backstory}
+**Goals:**   {goals}
+**Notes:**   {notes}
+""",
+)
+
+# Everything before the conversation, constant for an agent until its notes change
+CONVERSE_PREFIX = PromptTemplate(
+    "converse_prefix",
+    1,
+    """Given a character and question, answer the question in a paragraph.
+
+Character:
+
+{profile}
+
+Alfred: What is your name?
+{name}: "My name is {name}."
+
+""",
+)
+
+# Only in the prompt once older turns have been summarized
+CONVERSE_SUMMARY = PromptTemplate(
+    "converse_summary",
+    1,
+    """Summary of the conversation so far: {summary}
+
+""",
+)
+
+# A remembered turn
+CONVERSE_EXCHANGE = PromptTemplate(
+    "converse_exchange",
+    1,
+    """Alfred: {statement}
+{name}: "{answer}"
+
+""",
+)
+
+CONVERSE_TURN = PromptTemplate(
+    "converse_turn",
+    1,
+    """Alfred: {statement}
+{name}: \"""",
+)
+
+SUMMARIZE_CONVERSATION = PromptTemplate(
+    "summarize_conversation",
+    1,
+    """Summarize the conversation between Alfred and {name} in at most three sentences. Keep names, facts and promises.
+
+{previous_summary}{exchanges}Summary:""",
+)
+
+FRIEND_QUESTION = PromptTemplate(
+    "friend_question",
+    1,
+    """Answer questions about the following statement:
+
+"{statement}"
+
+Is the statement above about chocolate?
+No
+
+{friendly_question}
+""",
+)
+
+FAKE_SCENERY = PromptTemplate(
+    "fake_scenery",
+    1,
+    # The indented blank lines are part of the cached prompts, keep them
+    "Given a room description and an object in the room, describe the object.\n"
+    "    \n"
+    "Room Name: {room_name}\n"
+    "\n"
+    "Room Description: {room_text}\n"
+    "    \n"
+    "Object Name: {scenery_text}\n"
+    "\n"
+    "Object Description: ",
+)
+
+DESCRIBE_CHARACTER = PromptTemplate(
+    "describe_character",
+    1,
+    "Given a character profile, write a description of the character in a single paragraph. The description should include the age and race.\n"
+    "    \n"
+    """Character:
+
+{profile}
+
+Description:
+
+""",
+)
+
+
+def approximate_token_count(text: str) -> int:
+    """Words and punctuation, close to BPE counts for English prose."""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def count_tokens(model, text: str) -> int:
+    count = getattr(model, "count_tokens", None)
+    if count is None:
+        return approximate_token_count(text)
+    return count(text)
+
+
+class PromptPrefix:
+    """A prompt prefix shared by many llm calls, with its token count per model."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.token_counts: Dict[str, int] = {}
+
+    def token_count(self, model) -> int:
+        model_name = model.model_name()
+        if model_name not in self.token_counts:
+            self.token_counts[model_name] = count_tokens(model, self.text)
+        return self.token_counts[model_name]
+
+
+def _profile_key(agent: Agent) -> Tuple:
+    profile = agent.profile
+    return (
+        profile.name,
+        profile.age,
+        profile.race,
+        profile.gender,
+        profile.occupation,
+        tuple(profile.personality or []),
+        tuple(profile.backstory or []),
+        tuple(profile.goals or []),
+        tuple(agent.notes),
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _render_profile(profile_key: Tuple) -> str:
+    (
+        name,
+        age,
+        race,
+        gender,
+        occupation,
+        personality,
+        backstory,
+        goals,
+        notes,
+    ) = profile_key
+    return PROFILE.render(
+        name=name,
+        age=age,
+        race=race,
+        gender=gender,
+        occupation=occupation,
+        personality=". ".join(personality),
+        backstory=". ".join(backstory),
+        goals=". ".join(goals),
+        notes=". ".join(notes),
+    )
+
+
+def profile_for_agent(agent: Agent) -> str:
+    return _render_profile(_profile_key(agent))
+
+
+@functools.lru_cache(maxsize=256)
+def _converse_prefix(profile_key: Tuple, summary: str) -> PromptPrefix:
+    text = CONVERSE_PREFIX.render(
+        profile=_render_profile(profile_key), name=profile_key[0]
+    )
+    if len(summary) > 0:
+        text += CONVERSE_SUMMARY.render(summary=summary)
+    return PromptPrefix(text)
+
+
+def converse_prefix(agent: Agent) -> PromptPrefix:
+    """The prompt up to the remembered turns, which only changes with the summary."""
+    return _converse_prefix(_profile_key(agent), agent.memory.summary)
+
+
+def render_exchange(agent: Agent, statement: str, answer: str) -> str:
+    return CONVERSE_EXCHANGE.render(statement=statement, name=agent.name, answer=answer)
+
+
+def clear_prompt_caches():
+    _render_profile.cache_clear()
+    _converse_prefix.cache_clear()
@@ -0,0 +1,282 @@
+import hashlib
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import gptif.settings
+from gptif import db
+from gptif.console import console
+
+# The player's question is replaced by this in the context key, so dialogues that
+# only differ by the question share a key
+QUESTION_PLACEHOLDER = "\x00question\x00"
+
+NEGATIONS = frozenset(["not", "no", "never", "nothing", "nobody", "nowhere"])
+
+# Questions from the dialogue cache embedded per lookup while an index is being built
+INDEX_BATCH_SIZE = 64
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(re.sub(r"[^a-z0-9' ]+", " ", question.lower()).split())
+
+
+def negation_signature(question: str) -> int:
+    """How many negations are in the question.
+
+    "Do you like the army?" and "Don't you like the army?" look alike but must not
+    share an answer.
+    """
+    return sum(
+        1
+        for word in normalize_question(question).split()
+        if word in NEGATIONS or word.endswith("n't")
+    )
+
+
+class HashingEmbedder:
+    """Embeds text as hashed character n-grams and words, no model needed.
+
+    It compares spelling, not meaning: it catches questions that differ in case,
+    punctuation or a word or two, and scores different questions that are spelled
+    alike highly ("Do you have a wife?" / "Do you have a knife?" is 0.75).  Only use
+    it with a threshold of 0.95 or more.
+    """
+
+    def __init__(self, dimensions: int = 2048, ngram_sizes: Tuple[int, ...] = (3, 4, 5)):
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    def name(self) -> str:
+        return f"hashing-{self.dimensions}"
+
+    def embed(self, text: str) -> np.ndarray:
+        normalized = normalize_question(text)
+        padded = f" {normalized} "
+        features = [
+            padded[i : i + n]
+            for n in self.ngram_sizes
+            for i in range(len(padded) - n + 1)
+        ] + ["w:" + word for word in normalized.split()]
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            # crc32 instead of hash() so embeddings are stable across processes
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed(text) for text in texts])
+
+
+class OpenAiEmbedder:
+    def __init__(self, model: str = "text-embedding-ada-002"):
+        self.model = model
+
+    def name(self) -> str:
+        return self.model
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        import openai
+
+        response = openai.Embedding.create(
+            input=[normalize_question(text) for text in texts], model=self.model
+        )
+        data = sorted(response["data"], key=lambda d: d["index"])  # type: ignore
+        vectors = np.array([d["embedding"] for d in data], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def context_key(dialogue: db.GptDialogue) -> str:
+    """Identifies everything about a dialogue except the question."""
+    return hashlib.sha256(
+        "\x00".join(
+            [
+                dialogue.context.replace(dialogue.question, QUESTION_PLACEHOLDER),
+                dialogue.stop_words or "",
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+class CharacterIndex:
+    """The embedded questions for one character and model, searched by brute force.
+
+    The questions already in the dialogue cache start out pending and are embedded
+    a batch at a time by the lookups.
+    """
+
+    def __init__(self, pending: List[db.GptDialogue]):
+        self.vectors: Optional[np.ndarray] = None
+        self.size = 0
+        self.pending = pending
+        self.context_keys: List[str] = []
+        self.negations: List[int] = []
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+
+    def add(self, vector: np.ndarray, dialogue: db.GptDialogue):
+        assert dialogue.answer is not None
+        if self.vectors is None:
+            self.vectors = np.zeros((16, vector.shape[0]), dtype=np.float32)
+        elif self.size == self.vectors.shape[0]:
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+        self.vectors[self.size] = vector
+        self.size += 1
+        self.context_keys.append(context_key(dialogue))
+        self.negations.append(negation_signature(dialogue.question))
+        self.questions.append(dialogue.question)
+        self.answers.append(dialogue.answer)
+
+    def nearest(
+        self, vector: np.ndarray, dialogue: db.GptDialogue
+    ) -> Tuple[Optional[int], float]:
+        if self.size == 0:
+            return None, 0.0
+        assert self.vectors is not None
+        similarities = self.vectors[: self.size] @ vector
+        key = context_key(dialogue)
+        negations = negation_signature(dialogue.question)
+        # Only answers given in the same context can be reused
+        mask = np.array(
+            [
+                k == key and n == negations
+                for k, n in zip(self.context_keys, self.negations)
+            ]
+        )
+        similarities = np.where(mask, similarities, -np.inf)
+        best = int(np.argmax(similarities))
+        if not np.isfinite(similarities[best]):
+            return None, 0.0
+        return best, float(similarities[best])
+
+
+class SemanticCache:
+    def __init__(self, threshold: float, embedder=None):
+        self.threshold = threshold
+        self.embedder = embedder if embedder is not None else OpenAiEmbedder()
+        self.lock = threading.Lock()
+        # By character, model and stop words.  Answers are only reused for the same
+        # stop words, so e.g. describe prompts and friend checks are never loaded
+        # into the index for conversations.
+        self.indices: Dict[Tuple[str, str, str], CharacterIndex] = {}
+        self.hits = 0
+        self.misses = 0
+        # Since the last drain, for publishing as metrics
+        self.stats: Counter = Counter()
+
+    def _index_key(self, dialogue: db.GptDialogue) -> Tuple[str, str, str]:
+        assert dialogue.character_name is not None
+        assert dialogue.model_version is not None
+        return (dialogue.character_name, dialogue.model_version, dialogue.stop_words or "")
+
+    def _index_for(self, dialogue: db.GptDialogue) -> CharacterIndex:
+        """The index, which starts out with the character's cached dialogues pending."""
+        index_key = self._index_key(dialogue)
+        with self.lock:
+            index = self.indices.get(index_key)
+        if index is not None:
+            return index
+        dialogues = db.get_dialogues_for_character(*index_key)
+        with self.lock:
+            index = self.indices.get(index_key)
+            if index is None:
+                index = CharacterIndex(dialogues)
+                self.indices[index_key] = index
+        return index
+
+    def _embed_pending(self, index: CharacterIndex):
+        """Embeds the next batch of cached questions, so the first lookup for a
+        character with a long history doesn't embed all of it."""
+        with self.lock:
+            batch = index.pending[:INDEX_BATCH_SIZE]
+            del index.pending[:INDEX_BATCH_SIZE]
+        if len(batch) == 0:
+            return
+        try:
+            vectors = self.embedder.embed_batch([dialogue.question for dialogue in batch])
+        except Exception:
+            with self.lock:
+                index.pending[:0] = batch
+            raise
+        with self.lock:
+            for vector, dialogue in zip(vectors, batch):
+                index.add(vector, dialogue)
+            console.debug(
+                f"Semantic index for {batch[0].character_name}: {index.size} questions, {len(index.pending)} pending"
+            )
+
+    def lookup(self, dialogue: db.GptDialogue) -> Optional[str]:
+        """Returns the answer to the most similar question asked in the same context."""
+        if dialogue.character_name is None or dialogue.model_version is None:
+            return None
+        index = self._index_for(dialogue)
+        self._embed_pending(index)
+        vector = self.embedder.embed(dialogue.question)
+        with self.lock:
+            best, similarity = index.nearest(vector, dialogue)
+            if best is not None and similarity >= self.threshold:
+                self.hits += 1
+                self.stats["hit"] += 1
+                console.debug(
+                    f"Semantic cache hit ({similarity:.2f}): {dialogue.question!r} ~ {index.questions[best]!r}"
+                )
+                return index.answers[best]
+            self.misses += 1
+            self.stats["miss"] += 1
+        return None
+
+    def remember(self, dialogue: db.GptDialogue):
+        """Adds a newly cached answer to the index (if the index was built already)."""
+        if dialogue.character_name is None or dialogue.model_version is None:
+            return
+        if dialogue.answer is None:
+            return
+        index_key = self._index_key(dialogue)
+        if index_key not in self.indices:
+            # It's in the db, it'll be loaded with the rest
+            return
+        vector = self.embedder.embed(dialogue.question)
+        with self.lock:
+            self.indices[index_key].add(vector, dialogue)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def drain_stats(self) -> Dict[str, int]:
+        """The hits and misses since the last drain."""
+        with self.lock:
+            stats = dict(self.stats)
+            self.stats.clear()
+        return stats
+
+
+semantic_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """The semantic cache, or None in strict (exact match only) mode."""
+    global semantic_cache
+    threshold = gptif.settings.SEMANTIC_CACHE_THRESHOLD
+    if threshold is None:
+        return None
+    if semantic_cache is None or semantic_cache.threshold != threshold:
+        embedder = (
+            HashingEmbedder()
+            if gptif.settings.SEMANTIC_CACHE_EMBEDDER == "hashing"
+            else OpenAiEmbedder()
+        )
+        semantic_cache = SemanticCache(threshold, embedder)
+    return semantic_cache
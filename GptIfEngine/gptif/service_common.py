@@ -0,0 +1,153 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()  # take environment variables from .env.
+
+import bugsnag
+
+stage = os.environ.get("STAGE", None)
+
+bugsnag.configure(
+    api_key=os.environ["BUGSNAG_API_KEY"] if stage else None,
+    project_root=os.getcwd(),
+)
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+from aws_lambda_powertools.metrics import MetricUnit
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from starlette.exceptions import ExceptionMiddleware
+
+from gptif.backend_utils import logger, metrics
+from gptif.db import create_db_and_tables
+from gptif.fixtures import configure_fixtures_from_env
+
+root_path = f"/{stage}/" if stage else "/"
+
+origins = [
+    "http://gptif-site.s3-website-us-east-1.amazonaws.com",
+    "https://gptif-site.s3-website-us-east-1.amazonaws.com",
+    "http://generativefiction.com",
+    "https://generativefiction.com",
+    "http://localhost",
+    "http://localhost:3000",
+]
+
+T = TypeVar("T")
+
+# Set GPTIF_FIXTURE_MODE (and GPTIF_FIXTURE_CASSETTE etc.) to load test without upstream keys
+configure_fixtures_from_env()
+
+
+class LoggerRouteHandler(APIRoute):
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            # Add fastapi context to logs
+            ctx = {
+                "path": request.url.path,
+                "route": self.path,
+                "method": request.method,
+            }
+            logger.append_keys(fastapi=ctx)
+            logger.info("Received request")
+
+            return await original_route_handler(request)
+
+        return route_handler
+
+
+class ConcurrencyLimiter:
+    """Bounds the requests a tier works on at once, and how many may wait.
+
+    Use as a dependency, and run blocking work with run() so it happens on the
+    tier's own threads instead of the event loop or the shared threadpool.
+    Requests beyond the queue get a 503 so a burst can't pile up forever.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.waiting = 0
+        # Created on first use so it binds to the server's event loop
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix=name
+        )
+
+    async def __call__(self) -> AsyncIterator[None]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            metrics.add_metric(
+                name=f"{self.name}Rejected", unit=MetricUnit.Count, value=1
+            )
+            raise HTTPException(
+                status_code=503,
+                detail=f"{self.name} is busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+    async def run(self, f: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(f, *args)
+        )
+
+
+async def unhandled_exception_handler(request, err):
+    logger.exception("Unhandled exception")
+    bugsnag.notify(err)
+    metrics.add_metric(name="Crash", unit=MetricUnit.Count, value=1)
+    return JSONResponse(
+        status_code=500, content={"detail": "Internal Server Error: " + str(err)}
+    )
+
+
+def create_app(title: str) -> FastAPI:
+    app = FastAPI(title=title, root_path=root_path)
+    app.router.route_class = LoggerRouteHandler
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # The game state version, passed back to /api/complete
+        expose_headers=["X-Gptif-State-Version"],
+    )
+
+    app.add_exception_handler(Exception, unhandled_exception_handler)
+    app.add_middleware(ExceptionMiddleware, handlers=app.exception_handlers)
+
+    return app
+
+
+def start_services(image_worker: bool):
+    create_db_and_tables()
+    # Set GPTIF_IMAGE_WORKER=external when running "python -m gptif.image_queue" separately.
+    # Lambda freezes the process between requests, so a thread would stall there and
+    # the image_worker function processes the queue instead.
+    default_worker = "external" if "STAGE" in os.environ else "thread"
+    if image_worker and os.environ.get("GPTIF_IMAGE_WORKER", default_worker) == "thread":
+        from gptif.image_queue import start_image_worker
+
+        start_image_worker()
@@ -0,0 +1,120 @@
+import base64
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Generic, Optional, Tuple, TypeVar
+
+import nacl.exceptions
+import nacl.secret
+
+import gptif.settings
+
+# Compact cookie payloads start with a version byte
+COOKIE_VERSION_UUID = 1
+COOKIE_VERSION_STRING = 2
+
+COMPACT = "compact"
+LEGACY = "legacy"
+
+V = TypeVar("V")
+
+
+class TtlCache(Generic[V]):
+    """A small LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[V]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: V):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SessionCodec:
+    """Encrypts session ids into cookies and back.
+
+    New cookies are SecretBox(version byte + 16 uuid bytes), urlsafe base64 without
+    padding (~75 characters).  Legacy cookies (base64 of an encrypted JSON object)
+    are still accepted.
+    """
+
+    def __init__(self, secret_box: nacl.secret.SecretBox):
+        self.secret_box = secret_box
+        self.cache: TtlCache[str] = TtlCache(
+            gptif.settings.SESSION_CACHE_MAX_ENTRIES,
+            gptif.settings.SESSION_CACHE_TTL_SECONDS,
+        )
+
+    def encode(self, session_id: str) -> str:
+        try:
+            payload = bytes([COOKIE_VERSION_UUID]) + uuid.UUID(session_id).bytes
+        except ValueError:
+            payload = bytes([COOKIE_VERSION_STRING]) + session_id.encode("utf-8")
+        cookie = (
+            base64.urlsafe_b64encode(self.secret_box.encrypt(payload))
+            .rstrip(b"=")
+            .decode("ascii")
+        )
+        self.cache.put(cookie, session_id)
+        return cookie
+
+    def decode(self, cookie: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (session_id, format), or (None, None) if the cookie is invalid."""
+        try:
+            # Accepts both the standard (legacy) and urlsafe alphabets
+            encrypted = base64.b64decode(
+                cookie.replace("-", "+").replace("_", "/") + "=" * (-len(cookie) % 4),
+                validate=True,
+            )
+            payload = self.secret_box.decrypt(encrypted)
+        except (ValueError, nacl.exceptions.CryptoError):
+            return None, None
+
+        if len(payload) == 0:
+            return None, None
+        if payload[0] == COOKIE_VERSION_UUID and len(payload) == 17:
+            return str(uuid.UUID(bytes=payload[1:])), COMPACT
+        if payload[0] == COOKIE_VERSION_STRING:
+            return payload[1:].decode("utf-8"), COMPACT
+        try:
+            legacy_session = json.loads(payload.decode("utf-8"))
+            return (
+                legacy_session.get("logged_in_id", legacy_session["logged_out_id"]),
+                LEGACY,
+            )
+        except (ValueError, KeyError, AttributeError):
+            return None, None
+
+    def resolve(self, cookie: str) -> Tuple[Optional[str], bool, Optional[str]]:
+        """Returns (session_id, cache_hit, format), caching successful decodes."""
+        session_id = self.cache.get(cookie)
+        if session_id is not None:
+            return session_id, True, None
+        session_id, cookie_format = self.decode(cookie)
+        if session_id is not None:
+            self.cache.put(cookie, session_id)
+        return session_id, False, cookie_format
@@ -7,9 +7,50 @@ from typing import Optional
 
 RUN_LOCALLY = True
 CONVERSE_SERVER: Optional[str] = None
+# Image tier, when it runs separately from the converse server
+IMAGE_SERVER: Optional[str] = None
 DEBUG_MODE = False
 CLI_MODE = False
 FAKE_SCENERY = True
+IMAGE_MODEL_VERSION = "dalle_with_waterfall"
+IMAGE_HEDGING = True
+# Start the next image provider if the current one hasn't answered by its p95 (capped by this)
+IMAGE_HEDGE_DELAY_SECONDS = 8.0
+# Providers failing more often than this are hedged immediately
+IMAGE_HEDGE_MAX_ERROR_RATE = 0.5
+IMAGE_PROVIDER_TIMEOUT_SECONDS = 25.0
+MAX_OUTPUT_BYTES_PER_REQUEST = 256 * 1024
+SESSION_CACHE_TTL_SECONDS = 300.0
+SESSION_CACHE_MAX_ENTRIES = 10000
+IMAGE_SERVICE_MAX_CONCURRENT = 4
+IMAGE_SERVICE_MAX_QUEUE = 64
+DIALOGUE_SERVICE_MAX_CONCURRENT = 8
+DIALOGUE_SERVICE_MAX_QUEUE = 128
+COMPLETION_MAX_CONCURRENT = 4
+COMPLETION_MAX_QUEUE = 64
+# Reuse the answer to a similar enough question (cosine similarity).  Start around
+# 0.95 with the openai embedder.  The hashing embedder compares spelling, not
+# meaning, and needs 0.95 or more.  None is strict mode: only exact matches are reused.
+SEMANTIC_CACHE_THRESHOLD: Optional[float] = None
+# "openai" (ada embeddings) or "hashing" (local, no model, near-exact matches only)
+SEMANTIC_CACHE_EMBEDDER = "openai"
+# Recent dialogue with an agent is kept word for word up to this many tokens, older
+# turns are summarized.  None turns off conversation memory.
+CONVERSATION_MEMORY_TOKEN_BUDGET: Optional[int] = 512
+CONVERSATION_SUMMARY_MAX_WORDS = 120
+# Images rendered for the terminal are kept here.  None only caches them in memory.
+ANSI_CACHE_DIR: Optional[str] = "~/.gptif/ansi"
+# Images from the converse server are kept here.  None only caches them in memory.
+IMAGE_CACHE_DIR: Optional[str] = "~/.gptif/images"
+# Fetch the images for neighbouring rooms and the people here before they're needed.
+# Portraits are only fetched for people who have been described already.
+IMAGE_PREFETCH = True
+# Describe and draw what's in the room (and the rooms next to it) in the background
+# when the player walks in.  Costs llm and image calls that may never be used, up
+# to the budget.
+SPECULATION = False
+SPECULATION_BUDGET = 200
+SPECULATION_WORKERS = 1
 
 if "SQL_URL" not in os.environ:
     os.environ["SQL_URL"] = "sqlite:///~/.gptif"
@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import gptif.settings
+from gptif.console import console, session_id_contextvar
+
+# The kinds of work that are speculated, the first part of their keys
+DESCRIPTION_KIND = "description"
+IMAGE_KIND = "image"
+
+# Priorities, lower runs first.  The player is most likely to look at the people
+# in the room they just entered, then at its scenery, then to walk on.
+DESCRIBE_PRIORITY = 0
+PORTRAIT_PRIORITY = 1
+SCENERY_PRIORITY = 2
+# Added for everything in a neighbouring room
+NEIGHBOR_PRIORITY = 10
+
+
+@dataclass(order=True)
+class SpeculationTask:
+    priority: int
+    sequence: int
+    session_id: str = field(compare=False)
+    epoch: int = field(compare=False)
+    key: Tuple[str, str] = field(compare=False)
+    # Returns the key of what it generated, None when it was warm already
+    warm: Callable[[], Optional[Tuple[str, str]]] = field(compare=False)
+
+
+class SpeculationEngine:
+    """Generates what the player will probably ask for next, in the background.
+
+    Work is queued when the player enters a room and dropped when they move on
+    before it ran.  Only generations that missed the caches count against the
+    budget.  uses() of speculated keys are counted as hits, of other keys as misses.
+    """
+
+    def __init__(self, budget: int, workers: int):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.queue: List[SpeculationTask] = []
+        self.sequence = itertools.count()
+        # Bumped on every room entry, queued tasks from older epochs are stale
+        self.epochs: Dict[str, int] = {}
+        self.queued_keys: Set[Tuple[str, str]] = set()
+        self.running: Dict[Tuple[str, str], threading.Event] = {}
+        self.warmed: Set[Tuple[str, str]] = set()
+        self.spent = 0
+        self.stats: Counter = Counter()
+        self.workers = [
+            threading.Thread(target=self._work, name=f"speculation_{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def start_epoch(self) -> int:
+        """Cancels the queued work for this session."""
+        session_id = session_id_contextvar.get()
+        with self.lock:
+            epoch = self.epochs.get(session_id, 0) + 1
+            self.epochs[session_id] = epoch
+            return epoch
+
+    def submit(
+        self,
+        priority: int,
+        key: Tuple[str, str],
+        warm: Callable[[], Optional[Tuple[str, str]]],
+        epoch: Optional[int] = None,
+    ):
+        """Queues work for the current epoch, or for the given one if it's still current."""
+        session_id = session_id_contextvar.get()
+        with self.lock:
+            current_epoch = self.epochs.get(session_id, 0)
+            if epoch is None:
+                epoch = current_epoch
+            elif epoch != current_epoch:
+                self.stats["cancelled"] += 1
+                return
+            if self.spent >= self.budget:
+                self.stats["over_budget"] += 1
+                return
+            if key in self.warmed or key in self.queued_keys or key in self.running:
+                return
+            self.queued_keys.add(key)
+            heapq.heappush(
+                self.queue,
+                SpeculationTask(
+                    priority,
+                    next(self.sequence),
+                    session_id,
+                    epoch,
+                    key,
+                    warm,
+                ),
+            )
+            self.stats["queued"] += 1
+            self.condition.notify()
+
+    def _next_task(self) -> SpeculationTask:
+        with self.lock:
+            while True:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                task = heapq.heappop(self.queue)
+                self.queued_keys.discard(task.key)
+                if task.epoch != self.epochs.get(task.session_id, 0):
+                    self.stats["cancelled"] += 1
+                    continue
+                if self.spent >= self.budget:
+                    self.stats["over_budget"] += 1
+                    continue
+                self.running[task.key] = threading.Event()
+                return task
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            generated = None
+            try:
+                token = session_id_contextvar.set(task.session_id)
+                try:
+                    generated = task.warm()
+                finally:
+                    session_id_contextvar.reset(token)
+            except Exception as ex:
+                console.debug("Speculation failed", task.key, ex)
+            with self.lock:
+                if generated is not None:
+                    self.warmed.add(generated)
+                    self.spent += 1
+                    self.stats["generated"] += 1
+                else:
+                    self.stats["already_warm"] += 1
+                self.running.pop(task.key).set()
+
+    def use(self, key: Tuple[str, str]):
+        """Called when the player asks for something that could have been speculated.
+        Waits for it if it's being generated right now, rather than generating it twice."""
+        with self.lock:
+            event = self.running.get(key)
+        if event is not None:
+            event.wait()
+        with self.lock:
+            if key in self.warmed:
+                self.warmed.discard(key)
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return self.stats["hits"] / total if total > 0 else 0.0
+
+    def drain_stats(self) -> Dict[str, int]:
+        """The counts since the last drain, for publishing as metrics."""
+        with self.lock:
+            stats = dict(self.stats)
+            self.stats.clear()
+        return stats
+
+
+speculation_engine: Optional[SpeculationEngine] = None
+speculation_engine_lock = threading.Lock()
+
+
+def get_speculation_engine() -> Optional[SpeculationEngine]:
+    """The engine, or None when speculation is off."""
+    global speculation_engine
+    if not gptif.settings.SPECULATION:
+        return None
+    with speculation_engine_lock:
+        if speculation_engine is None:
+            speculation_engine = SpeculationEngine(
+                gptif.settings.SPECULATION_BUDGET, gptif.settings.SPECULATION_WORKERS
+            )
+    return speculation_engine
+
+
+def record_use(kind: str, key: str):
+    if speculation_engine is not None:
+        speculation_engine.use((kind, key))
+
+
+def _warm_description(
+    engine: SpeculationEngine, agent, priority: int, epoch: int
+) -> Optional[Tuple[str, str]]:
+    from gptif.cl_image import portrait_prompt
+    from gptif.converse import cached_description, describe_character
+
+    description = cached_description(agent)
+    generated = description is None
+    if description is None:
+        description = describe_character(agent)
+    # The portrait's prompt is only known once the agent is described.  It's keyed by
+    # the prompt, like the use() when it's shown.
+    prompt = portrait_prompt(description)
+    engine.submit(
+        priority + PORTRAIT_PRIORITY,
+        (IMAGE_KIND, prompt),
+        lambda: _warm_image(prompt),
+        epoch,
+    )
+    return (DESCRIPTION_KIND, agent.uid) if generated else None
+
+
+def _warm_image(prompt: str) -> Optional[Tuple[str, str]]:
+    from gptif.cl_image import warm_image
+
+    return (IMAGE_KIND, prompt) if warm_image(prompt) else None
+
+
+def _speculate_room(engine: SpeculationEngine, world, room, priority: int, epoch: int):
+    for agent in world.agents_in(room.uid):
+        # Also queues the portrait
+        engine.submit(
+            priority + DESCRIBE_PRIORITY,
+            (DESCRIPTION_KIND, agent.uid),
+            lambda agent=agent: _warm_description(engine, agent, priority, epoch),
+            epoch,
+        )
+    for scenery in room.scenery:
+        prompt = scenery.image_prompt
+        if prompt is not None:
+            engine.submit(
+                priority + SCENERY_PRIORITY,
+                (IMAGE_KIND, prompt),
+                lambda prompt=prompt: _warm_image(prompt),
+                epoch,
+            )
+
+
+def speculate_on_room_entry(world):
+    """Queues the descriptions and images for the room the player is in and its
+    neighbours, dropping what was queued for the last room."""
+    engine = get_speculation_engine()
+    if engine is None:
+        return
+    epoch = engine.start_epoch()
+    room = world.current_room
+    _speculate_room(engine, world, room, 0, epoch)
+    # Exit visibility runs the room's scripts, so it's worked out here and not in
+    # the speculation threads
+    for exit in room.exits.values():
+        if not world.exit_visible(exit):
+            continue
+        neighbor = world.rooms[exit.room_uid]
+        prompt = neighbor.image_prompt
+        engine.submit(
+            NEIGHBOR_PRIORITY,
+            (IMAGE_KIND, prompt),
+            lambda prompt=prompt: _warm_image(prompt),
+            epoch,
+        )
+        _speculate_room(engine, world, neighbor, NEIGHBOR_PRIORITY, epoch)
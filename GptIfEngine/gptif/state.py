@@ -1,14 +1,17 @@
 from __future__ import annotations
 
+import bisect
+import dataclasses
+import hashlib
+import heapq
 import json
 import random
 import re
 from dataclasses import dataclass, field
 from enum import IntEnum
 from io import StringIO
-from typing import Dict, List, Optional, Set, Tuple, cast
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-import dice
 import jinja2
 import yaml
 from md2py import TreeOfContents, md2py
@@ -16,9 +19,21 @@ from rich.console import Console
 from rich.markdown import Markdown
 
 import gptif.settings
-from gptif.cl_image import display_image_for_prompt
+from gptif.cl_image import display_image_for_prompt, portrait_prompt
 from gptif.console import console
+from gptif.content import (
+    AGENTS_PATH,
+    CHAPTER_PATHS,
+    ROOM_DESCRIPTIONS_PATH,
+    ROOMS_PATH,
+    SCENERY_ACTIONS_PATH,
+    SCENERY_PATH,
+    START_ROOM_ID,
+    load_sections,
+)
 from gptif.db import GameState
+from gptif.dice_rolls import DiceSampler, compile_dice, roll_all
+from gptif.name_index import NameIndex
 
 try:
     from yaml import CDumper as Dumper
@@ -27,6 +42,7 @@ except ImportError:
     from yaml import Loader, Dumper
 
 from gptif.parser import get_hypernyms_set, get_verb_classes, get_verb_classes_for_list
+from gptif.speculation import DESCRIPTION_KIND, record_use, speculate_on_room_entry
 
 
 class Gender(IntEnum):
@@ -77,6 +93,40 @@ class AgentProfile:
         )
 
 
+@dataclass
+class ConversationMemory:
+    """What the player and an agent said to each other.
+
+    The latest turns are kept word for word, older turns are folded into summary
+    (see converse.remember_turn).
+    """
+
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    summary: str = ""
+
+    def is_empty(self) -> bool:
+        return len(self.turns) == 0 and len(self.summary) == 0
+
+    def add_turn(self, statement: str, answer: str):
+        self.turns.append((statement, answer))
+
+    def digest(self) -> str:
+        """Stable id of the memory contents, the same in every process."""
+        return hashlib.sha256(
+            json.dumps([self.summary, self.turns]).encode("utf-8")
+        ).hexdigest()[:16]
+
+    def to_json(self) -> Dict:
+        return {"turns": [list(turn) for turn in self.turns], "summary": self.summary}
+
+    @classmethod
+    def from_json(cls, memory_json: Dict) -> ConversationMemory:
+        return cls(
+            [(turn[0], turn[1]) for turn in memory_json["turns"]],
+            memory_json["summary"],
+        )
+
+
 @dataclass
 class Agent:
     uid: str
@@ -91,6 +141,12 @@ class Agent:
     room_id: Optional[str]
     tic_percentage: int = 0
     friend_points: int = 0
+    memory: ConversationMemory = field(default_factory=ConversationMemory)
+    tic_dice: DiceSampler = field(init=False, repr=False)
+
+    def __post_init__(self):
+        assert self.percent_increase_per_tic.endswith("t")
+        self.tic_dice = compile_dice(self.percent_increase_per_tic)
 
     @classmethod
     def load_yaml(cls, uid, agent_yaml):
@@ -143,6 +199,17 @@ class Scenery:
     def nouns(self):
         return [x.strip() for x in id.split("/")]
 
+    def image_prompt_for(self, action: str) -> str:
+        """What's drawn when the player does the action, from its first paragraph."""
+        return self.actions[action][0].split("\n\n")[0]
+
+    @property
+    def image_prompt(self) -> Optional[str]:
+        """What's drawn when the player looks at the scenery, if they can."""
+        if "look" not in self.actions:
+            return None
+        return self.image_prompt_for("look")
+
 
 @dataclass
 class Exit:
@@ -159,9 +226,138 @@ class Room:
     descriptions: Dict[str, List[str]]
     scenery: List[Scenery] = field(default_factory=lambda: [])
     exits: Dict[str, Exit] = field(default_factory=dict)
+    # The times of the "Tic N" descriptions, sorted
+    tic_times: List[int] = field(init=False)
 
+    def __post_init__(self):
+        self.tic_times = sorted(
+            int(description.split(" ")[1])
+            for description in self.descriptions.keys()
+            if description.startswith("Tic")
+        )
 
-world: World = None  # type: ignore
+    @property
+    def image_prompt(self) -> str:
+        """The room is drawn from the first paragraph of its long description."""
+        return self.descriptions["Long"][0].split("\n\n")[0]
+
+
+def load_rooms() -> Dict[str, Room]:
+    rooms: Dict[str, Room] = {}
+
+    # Load room descriptions
+    room_descriptions = load_sections(ROOM_DESCRIPTIONS_PATH)
+
+    # Load rooms
+    with open(ROOMS_PATH, "r") as rooms_file:
+        rooms_yaml = yaml.safe_load(rooms_file)
+        for room_uid, room_yaml in rooms_yaml.items():
+            assert room_uid not in rooms, f"Duplicate room_uid, {room_uid}"
+            room_title = room_yaml["title"]
+            exits = {}
+            if "exits" in room_yaml:
+                for exit_direction, exit in room_yaml["exits"].items():
+                    exits[exit_direction] = Exit(
+                        exit["room"],
+                        exit.get("visible", None),
+                        exit.get("prescript", None),
+                        exit.get("postscript", None),
+                    )
+            rooms[room_uid] = Room(
+                room_uid, room_title, room_descriptions[room_uid], [], exits
+            )
+
+    # Load scenery descriptions
+    scenery_actions = load_sections(SCENERY_ACTIONS_PATH)
+
+    # Load scenery
+    with open(SCENERY_PATH, "r") as fp:
+        all_scenery_yaml = yaml.safe_load(fp)
+        for scenery_uid, scenery_yaml in all_scenery_yaml.items():
+            scenery = Scenery(
+                scenery_uid,
+                set(scenery_yaml["hints"]),
+                set(scenery_yaml["rooms"]),
+                set(scenery_yaml["names"]),
+                scenery_actions[scenery_uid],
+            )
+            # Attach scenery to all rooms listed
+            for room_id in scenery_yaml["rooms"]:
+                rooms[room_id].scenery.append(scenery)
+
+    # Adjust room descriptions based on scenery
+    for room in rooms.values():
+        for description_list in room.descriptions.values():
+            for scenery in room.scenery:
+                for scenery_hint in scenery.hints:
+                    for i, description in enumerate(description_list):
+                        description_list[i] = re.sub(
+                            f"({scenery_hint})",
+                            "**\\1**",
+                            description,
+                            0,
+                            re.MULTILINE | re.IGNORECASE,
+                        )
+
+    return rooms
+
+
+def load_agents() -> Dict[str, Agent]:
+    agents: Dict[str, Agent] = {}
+    with open(AGENTS_PATH, "r") as agent_file:
+        all_agent_yaml = yaml.safe_load(agent_file)
+        for agent_uid, agent_yaml in all_agent_yaml.items():
+            agents[agent_uid] = Agent.load_yaml(agent_uid, agent_yaml)
+    return agents
+
+
+# Parsed game content, shared by every World in the process
+_world_content: Optional[Tuple[Dict[str, Room], Dict[str, Agent]]] = None
+
+
+def load_world_content() -> Tuple[Dict[str, Room], Dict[str, Agent]]:
+    global _world_content
+    if _world_content is None:
+        _world_content = (load_rooms(), load_agents())
+    return _world_content
+
+
+# Built from the agents in _world_content
+_name_index: Optional[NameIndex] = None
+
+
+def get_name_index() -> NameIndex:
+    global _name_index
+    if _name_index is None:
+        _, agents = load_world_content()
+        _name_index = NameIndex((agent.uid, agent.names) for agent in agents.values())
+    return _name_index
+
+
+def clear_world_content_cache():
+    global _world_content, _name_index
+    _world_content = None
+    _name_index = None
+
+
+def replace_world_content(rooms: Dict[str, Room], agents: Dict[str, Agent]):
+    """Makes new Worlds use the given content (e.g. after it was edited)."""
+    global _world_content, _name_index
+    _world_content = (rooms, agents)
+    _name_index = None
+
+
+class AmbiguousNameException(Exception):
+    def __init__(self, name: str, agents: List[Agent]):
+        super().__init__(
+            f"Did you mean {' or '.join(agent.name for agent in agents)}?"
+        )
+        self.name = name
+        self.agents = agents
+
+
+# The time_in_chapter of the scripted events in World.step, by chapter
+CHAPTER_EVENT_TIMES: Dict[int, Tuple[int, ...]] = {4: (7, 20)}
 
 
 @dataclass
@@ -179,120 +375,32 @@ class World:
     inventory: List[str] = field(default_factory=list)
     game_over: bool = False
     password_letters_found: Set[str] = field(default_factory=set)
+    # Bumped by every save, so a saved game can be told apart from an older one
+    # without comparing it
+    save_count: int = 0
 
     version: int = 3
 
     random: random.Random = field(default_factory=lambda: random.Random(1))
 
-    def __post_init__(self):
-        global world
-        world = self
-
-        # Load room descriptions
-        room_descriptions: Dict[str, Dict[str, List[str]]] = {}
-
-        current_room = ""
-        current_topic = ""
-        with open("data/rooms/room_descriptions.md", "r") as fp:
-            sections = fp.read().split("\n\n")
-            for section in sections:
-                if section[:2] == "##":
-                    current_topic = section[2:].strip()
-                    room_descriptions[current_room][current_topic] = []
-                elif section[:1] == "#":
-                    current_room = section[1:].strip()
-                    room_descriptions[current_room] = {}
-                else:
-                    assert current_room != ""
-                    assert current_topic != ""
-                    room_descriptions[current_room][current_topic].append(section)
-
-            # Re-split room descriptions
-            for rd in room_descriptions.values():
-                for topic in rd.keys():
-                    rd[topic] = "\n\n".join(rd[topic]).split("{{< pagebreak >}}")
-
-        # Load rooms
-        with open("data/rooms/rooms.yaml", "r") as rooms_file:
-            rooms_yaml = yaml.safe_load(rooms_file)
-            for room_uid, room_yaml in rooms_yaml.items():
-                assert room_uid not in self.rooms, f"Duplicate room_uid, {room_uid}"
-                room_title = room_yaml["title"]
-                exits = {}
-                if "exits" in room_yaml:
-                    for exit_direction, exit in room_yaml["exits"].items():
-                        exits[exit_direction] = Exit(
-                            exit["room"],
-                            exit.get("visible", None),
-                            exit.get("prescript", None),
-                            exit.get("postscript", None),
-                        )
-                self.rooms[room_uid] = Room(
-                    room_uid, room_title, room_descriptions[room_uid], [], exits
-                )
+    # room_id -> uids of the agents in the room, kept up to date by move_agent
+    agents_by_room: Dict[Optional[str], Set[str]] = field(default_factory=dict)
+    # uid -> position in agents, so rooms list their agents in a stable order
+    agent_order: Dict[str, int] = field(default_factory=dict)
 
-        # Load scenery descriptions
-        scenery_actions: Dict[str, Dict[str, List[str]]] = {}
-
-        current_scenery = ""
-        current_action = ""
-        with open("data/rooms/scenery_actions.md", "r") as fp:
-            sections = fp.read().split("\n\n")
-            for section in sections:
-                if section[:2] == "##":
-                    current_action = section[2:].strip()
-                    scenery_actions[current_scenery][current_action] = []
-                elif section[:1] == "#":
-                    current_scenery = section[1:].strip()
-                    scenery_actions[current_scenery] = {}
-                else:
-                    assert current_scenery != ""
-                    assert current_action != ""
-                    scenery_actions[current_scenery][current_action].append(section)
-
-            # Re-split scenery descriptions
-            for sd in scenery_actions.values():
-                for action in sd.keys():
-                    sd[action] = "\n\n".join(sd[action]).split("{{< pagebreak >}}")
-
-        # Load scenery
-        with open("data/rooms/scenery.yaml", "r") as fp:
-            all_scenery_yaml = yaml.safe_load(fp)
-            for scenery_uid, scenery_yaml in all_scenery_yaml.items():
-                scenery = Scenery(
-                    scenery_uid,
-                    set(scenery_yaml["hints"]),
-                    set(scenery_yaml["rooms"]),
-                    set(scenery_yaml["names"]),
-                    scenery_actions[scenery_uid],
-                )
-                # Attach scenery to all rooms listed
-                for room_id in scenery_yaml["rooms"]:
-                    self.rooms[room_id].scenery.append(scenery)
-
-        # Adjust room descriptions based on scenery
-        for room in self.rooms.values():
-            for description_list in room.descriptions.values():
-                for scenery in room.scenery:
-                    for scenery_hint in scenery.hints:
-                        for i, description in enumerate(description_list):
-                            description_list[i] = re.sub(
-                                f"({scenery_hint})",
-                                "**\\1**",
-                                description,
-                                0,
-                                re.MULTILINE | re.IGNORECASE,
-                            )
-
-        # Load agents
-        with open("data/agents/agents.yaml", "r") as agent_file:
-            all_agent_yaml = yaml.safe_load(agent_file)
-            for agent_uid, agent_yaml in all_agent_yaml.items():
-                self.agents[agent_uid] = Agent.load_yaml(agent_uid, agent_yaml)
-
-        pass
+    def __post_init__(self):
+        rooms, agents = load_world_content()
+        # Rooms never change during a game so every world shares them, agents have
+        # per-game state so each world gets its own copies
+        self.rooms.update(rooms)
+        for agent_uid, agent in agents.items():
+            self.agents[agent_uid] = dataclasses.replace(
+                agent, memory=ConversationMemory()
+            )
+        self.index_agents()
 
     def save(self, game_state: GameState):
+        self.save_count += 1
         world_state = {
             "waiting_for_player": self.waiting_for_player,
             "active_agents": list(sorted(self.active_agents)),
@@ -304,6 +412,7 @@ class World:
             "inventory": self.inventory,
             "version": self.version,
             "password_letters_found": list(sorted(self.password_letters_found)),
+            "save_count": self.save_count,
         }
         agent_states = {}
         for agent_id, agent in self.agents.items():
@@ -312,11 +421,17 @@ class World:
                 "tic_percentage": agent.tic_percentage,
                 "friend_points": agent.friend_points,
             }
+            if not agent.memory.is_empty():
+                agent_states[agent_id]["memory"] = agent.memory.to_json()
         game_state.world_state = json.dumps(world_state)
         game_state.agent_states = json.dumps(agent_states)
         game_state.rng = json.dumps(self.random.getstate())
         game_state.version = str(self.version)
 
+    @staticmethod
+    def save_count_in(game_state: GameState) -> int:
+        return json.loads(game_state.world_state).get("save_count", 0)
+
     def load(self, session: GameState) -> bool:
         if session.version != str(self.version):
             # Incompatible
@@ -334,9 +449,14 @@ class World:
 
         agent_states = json.loads(session.agent_states)
         for agent_id, agent_state in agent_states.items():
+            if "memory" in agent_state:
+                agent_state["memory"] = ConversationMemory.from_json(
+                    agent_state["memory"]
+                )
             for k2, v2 in agent_state.items():
                 assert hasattr(self.agents[agent_id], k2)
                 setattr(self.agents[agent_id], k2, v2)
+        self.index_agents()
 
         def convert_to_tuple(l):
             return tuple(convert_to_tuple(x) for x in l) if type(l) is list else l
@@ -364,19 +484,91 @@ class World:
         return self.rooms[self.current_room_id]
 
     def min_wait_duration(self) -> int:
-        wait_duration: Optional[int] = None
+        tic_times = self.current_room.tic_times
+        next_tic = bisect.bisect_right(tic_times, self.time_in_room)
+        if next_tic == len(tic_times):
+            return 1
+        return tic_times[next_tic] - self.time_in_room
+
+    def scheduled_events(self) -> List[Tuple[int, str]]:
+        """A heap of (ticks from now, event) for everything that can happen at a
+        known time: room tics, chapter events and movement script waypoints."""
+        events: List[Tuple[int, str]] = []
+        tic_times = self.current_room.tic_times
+        next_tic = bisect.bisect_right(tic_times, self.time_in_room)
+        if next_tic < len(tic_times):
+            events.append(
+                (tic_times[next_tic] - self.time_in_room, f"Tic {tic_times[next_tic]}")
+            )
+        for event_time in CHAPTER_EVENT_TIMES.get(self.on_chapter, ()):
+            if event_time > self.time_in_chapter:
+                events.append(
+                    (event_time - self.time_in_chapter, f"Chapter {self.on_chapter} event")
+                )
+        for agent in self.agents.values():
+            for event_time in agent.movement.event_times(self.on_chapter):
+                if event_time > self.time_in_chapter:
+                    events.append((event_time - self.time_in_chapter, f"{agent.uid} moves"))
+        heapq.heapify(events)
+        return events
+
+    def wait(self, ticks: int):
+        """The same as calling step() ticks times, but skips through idle ticks."""
+        while ticks > 0:
+            events = self.scheduled_events()
+            idle_ticks = ticks if len(events) == 0 else min(ticks, events[0][0] - 1)
+            if idle_ticks > 0:
+                self.fast_forward(idle_ticks)
+                ticks -= idle_ticks
+            else:
+                self.step()
+                ticks -= 1
+
+    def fast_forward(self, ticks: int):
+        """Runs ticks in which nothing is scheduled.
+
+        Agent tics are random, so their dice are still rolled for every tick, in
+        the order step() rolls them, to keep the rng (and saves) the same.  The
+        rolls are drawn in one batch up front, which is fine because playing a
+        tic doesn't use the world's rng.  Without agent tics in the room this
+        takes constant time.
+        """
+        tic_agents = [
+            agent for agent in self.agents_in_room if len(agent.tic_creatives) > 0
+        ]
+        if len(tic_agents) == 0:
+            self.time_in_room += ticks
+            self.time_in_chapter += ticks
+            return
 
-        for description in self.current_room.descriptions.keys():
-            if description.startswith("Tic"):
-                tic_time = int(description.split(" ")[1])
-                if self.time_in_room < tic_time:
-                    time_to_wait = tic_time - self.time_in_room
-                    if wait_duration is None or time_to_wait < wait_duration:
-                        wait_duration = time_to_wait
+        start_time_in_room = self.time_in_room
+        start_time_in_chapter = self.time_in_chapter
+        rolls = roll_all([agent.tic_dice for agent in tic_agents], self.random, ticks)
 
-        if wait_duration is None:
-            return 1
-        return wait_duration
+        console.step_mode = True
+        try:
+            for tick, tick_rolls in enumerate(rolls, 1):
+                for agent, increase in zip(tic_agents, tick_rolls):
+                    agent.tic_percentage += increase
+                    if agent.tic_percentage >= 100:
+                        # The tic is rendered at the time it happens
+                        self.time_in_room = start_time_in_room + tick
+                        self.time_in_chapter = start_time_in_chapter + tick
+                        self.play_agent_tic(agent)
+        finally:
+            console.step_mode = False
+        self.time_in_room = start_time_in_room + ticks
+        self.time_in_chapter = start_time_in_chapter + ticks
+
+    def roll_agent_tic(self, agent: Agent):
+        agent.tic_percentage += agent.tic_dice.roll(self.random)
+        if agent.tic_percentage >= 100:
+            self.play_agent_tic(agent)
+
+    def play_agent_tic(self, agent: Agent):
+        agent.tic_percentage = 0
+        # Pick a random tic
+        self.play_sections([random.choice(agent.tic_creatives)], "purple")
 
     def step(self):
         console.step_mode = True
@@ -388,18 +580,8 @@ class World:
                     agent.room_id == self.current_room_id
                     and len(agent.tic_creatives) > 0
                 ):
-                    assert agent.percent_increase_per_tic.endswith("t")
-                    agent.tic_percentage += cast(
-                        int,
-                        dice.roll(agent.percent_increase_per_tic, random=self.random),
-                    )
-                    if agent.tic_percentage >= 100:
-                        agent.tic_percentage = 0
-                        # Pick a random tic
-                        self.play_sections(
-                            [random.choice(agent.tic_creatives)], "purple"
-                        )
-                agent.movement.step(agent)
+                    self.roll_agent_tic(agent)
+                agent.movement.step(self, agent)
             if f"Tic {self.time_in_room}" in self.current_room.descriptions:
                 self.play_sections(
                     self.current_room.descriptions[f"Tic {self.time_in_room}"],
@@ -407,6 +589,7 @@ class World:
                     insert_pauses=True,
                 )
 
+            # These times are in CHAPTER_EVENT_TIMES too
             if self.on_chapter == 4 and self.time_in_chapter == 7:
                 self.play_sections(
                     """Terrus pushes past David, making the older gentleman stumble and fall to one knee.  You run over to help David up as June spins around to face the tour.
@@ -433,7 +616,7 @@ After a few moments, the short conversation is over and June turns back to face
                     ),
                     insert_pauses=True,
                 )
-                self.agents["mercenary"].room_id = None
+                self.move_agent(self.agents["mercenary"], None)
 
             if self.on_chapter == 4 and self.time_in_chapter == 20:
                 # Captain yell
@@ -445,6 +628,7 @@ After a few moments, the short conversation is over and June turns back to face
         assert room_id in self.rooms
         self.current_room_id = room_id
         self.time_in_room = 0
+        speculate_on_room_entry(self)
         if room_id in self.visited_rooms:
             self.look_quickly()
         else:
@@ -506,10 +690,58 @@ After a few moments, the short conversation is over and June turns back to face
             console.print(f"{agent.name} walks in.")
 
     def move_agent(self, agent: Agent, room: Optional[Room]):
+        self.agents_by_room[agent.room_id].discard(agent.uid)
         if room is None:
             agent.room_id = None
         else:
             agent.room_id = room.uid
+        self.agents_by_room.setdefault(agent.room_id, set()).add(agent.uid)
+
+    def index_agents(self):
+        """Rebuilds agents_by_room, after changing room_id without move_agent."""
+        self.agent_order = {uid: i for i, uid in enumerate(self.agents.keys())}
+        self.agents_by_room = {}
+        for agent in self.agents.values():
+            self.agents_by_room.setdefault(agent.room_id, set()).add(agent.uid)
+
+    def find_agent(self, name: str) -> Tuple[Optional[Agent], Optional[Agent]]:
+        """Returns (the agent called name that is here to talk to, an agent called
+        name anywhere).  Typos are allowed when nobody has the name.
+
+        Raises AmbiguousNameException when several agents here have the name.
+        """
+        match = get_name_index().resolve(name)
+        if match is None:
+            return None, None
+        agents = [self.agents[uid] for uid in match.uids if uid in self.agents]
+        nearby_agents = [
+            agent
+            for agent in agents
+            if agent.uid in self.active_agents and agent.room_id == self.current_room_id
+        ]
+        if len(nearby_agents) > 1:
+            raise AmbiguousNameException(name, nearby_agents)
+        return (
+            nearby_agents[0] if len(nearby_agents) > 0 else None,
+            agents[-1] if len(agents) > 0 else None,
+        )
+
+    def agent_in_room_called(self, name: str, fuzzy: bool) -> Optional[Agent]:
+        match = get_name_index().resolve(name, fuzzy=fuzzy)
+        if match is None:
+            return None
+        for uid in match.uids:
+            if uid in self.agents and self.agents[uid].room_id == self.current_room_id:
+                return self.agents[uid]
+        return None
+
+    def agents_in(self, room_id: Optional[str]) -> List[Agent]:
+        return [
+            self.agents[uid]
+            for uid in sorted(
+                self.agents_by_room.get(room_id, ()), key=self.agent_order.__getitem__
+            )
+        ]
 
     def render_image(self, prompt: str):
         display_image_for_prompt(prompt)
@@ -521,9 +753,7 @@ After a few moments, the short conversation is over and June turns back to face
 
         self.print_header()
         self.play_sections(self.current_room.descriptions["Long"], markdown=True)
-        display_image_for_prompt(
-            self.current_room.descriptions["Long"][0].split("\n\n")[0]
-        )
+        display_image_for_prompt(self.current_room.image_prompt)
         self.print_footer()
 
     def look_quickly(self):
@@ -533,9 +763,7 @@ After a few moments, the short conversation is over and June turns back to face
 
         self.print_header()
         self.play_sections(self.current_room.descriptions["Short"], markdown=True)
-        display_image_for_prompt(
-            self.current_room.descriptions["Long"][0].split("\n\n")[0]
-        )
+        display_image_for_prompt(self.current_room.image_prompt)
         self.print_footer()
 
     @property
@@ -546,11 +774,11 @@ After a few moments, the short conversation is over and June turns back to face
             else:
                 return "Boarding the cruise ship."
         if self.on_chapter == 2:
-            if "my_stateroom" not in world.visited_rooms:
+            if "my_stateroom" not in self.visited_rooms:
                 return "Exploring the Fortuna"
-            elif "VIP Pass" not in world.inventory:
+            elif "VIP Pass" not in self.inventory:
                 return "Opening my safe"
-            elif world.current_room_id != "vip_lounge":
+            elif self.current_room_id != "vip_lounge":
                 return "Making my way to the VIP Room"
             else:
                 return "Chatting with other VIPs"
@@ -562,7 +790,7 @@ After a few moments, the short conversation is over and June turns back to face
             else:
                 return "Looking for an officer keycard"
         if self.on_chapter == 6:
-            if "owner_stateroom" not in world.visited_rooms:
+            if "owner_stateroom" not in self.visited_rooms:
                 return "Going to James Carrington's VIP room"
             else:
                 password_string = ",".join(
@@ -577,7 +805,7 @@ After a few moments, the short conversation is over and June turns back to face
 
     def print_goal(self):
         if self.current_quest is not None:
-            console.print(
+            console.goal(
                 "Your current goal is: " + self.current_quest, style="bright_blue bold"
             )
 
@@ -615,10 +843,7 @@ After a few moments, the short conversation is over and June turns back to face
 
     @property
     def agents_in_room(self) -> List[Agent]:
-        def is_in_room(agent: Agent):
-            return agent.room_id == self.current_room_id
-
-        return list(filter(is_in_room, self.agents.values()))
+        return self.agents_in(self.current_room_id)
 
     def print_agents(self):
         agent_text = [
@@ -634,22 +859,23 @@ After a few moments, the short conversation is over and June turns back to face
 
         return describe_character(agent)
 
-    def act_on(self, verb: str, look_object: str) -> bool:
+    def look_at_agent(self, agent: Agent):
         from gptif.converse import describe_character
 
+        record_use(DESCRIPTION_KIND, agent.uid)
+        description = describe_character(agent)
+        display_image_for_prompt(portrait_prompt(description))
+        self.play_sections([description])
+
+    def act_on(self, verb: str, look_object: str) -> bool:
         look_object_root = look_object.split(" ")[-1]
 
         # Check if we are looking at a person
         if verb == "look":
-            for agent in self.agents_in_room:
-                if agent.answers_to_name(look_object_root):
-                    if agent.room_id == self.current_room_id:
-                        description = describe_character(agent)
-                        display_image_for_prompt(
-                            "Portrait of character with description: " + description
-                        )
-                        self.play_sections([description])
-                        return True
+            agent = self.agent_in_room_called(look_object_root, fuzzy=False)
+            if agent is not None:
+                self.look_at_agent(agent)
+                return True
 
         hypernyms_set = get_hypernyms_set(look_object_root)
         # Loop through all scenery in the room, looking for a match
@@ -672,11 +898,16 @@ After a few moments, the short conversation is over and June turns back to face
                 if scenery_action is not None:
                     self.play_sections(scenery.actions[scenery_action], "yellow")
                     if verb == "look":
-                        display_image_for_prompt(
-                            scenery.actions[scenery_action][0].split("\n\n")[0]
-                        )
+                        display_image_for_prompt(scenery.image_prompt_for(scenery_action))
                     return True
 
+        if verb == "look":
+            # Scenery didn't match either, maybe it's a person's name with a typo
+            agent = self.agent_in_room_called(look_object_root, fuzzy=True)
+            if agent is not None:
+                self.look_at_agent(agent)
+                return True
+
         if verb == "look" and gptif.settings.FAKE_SCENERY:
             from gptif.converse import generate_fake_scenery
 
@@ -767,12 +998,12 @@ Nancy beams a large smile to you.  She has a smile that can make boulders give u
 
     def start_chapter_one(self):
         self.active_agents = set(["taxi_driver", "port_security_officer"])
-        self.current_room_id = "driving_to_terminal"
+        self.current_room_id = START_ROOM_ID
         self.time_in_room = 0
         self.on_chapter = 1
         self.time_in_chapter = 0
 
-        with open("data/start_ch1.md", "r") as fp:
+        with open(CHAPTER_PATHS[1], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
@@ -789,7 +1020,7 @@ Nancy beams a large smile to you.  She has a smile that can make boulders give u
         self.on_chapter = 2
         self.time_in_chapter = 0
 
-        with open("data/start_ch2.md", "r") as fp:
+        with open(CHAPTER_PATHS[2], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
@@ -808,7 +1039,7 @@ Nancy beams a large smile to you.  She has a smile that can make boulders give u
         self.on_chapter = 3
         self.time_in_chapter = 0
 
-        with open("data/start_ch3.md", "r") as fp:
+        with open(CHAPTER_PATHS[3], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
@@ -820,21 +1051,21 @@ Nancy beams a large smile to you.  She has a smile that can make boulders give u
         self.on_chapter = 5
         self.time_in_chapter = 0
 
-        with open("data/start_ch5.md", "r") as fp:
+        with open(CHAPTER_PATHS[5], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
         # Move some agents around
-        self.agents["vip_reporter"].room_id = "pool_deck"
-        self.agents["ex_convict"].room_id = "gym"
-        self.agents["research_scientist"].room_id = "theater"
-        self.agents["tour_guide"].room_id = None
+        self.move_agent(self.agents["vip_reporter"], self.rooms["pool_deck"])
+        self.move_agent(self.agents["ex_convict"], self.rooms["gym"])
+        self.move_agent(self.agents["research_scientist"], self.rooms["theater"])
+        self.move_agent(self.agents["tour_guide"], None)
 
     def start_ch6(self):
         self.on_chapter = 6
         self.time_in_chapter = 0
 
-        with open("data/start_ch6.md", "r") as fp:
+        with open(CHAPTER_PATHS[6], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
@@ -842,7 +1073,7 @@ Nancy beams a large smile to you.  She has a smile that can make boulders give u
         self.on_chapter = 7
         self.time_in_chapter = 0
 
-        with open("data/start_ch7.md", "r") as fp:
+        with open(CHAPTER_PATHS[7], "r") as fp:
             sections = fp.read().split("{{< pagebreak >}}")
             self.play_sections(sections, insert_pauses=True)
 
@@ -885,24 +1116,36 @@ class ScriptId(IntEnum):
 
 
 class MovementScript:
-    def step(self, agent: Agent):
+    def step(self, world: World, agent: Agent):
         raise NotImplementedError()
 
+    def event_times(self, chapter: int) -> Iterable[int]:
+        """The time_in_chapter values when step() can do something."""
+        return ()
+
 
 class TourGuideMovementScript(MovementScript):
+    # time_in_chapter -> direction the tour goes in chapter 4
+    TIME_MOVEMENT_MAP = {
+        3: "down",
+        6: "down",
+        9: "down",
+        12: "down",
+        15: "down",
+        18: "north",
+    }
+
     def __init__(self):
         pass
 
-    def step(self, agent: Agent):
+    def event_times(self, chapter: int) -> Iterable[int]:
+        if chapter == 4:
+            return TourGuideMovementScript.TIME_MOVEMENT_MAP.keys()
+        return ()
+
+    def step(self, world: World, agent: Agent):
         if world.on_chapter == 4:
-            time_movement_map = {
-                3: "down",
-                6: "down",
-                9: "down",
-                12: "down",
-                15: "down",
-                18: "north",
-            }
+            time_movement_map = TourGuideMovementScript.TIME_MOVEMENT_MAP
             if world.time_in_chapter in time_movement_map:
                 direction = time_movement_map[world.time_in_chapter]
                 if world.time_in_chapter < 7:
@@ -978,7 +1221,12 @@ class Movement:
             script = TourGuideMovementScript()
         return Movement(yaml["starting_room"], script_id, script)
 
-    def step(self, agent: Agent):
+    def step(self, world: World, agent: Agent):
         if self.script is None:
             return
-        self.script.step(agent)
+        self.script.step(world, agent)
+
+    def event_times(self, chapter: int) -> Iterable[int]:
+        if self.script is None:
+            return ()
+        return self.script.event_times(chapter)